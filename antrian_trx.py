@@ -0,0 +1,55 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import TRX_WORKERS, TRX_QUEUE_MAX
+
+logger = logging.getLogger(__name__)
+
+# Executor khusus untuk panggilan provider yang lambat (create_trx), supaya worker
+# dispatcher Telegram tidak ikut tertahan. Antrian dibatasi TRX_QUEUE_MAX; jika
+# penuh, submit() langsung menolak agar transaksi tidak menumpuk tanpa batas.
+
+class AntrianPenuh(Exception):
+    """Antrian transaksi penuh, transaksi baru ditolak."""
+
+_executor = ThreadPoolExecutor(max_workers=TRX_WORKERS, thread_name_prefix="trx")
+_lock = threading.Lock()
+_stat = {"antri": 0, "jalan": 0, "selesai": 0, "error": 0, "ditolak": 0}
+
+def _jalankan(fn, args, kwargs):
+    with _lock:
+        _stat["antri"] -= 1
+        _stat["jalan"] += 1
+    try:
+        return fn(*args, **kwargs)
+    except Exception:
+        with _lock:
+            _stat["error"] += 1
+        logger.exception(f"[ANTRIAN] Error menjalankan {getattr(fn, '__name__', fn)}")
+        raise
+    finally:
+        with _lock:
+            _stat["jalan"] -= 1
+            _stat["selesai"] += 1
+
+def submit(fn, *args, **kwargs):
+    """Jalankan fn(*args, **kwargs) di executor transaksi. Raise AntrianPenuh jika antrian penuh."""
+    with _lock:
+        if _stat["antri"] >= TRX_QUEUE_MAX:
+            _stat["ditolak"] += 1
+            raise AntrianPenuh(f"Antrian transaksi penuh ({TRX_QUEUE_MAX})")
+        _stat["antri"] += 1
+    try:
+        return _executor.submit(_jalankan, fn, args, kwargs)
+    except Exception:
+        with _lock:
+            _stat["antri"] -= 1
+        raise
+
+def statistik():
+    """Snapshot jumlah transaksi di antrian, sedang diproses, dsb."""
+    with _lock:
+        return dict(_stat, workers=TRX_WORKERS, kapasitas_antrian=TRX_QUEUE_MAX)
+
+def shutdown(wait=True):
+    _executor.shutdown(wait=wait)
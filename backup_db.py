@@ -1,12 +1,13 @@
-import shutil
 import os
 from datetime import datetime
+import db
 
-def backup_sqlite(dbfile='botdata.db', backup_dir='backup'):
+def backup_sqlite(backup_dir='backup'):
+    # Pakai backup API SQLite, bukan copy file: dalam mode WAL data terbaru bisa masih di file -wal
     os.makedirs(backup_dir, exist_ok=True)
     date = datetime.now().strftime("%Y%m%d_%H%M%S")
     dst = f"{backup_dir}/botdata_{date}.db"
-    shutil.copy(dbfile, dst)
+    db.backup(dst)
     print(f"Backup selesai ke {dst}")
 
 if __name__ == "__main__":
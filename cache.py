@@ -0,0 +1,30 @@
+import threading
+from collections import OrderedDict
+
+# Cache generik yang dipakai beberapa modul (QRIS per nominal, status final cek_status).
+
+class LRUCache:
+    """Cache LRU sederhana yang aman dipakai dari banyak thread."""
+
+    def __init__(self, maxsize: int = 64):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            return self._data.pop(key, None)
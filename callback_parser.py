@@ -0,0 +1,180 @@
+import re
+import time
+
+# Parser callback provider tanpa regex backtracking. Format pesan:
+#
+#   RC=<reffid> TrxID=<angka> <PRODUK>.<tujuan> <Status> <keterangan> [Saldo ...] [result=<kode>] [>]
+#
+# Pesan dipecah per token dari kiri ke kanan; setiap langkah hanya memindai
+# sebagian pesan sekali, jadi waktu parse linear terhadap panjang pesan.
+# Jika gagal, CallbackTidakValid membawa alasan yang jelas (bukan sekadar
+# "format tidak dikenali").
+
+MAX_PANJANG = 4096
+
+_HEX_REFID = frozenset("0123456789abcdefABCDEF-")
+_SALDO = re.compile(r"\ssaldo", re.I)  # literal sederhana, tanpa backtracking
+
+class CallbackTidakValid(ValueError):
+    """Pesan callback tidak sesuai format; atribut `alasan` berisi penyebabnya."""
+
+    def __init__(self, alasan):
+        super().__init__(alasan)
+        self.alasan = alasan
+
+def _ambil_token(message, pos):
+    """Lewati spasi, return (token, posisi setelah token)."""
+    n = len(message)
+    while pos < n and message[pos].isspace():
+        pos += 1
+    awal = pos
+    while pos < n and not message[pos].isspace():
+        pos += 1
+    return message[awal:pos], pos
+
+def _nilai_prefix(token, prefix, nama):
+    if token[:len(prefix)].lower() != prefix.lower():
+        raise CallbackTidakValid(f"token {nama} harus diawali '{prefix}', dapat '{token[:20]}'")
+    nilai = token[len(prefix):]
+    if not nilai:
+        raise CallbackTidakValid(f"{nama} kosong")
+    return nilai
+
+def parse_callback(message):
+    """
+    Parse pesan callback provider. Return dict reffid, trxid, produk, tujuan,
+    status_text, keterangan, status_code (None jika tidak ada).
+    Raise CallbackTidakValid jika format salah.
+    """
+    if not message or not message.strip():
+        raise CallbackTidakValid("pesan kosong")
+    if len(message) > MAX_PANJANG:
+        raise CallbackTidakValid(f"pesan terlalu panjang ({len(message)} > {MAX_PANJANG} karakter)")
+
+    token, pos = _ambil_token(message, 0)
+    reffid = _nilai_prefix(token, "RC=", "RC")
+    if not all(c in _HEX_REFID for c in reffid):
+        raise CallbackTidakValid(f"RC bukan refid hex: '{reffid[:40]}'")
+
+    token, pos = _ambil_token(message, pos)
+    trxid = _nilai_prefix(token, "TrxID=", "TrxID")
+    if not trxid.isdigit():
+        raise CallbackTidakValid(f"TrxID bukan angka: '{trxid[:20]}'")
+
+    token, pos = _ambil_token(message, pos)
+    produk, titik, tujuan = token.partition(".")
+    if not titik:
+        raise CallbackTidakValid(f"token produk.tujuan tidak mengandung '.': '{token[:40]}'")
+    if not produk or not produk.isascii() or not produk.isalnum():
+        raise CallbackTidakValid(f"kode produk tidak valid: '{produk[:20]}'")
+    if not tujuan.isdigit():
+        raise CallbackTidakValid(f"nomor tujuan bukan angka: '{tujuan[:20]}'")
+
+    # Status = huruf di awal token berikutnya; sisa token ikut ke keterangan
+    n = len(message)
+    while pos < n and message[pos].isspace():
+        pos += 1
+    awal = pos
+    while pos < n and message[pos].isascii() and message[pos].isalpha():
+        pos += 1
+    status_text = message[awal:pos]
+    if not status_text:
+        raise CallbackTidakValid("status tidak ditemukan setelah produk.tujuan")
+
+    sisa = message[pos:].rstrip()
+    if sisa.endswith(">"):
+        sisa = sisa[:-1].rstrip()
+
+    status_code = None
+    idx = sisa.rfind("result=")
+    if idx != -1:
+        kode = sisa[idx + len("result="):]
+        sebelum = sisa[idx - 1] if idx > 0 else " "
+        if kode.isdigit() and not (sebelum.isalnum() or sebelum == "_"):
+            status_code = kode
+            sisa = sisa[:idx]
+
+    # Bagian "Saldo ..." (info saldo provider) tidak ikut keterangan
+    saldo = _SALDO.search(sisa, 1)
+    if saldo:
+        sisa = sisa[:saldo.start()]
+
+    return {
+        "reffid": reffid,
+        "trxid": trxid,
+        "produk": produk,
+        "tujuan": tujuan,
+        "status_text": status_text,
+        "keterangan": sisa.strip(),
+        "status_code": status_code,
+    }
+
+# ========== FUZZ & BENCHMARK (python callback_parser.py) ==========
+
+CONTOH_VALID = [
+    "RC=0d3f1c2a-9b1e-4c55-8f0a-7b2d4e6f8a90 TrxID=123456 BPAL1.081234567890 Sukses SN: 1234567890 Saldo 1.000.000 - 5.000 = 995.000 result=0",
+    "RC=0d3f1c2a-9b1e-4c55-8f0a-7b2d4e6f8a90 TrxID=123457 XLA14.081234567890 Gagal Nomor tidak valid result=1 >",
+    "RC=0d3f1c2a-9b1e-4c55-8f0a-7b2d4e6f8a90 TrxID=123458 bpaxxl7.6281234567890 Batal Stok habis, saldo dikembalikan",
+    "RC=abcdef TrxID=1 XLA89.0812 Proses sedang diproses\nSaldo 500.000",
+]
+
+CONTOH_ADVERSARIAL = [
+    "",
+    "   ",
+    "RC= TrxID=1 A.1 Sukses x",
+    "RC=zzzz TrxID=1 A.1 Sukses x",
+    "RC=abc TrxID=x1 A.1 Sukses x",
+    "RC=abc TrxID=1 A1 Sukses x",
+    "RC=abc TrxID=1 A.1x Sukses x",
+    "RC=abc TrxID=1 A.1 123",
+    "RC=" + "a" * 3000 + " TrxID=1 A.1 Sukses " + " Saldo" * 100,
+    "RC=abc TrxID=1 A.1 Sukses " + " " * 3000 + "result=",
+    "RC=abc TrxID=1 A.1 Sukses " + "Saldo " * 600 + "result=1",
+    "x" * (MAX_PANJANG + 1),
+]
+
+def _fuzz(jumlah=20000, seed=1):
+    import random
+    rnd = random.Random(seed)
+    alfabet = "RCTrxID=.0123456789abcdef- \n>SaldoresultSuksesGagal"
+    terburuk = 0.0
+    for _ in range(jumlah):
+        if rnd.random() < 0.5:
+            dasar = rnd.choice(CONTOH_VALID)
+            pesan = list(dasar)
+            for _ in range(rnd.randint(1, 5)):
+                pesan.insert(rnd.randrange(len(pesan) + 1), rnd.choice(alfabet))
+            pesan = "".join(pesan)
+        else:
+            pesan = "".join(rnd.choice(alfabet) for _ in range(rnd.randint(0, 400)))
+        t0 = time.perf_counter()
+        try:
+            hasil = parse_callback(pesan)
+            assert hasil["reffid"] and hasil["trxid"].isdigit() and hasil["tujuan"].isdigit()
+        except CallbackTidakValid as e:
+            assert e.alasan
+        terburuk = max(terburuk, time.perf_counter() - t0)
+    return terburuk
+
+def _bench(pesan, ulang=2000):
+    t0 = time.perf_counter()
+    for _ in range(ulang):
+        try:
+            parse_callback(pesan)
+        except CallbackTidakValid:
+            pass
+    return (time.perf_counter() - t0) / ulang * 1e6
+
+if __name__ == "__main__":
+    for pesan in CONTOH_VALID:
+        print(parse_callback(pesan))
+    for pesan in CONTOH_ADVERSARIAL:
+        try:
+            parse_callback(pesan)
+            print(f"OK      {pesan[:50]!r}")
+        except CallbackTidakValid as e:
+            print(f"DITOLAK {pesan[:50]!r}: {e.alasan}")
+    print(f"Fuzz selesai, parse terlama {_fuzz() * 1e6:.1f} µs")
+    for ukuran in (100, 1000, 4000):
+        pesan = "RC=abc TrxID=1 A.1 Sukses " + ("x Saldo " * ukuran)[:ukuran] + " result=1"
+        print(f"Benchmark {len(pesan):>5} karakter: {_bench(pesan):.1f} µs/parse")
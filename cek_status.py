@@ -0,0 +1,103 @@
+import time
+import threading
+from concurrent.futures import Future
+import db
+import riwayat_log
+from provider import history
+from cache import LRUCache
+
+# Cek status transaksi (CEK|refid) dengan urutan:
+#   1. transaksi final di penyimpanan lokal (riwayat_log / tabel riwayat)
+#   2. LRU status final yang pernah didapat dari provider
+#   3. cache singkat (TTL_SEMENTARA) untuk status yang belum final
+#   4. provider.history; permintaan bersamaan untuk refid yang sama
+#      menunggu satu panggilan yang sama (request coalescing)
+
+TTL_SEMENTARA = 15  # detik
+FINAL_CACHE_SIZE = 5000
+TUNGGU_MAKS = 30  # detik, batas menunggu panggilan history milik request lain
+
+_final_cache = LRUCache(FINAL_CACHE_SIZE)  # refid -> data history berstatus final
+_sementara = {}  # refid -> (kadaluarsa monotonic, data history)
+_sedang_jalan = {}  # refid -> Future hasil history yang sedang dipanggil
+_lock = threading.Lock()
+
+def status_dari_history(data):
+    """Ambil (status_text, keterangan) dari respon provider.history; status None jika tidak terbaca."""
+    if not isinstance(data, dict) or data.get("status") == "error":
+        return None, ""
+    isi = data.get("data", data)
+    if isinstance(isi, list):
+        isi = isi[0] if isi else {}
+    if not isinstance(isi, dict):
+        return None, ""
+    status = isi.get("status_text") or isi.get("status")
+    if not isinstance(status, str) or not status.strip():
+        return None, ""
+    return status.strip().lower(), str(isi.get("keterangan") or isi.get("message") or "")
+
+def tidak_ditemukan(data):
+    """True jika provider.history menjawab bahwa transaksi tidak ada (bukan karena request gagal)."""
+    if not isinstance(data, dict) or data.get("gangguan"):
+        return False
+    pesan = str(data.get("message") or data.get("keterangan") or "").lower()
+    return "tidak ditemukan" in pesan or "not found" in pesan
+
+def _dari_lokal(refid):
+    trx = riwayat_log.get(refid)
+    if trx and db.status_final(trx.get("status_text")):
+        return {
+            "refid": refid,
+            "produk": trx.get("produk", ""),
+            "tujuan": trx.get("tujuan", ""),
+            "status": trx.get("status_text", ""),
+            "keterangan": trx.get("keterangan", ""),
+            "waktu": trx.get("waktu", ""),
+        }
+    r = db.get_riwayat_by_refid(refid)
+    if r and db.status_final(r[6]):
+        return {"refid": r[0], "produk": r[2], "tujuan": r[3], "status": r[6], "keterangan": r[7], "waktu": r[5]}
+    return None
+
+def _panggil_history(refid):
+    """Satu panggilan history per refid pada satu waktu; pemanggil lain menunggu hasil yang sama."""
+    with _lock:
+        future = _sedang_jalan.get(refid)
+        pemimpin = future is None
+        if pemimpin:
+            future = _sedang_jalan[refid] = Future()
+    if not pemimpin:
+        return future.result(timeout=TUNGGU_MAKS)
+    try:
+        data = history(refid)
+        status, _ = status_dari_history(data)
+        if status and db.status_final(status):
+            _final_cache.set(refid, data)
+        elif status:
+            with _lock:
+                _sementara[refid] = (time.monotonic() + TTL_SEMENTARA, data)
+        future.set_result(data)
+        return data
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _lock:
+            _sedang_jalan.pop(refid, None)
+
+def cek_status(refid):
+    """Return (data, sumber) dengan sumber "lokal", "cache" atau "provider"."""
+    data = _dari_lokal(refid)
+    if data:
+        return data, "lokal"
+    data = _final_cache.get(refid)
+    if data:
+        return data, "cache"
+    now = time.monotonic()
+    with _lock:
+        for r in [r for r, (kadaluarsa, _) in _sementara.items() if kadaluarsa <= now]:
+            del _sementara[r]
+        simpan = _sementara.get(refid)
+    if simpan:
+        return simpan[1], "cache"
+    return _panggil_history(refid), "provider"
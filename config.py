@@ -4,7 +4,7 @@ with open("config.json") as f:
     cfg = json.load(f)
 
 TOKEN = cfg["TOKEN"]
-ADMIN_IDS = [int(x) for x in cfg["ADMIN_IDS"]]  # pastikan tipe integer
+ADMIN_IDS = frozenset(int(x) for x in cfg["ADMIN_IDS"])  # pastikan tipe integer; dibaca ulang oleh peran.py
 API_KEY = cfg["API_KEY"]
 BASE_URL = cfg["BASE_URL"]
 BASE_URL_AKRAB = cfg.get("BASE_URL_AKRAB", "")
@@ -15,3 +15,25 @@ TOPUP_FILE = 'topup_user.json'
 QRIS_STATIS = cfg["QRIS_STATIS"]
 WEBHOOK_URL = cfg.get("WEBHOOK_URL", "")
 WEBHOOK_PORT = cfg.get("WEBHOOK_PORT", 5000)
+STOK_TTL = cfg.get("STOK_TTL", 60)  # detik, umur maksimal snapshot stok provider
+STOK_REFRESH_INTERVAL = cfg.get("STOK_REFRESH_INTERVAL", 30)  # detik, interval refresh stok di background
+KATALOG_SYNC_INTERVAL = cfg.get("KATALOG_SYNC_INTERVAL", 3600)  # detik, interval sinkron katalog dari provider.list_product
+RIWAYAT_LOG_FILE = 'riwayat_transaksi.jsonl'  # log transaksi append-only (satu JSON per baris)
+DB_FILE = cfg.get("DB_FILE", "botdata.db")  # database SQLite (users, riwayat, topup_pending)
+TRX_WORKERS = cfg.get("TRX_WORKERS", 8)  # thread khusus pemanggilan create_trx ke provider
+TRX_QUEUE_MAX = cfg.get("TRX_QUEUE_MAX", 100)  # maksimal transaksi menunggu di antrian
+BOT_MODE = cfg.get("BOT_MODE", "polling")  # "polling" atau "webhook" (update Telegram lewat Flask di webhook.py)
+WEBHOOK_LISTEN = cfg.get("WEBHOOK_LISTEN", "127.0.0.1")  # alamat Flask (di belakang nginx)
+TELEGRAM_WEBHOOK_SECRET = cfg.get("TELEGRAM_WEBHOOK_SECRET", "")  # path rahasia: /telegram/<secret>
+TELEGRAM_WEBHOOK_URL = cfg.get("TELEGRAM_WEBHOOK_URL", "")  # URL publik https untuk setWebhook (tanpa /<secret>)
+WEBHOOK_CERT = cfg.get("WEBHOOK_CERT", "")  # sertifikat self-signed (opsional, tanpa nginx)
+WEBHOOK_KEY = cfg.get("WEBHOOK_KEY", "")
+CALLBACK_BATCH_WINDOW = cfg.get("CALLBACK_BATCH_WINDOW", 0.05)  # detik, jendela pengumpulan callback provider per batch
+CALLBACK_BATCH_MAX = cfg.get("CALLBACK_BATCH_MAX", 200)  # maksimal callback per transaksi DB
+REKON_INTERVAL = cfg.get("REKON_INTERVAL", 120)  # detik, interval job rekonsiliasi transaksi pending
+REKON_UMUR_MENIT = cfg.get("REKON_UMUR_MENIT", 10)  # transaksi pending lebih lama dari ini dicek ke provider.history
+REKON_WORKERS = cfg.get("REKON_WORKERS", 4)  # maksimal request history bersamaan
+REKON_PER_DETIK = cfg.get("REKON_PER_DETIK", 5)  # maksimal request history per detik
+REKON_BATCH = cfg.get("REKON_BATCH", 50)  # maksimal transaksi dicek per putaran
+REKON_MAKS_UMUR_JAM = cfg.get("REKON_MAKS_UMUR_JAM", 48)  # pending lebih lama dari ini: refund hanya jika provider menjawab gagal/tidak ditemukan, selain itu CEK MANUAL
+HOLD_MAKS_MENIT = cfg.get("HOLD_MAKS_MENIT", 30)  # hold saldo yang tidak di-capture/release selama ini diselesaikan oleh job
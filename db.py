@@ -1,409 +1,558 @@
 import json
-from telegram import Update, ParseMode, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import CallbackContext, ConversationHandler, MessageHandler, Filters, CallbackQueryHandler
-from provider import create_trx, history, cek_stock_akrab
-from provider_qris import generate_qris
-from markup import get_menu, produk_inline_keyboard, admin_edit_produk_keyboard, is_admin
-from produk import get_produk_list, edit_produk, get_produk_by_kode
-import db  # Import database Anda
-
-CHOOSING_PRODUK, INPUT_TUJUAN, KONFIRMASI, TOPUP_NOMINAL, ADMIN_EDIT = range(5)
-
-def start(update: Update, context: CallbackContext):
-    user = update.effective_user
-    # Tambahkan user ke database jika belum ada
-    db.tambah_user(user.id, user.username or "", user.full_name)
-    
-    update.message.reply_text(
-        f"Halo <b>{user.first_name}</b>!\nGunakan menu di bawah.",
-        parse_mode=ParseMode.HTML,
-        reply_markup=get_menu(user.id)
-    )
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from config import DB_FILE
 
-def main_menu_callback(update: Update, context: CallbackContext):
-    query = update.callback_query
-    user = query.from_user
-    data = query.data
-    query.answer()
-    
-    # Pastikan user ada di database
-    db.tambah_user(user.id, user.username or "", user.full_name)
-    
-    if data == 'lihat_produk':
-        produk_list = get_produk_list()
-        msg = "<b>Daftar Produk:</b>\n"
-        for p in produk_list:
-            msg += f"<code>{p['kode']}</code> | {p['nama']} | <b>Rp {p['harga']:,}</b> | Kuota: {p['kuota']}\n"
-        query.edit_message_text(msg, parse_mode=ParseMode.HTML, reply_markup=get_menu(user.id))
-    elif data == 'beli_produk':
-        query.edit_message_text("Pilih produk yang ingin dibeli:", reply_markup=produk_inline_keyboard())
-        context.user_data.clear()
-        return CHOOSING_PRODUK
-    elif data == 'topup':
-        query.edit_message_text(
-            "Masukkan nominal Top Up saldo yang diinginkan (minimal 10.000):",
-            parse_mode=ParseMode.HTML, reply_markup=get_menu(user.id))
-        return TOPUP_NOMINAL
-    elif data == 'cek_status':
-        query.edit_message_text("Kirim format: <code>CEK|refid</code>", parse_mode=ParseMode.HTML, reply_markup=get_menu(user.id))
-    elif data == 'riwayat':
-        riwayat_user(query, context)
-    elif data == 'stock_akrab':
-        raw = cek_stock_akrab()
-        msg = format_stock_akrab(raw)
-        if isinstance(msg, str) and msg.strip().lower().startswith("<html"):
-            msg = "❌ Provider membalas data tidak valid."
-        query.edit_message_text(msg, parse_mode=ParseMode.HTML, reply_markup=get_menu(user.id))
-    elif data == 'semua_riwayat' and is_admin(user.id):
-        semua_riwayat(query, context)
-    elif data == 'lihat_saldo' and is_admin(user.id):
-        # Ambil saldo dari database
-        saldo = db.get_saldo(user.id)
-        query.edit_message_text(f"Saldo Anda: <b>Rp {saldo:,}</b>", parse_mode=ParseMode.HTML, reply_markup=get_menu(user.id))
-    elif data == 'tambah_saldo' and is_admin(user.id):
-        query.edit_message_text("Kirim format: <code>TAMBAH|jumlah</code>", parse_mode=ParseMode.HTML, reply_markup=get_menu(user.id))
-    elif data == 'manajemen_produk' and is_admin(user.id):
-        produk_list = get_produk_list()
-        msg = "<b>Manajemen Produk:</b>\n"
-        keyboard = []
-        for p in produk_list:
-            keyboard.append([InlineKeyboardButton(f"{p['kode']} | {p['nama']}", callback_data=f"admin_edit_produk|{p['kode']}")])
-        keyboard.append([InlineKeyboardButton("⬅️ Kembali", callback_data="back_admin")])
-        query.edit_message_text(msg, parse_mode=ParseMode.HTML, reply_markup=InlineKeyboardMarkup(keyboard))
-    elif data.startswith("admin_edit_produk|") and is_admin(user.id):
-        kode = data.split("|")[1]
-        p = get_produk_by_kode(kode)
-        if not p:
-            query.edit_message_text("Produk tidak ditemukan.", reply_markup=get_menu(user.id))
-            return ConversationHandler.END
-        msg = (f"<b>Edit Produk {p['kode']}:</b>\n"
-               f"Nama: {p['nama']}\nHarga: Rp {p['harga']:,}\nKuota: {p['kuota']}\nDeskripsi: {p['deskripsi']}\n\n"
-               "Pilih field yang ingin diedit:")
-        query.edit_message_text(msg, parse_mode=ParseMode.HTML, reply_markup=admin_edit_produk_keyboard(kode))
-        context.user_data["edit_kode"] = kode
-        return ADMIN_EDIT
-    elif data == "back_admin":
-        query.edit_message_text("Kembali ke menu admin.", reply_markup=get_menu(user.id))
-    else:
-        query.edit_message_text("Menu tidak dikenal.", reply_markup=get_menu(user.id))
-    return ConversationHandler.END
-
-def admin_edit_callback(update: Update, context: CallbackContext):
-    query = update.callback_query
-    user = query.from_user
-    data = query.data
-    query.answer()
-    
-    if not is_admin(user.id):
-        query.edit_message_text("Akses ditolak.", reply_markup=get_menu(user.id))
-        return ConversationHandler.END
-        
-    if data.startswith("editharga|"):
-        kode = data.split("|")[1]
-        context.user_data["edit_kode"] = kode
-        context.user_data["edit_field"] = "harga"
-        query.edit_message_text(f"Masukkan harga baru untuk produk <b>{kode}</b> (angka):", parse_mode="HTML")
-        return ADMIN_EDIT
-        
-    elif data.startswith("editkuota|"):
-        query.edit_message_text("Stok produk mengikuti provider dan tidak bisa diedit manual.", reply_markup=get_menu(user.id))
-        return ConversationHandler.END
-        
-    elif data.startswith("editdeskripsi|"):
-        kode = data.split("|")[1]
-        context.user_data["edit_kode"] = kode
-        context.user_data["edit_field"] = "deskripsi"
-        query.edit_message_text(f"Masukkan deskripsi baru untuk produk <b>{kode}</b>:", parse_mode="HTML")
-        return ADMIN_EDIT
-        
+logger = logging.getLogger(__name__)
+
+# Satu koneksi per thread (worker Updater, thread Flask webhook, dsb).
+# Mode WAL membuat pembaca tidak menunggu penulis, dan busy_timeout membuat
+# penulis yang bentrok menunggu sebentar alih-alih langsung "database is locked".
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA foreign_keys=ON",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",
+)
+
+# Status transaksi dari provider (dicocokkan sebagai substring, huruf kecil)
+STATUS_FINAL = ("sukses", "gagal", "batal")
+STATUS_REFUND = ("gagal", "batal")
+# Belum final, tapi rekonsiliasi tidak lagi mengeceknya otomatis (perlu dicek admin)
+STATUS_CEK_MANUAL = "CEK MANUAL"
+_SQL_BELUM_FINAL = " AND ".join(f"lower(status_text) NOT LIKE '%{s}%'" for s in STATUS_FINAL)
+
+SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT NOT NULL DEFAULT '',
+        nama TEXT NOT NULL DEFAULT '',
+        saldo INTEGER NOT NULL DEFAULT 0,
+        created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        last_seen REAL
+    )""",
+    """CREATE TABLE IF NOT EXISTS riwayat (
+        reffid TEXT PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        produk TEXT NOT NULL,
+        tujuan TEXT NOT NULL,
+        harga INTEGER NOT NULL,
+        waktu TEXT NOT NULL DEFAULT '',
+        status_text TEXT NOT NULL DEFAULT 'pending',
+        keterangan TEXT NOT NULL DEFAULT '',
+        created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_riwayat_user ON riwayat(user_id)",
+    # Partial index: hanya transaksi yang belum final (dipakai rekonsiliasi)
+    f"CREATE INDEX IF NOT EXISTS idx_riwayat_pending ON riwayat(created_at) WHERE {_SQL_BELUM_FINAL}",
+    """CREATE TABLE IF NOT EXISTS webhook_event (
+        reffid TEXT NOT NULL,
+        trxid TEXT NOT NULL,
+        status TEXT NOT NULL,
+        created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (reffid, trxid, status)
+    )""",
+    """CREATE TABLE IF NOT EXISTS saldo_hold (
+        id TEXT PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        jumlah INTEGER NOT NULL,
+        status TEXT NOT NULL DEFAULT 'hold',
+        created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_hold_status ON saldo_hold(status)",
+    """CREATE TABLE IF NOT EXISTS saldo_mutasi (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        jumlah INTEGER NOT NULL,
+        jenis TEXT NOT NULL,
+        ref TEXT NOT NULL DEFAULT '',
+        waktu TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_mutasi_user ON saldo_mutasi(user_id)",
+    """CREATE TABLE IF NOT EXISTS topup_pending (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        username TEXT NOT NULL DEFAULT '',
+        nama TEXT NOT NULL DEFAULT '',
+        nominal INTEGER NOT NULL,
+        waktu TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        status TEXT NOT NULL DEFAULT 'pending',
+        bukti_file_id TEXT,
+        bukti_caption TEXT
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_topup_user ON topup_pending(user_id)",
+    "CREATE INDEX IF NOT EXISTS idx_topup_status ON topup_pending(status)",
+    """CREATE TABLE IF NOT EXISTS notif_queue (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER NOT NULL,
+        teks TEXT NOT NULL,
+        parse_mode TEXT,
+        status TEXT NOT NULL DEFAULT 'pending',
+        percobaan INTEGER NOT NULL DEFAULT 0,
+        next_at REAL NOT NULL DEFAULT 0,
+        error TEXT NOT NULL DEFAULT '',
+        created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_notif_siap ON notif_queue(status, next_at)",
+    """CREATE TABLE IF NOT EXISTS katalog_produk (
+        kode TEXT PRIMARY KEY,
+        nama TEXT NOT NULL DEFAULT '',
+        harga INTEGER NOT NULL DEFAULT 0,
+        deskripsi TEXT NOT NULL DEFAULT '',
+        aktif INTEGER NOT NULL DEFAULT 1,
+        updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_katalog_aktif ON katalog_produk(aktif)",
+    # Urutan tampil katalog disimpan terpisah (satu baris JSON), agar produk yang
+    # disisipkan di awal daftar provider tidak membuat semua baris lain ditulis ulang
+    """CREATE TABLE IF NOT EXISTS katalog_meta (
+        kunci TEXT PRIMARY KEY,
+        nilai TEXT NOT NULL
+    )""",
+)
+
+# Kolom yang ditambahkan setelah tabel dibuat: (tabel, kolom, definisi)
+MIGRASI_KOLOM = (
+    ("users", "last_seen", "REAL"),
+)
+
+# Kolom riwayat dalam urutan yang dipakai handler: r[0]=reffid ... r[7]=keterangan
+RIWAYAT_COLS = "reffid, user_id, produk, tujuan, harga, waktu, status_text, keterangan"
+
+_local = threading.local()
+_init_lock = threading.Lock()
+_schema_siap = False
+
+def _init_schema(conn):
+    global _schema_siap
+    with _init_lock:
+        if _schema_siap:
+            return
+        for sql in SCHEMA:
+            conn.execute(sql)
+        for tabel, kolom, definisi in MIGRASI_KOLOM:
+            ada = {row[1] for row in conn.execute(f"PRAGMA table_info({tabel})")}
+            if kolom not in ada:
+                conn.execute(f"ALTER TABLE {tabel} ADD COLUMN {kolom} {definisi}")
+        _schema_siap = True
+
+def get_conn():
+    """Koneksi SQLite milik thread ini (dibuat sekali per thread)."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        # isolation_level=None: autocommit, transaksi dibuka eksplisit lewat transaksi()
+        conn = sqlite3.connect(DB_FILE, timeout=30, isolation_level=None, cached_statements=256)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        _init_schema(conn)
+        _local.conn = conn
+    return conn
+
+def close_conn():
+    """Tutup koneksi milik thread ini (opsional, misal saat thread selesai)."""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+@contextmanager
+def transaksi():
+    """BEGIN IMMEDIATE ... COMMIT; rollback otomatis jika terjadi error."""
+    conn = get_conn()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
     else:
-        query.edit_message_text("Perintah tidak dikenal.", reply_markup=get_menu(user.id))
-        return ConversationHandler.END
-
-def admin_edit_produk_step(update, context):
-    kode = context.user_data.get("edit_kode")
-    field = context.user_data.get("edit_field")
-    value = update.message.text.strip()
-    
-    if not kode or not field:
-        update.message.reply_text(
-            "❌ Kueri tidak valid. Silakan ulangi.",
-            reply_markup=get_menu(update.effective_user.id)
+        conn.execute("COMMIT")
+
+# ========== USERS ==========
+
+def tambah_user(user_id, username, nama):
+    """Tambah user baru, atau perbarui username/nama jika sudah ada."""
+    get_conn().execute(
+        "INSERT INTO users (user_id, username, nama) VALUES (?, ?, ?) "
+        "ON CONFLICT(user_id) DO UPDATE SET username = excluded.username, nama = excluded.nama "
+        "WHERE users.username != excluded.username OR users.nama != excluded.nama",
+        (user_id, username or "", nama or ""),
+    )
+
+def get_user_info(user_id):
+    """Return (username, nama) atau None jika user belum ada."""
+    return get_conn().execute(
+        "SELECT username, nama FROM users WHERE user_id = ?", (user_id,)
+    ).fetchone()
+
+def simpan_last_seen(daftar):
+    """Update last_seen banyak user sekaligus dalam satu transaksi. daftar = [(user_id, timestamp), ...]"""
+    if not daftar:
+        return
+    with transaksi() as conn:
+        conn.executemany(
+            "UPDATE users SET last_seen = ? WHERE user_id = ? AND (last_seen IS NULL OR last_seen < ?)",
+            [(ts, user_id, ts) for user_id, ts in daftar],
+        )
+
+def get_user(user_id):
+    """Return (user_id, username, nama, saldo) atau None."""
+    return get_conn().execute(
+        "SELECT user_id, username, nama, saldo FROM users WHERE user_id = ?", (user_id,)
+    ).fetchone()
+
+def get_saldo(user_id):
+    row = get_conn().execute("SELECT saldo FROM users WHERE user_id = ?", (user_id,)).fetchone()
+    return row[0] if row else 0
+
+# ========== SALDO (LEDGER) ==========
+# Semua perubahan saldo berupa UPDATE relatif (saldo = saldo +/- x) di dalam
+# transaksi singkat, dan setiap mutasi dicatat di saldo_mutasi. Debit bersyarat
+# ("hanya jika saldo cukup") dikerjakan oleh SQLite dalam satu statement, jadi
+# dua pembelian bersamaan tidak bisa sama-sama lolos cek saldo.
+#
+# Alur pembelian: buat_hold() sebelum memanggil provider -> capture_hold() jika
+# transaksi diterima provider, atau release_hold() (saldo kembali) jika gagal.
+
+def _catat_mutasi(conn, user_id, jumlah, jenis, ref=""):
+    conn.execute(
+        "INSERT INTO saldo_mutasi (user_id, jumlah, jenis, ref) VALUES (?, ?, ?, ?)",
+        (user_id, jumlah, jenis, ref or ""),
+    )
+
+def buat_akun_saldo(user_id, saldo_awal=0):
+    """Buat akun saldo jika belum ada (saldo awal diabaikan jika akun sudah ada). Return True jika baru dibuat."""
+    with transaksi() as conn:
+        cur = conn.execute(
+            "INSERT OR IGNORE INTO users (user_id, saldo) VALUES (?, ?)", (user_id, int(saldo_awal))
         )
-        return ConversationHandler.END
+        if cur.rowcount == 1 and saldo_awal:
+            _catat_mutasi(conn, user_id, int(saldo_awal), "saldo_awal")
+        return cur.rowcount == 1
 
-    p = get_produk_by_kode(kode)
-    if not p:
-        update.message.reply_text(
-            "❌ Produk tidak ditemukan.",
-            reply_markup=get_menu(update.effective_user.id)
+def tambah_saldo(user_id, jumlah, jenis="kredit", ref=""):
+    """Kredit saldo user, return saldo akhir."""
+    jumlah = int(jumlah)
+    with transaksi() as conn:
+        conn.execute(
+            "INSERT INTO users (user_id, saldo) VALUES (?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET saldo = saldo + excluded.saldo",
+            (user_id, jumlah),
         )
-        return ConversationHandler.END
-
-    if field == "harga":
-        try:
-            harga = int(value.replace(".", "").replace(",", ""))
-            if harga <= 0:
-                raise ValueError("Harga harus lebih dari 0.")
-            old_harga = p["harga"]
-            
-            # Simpan ke database menggunakan fungsi dari db.py
-            db.set_produk_admin_harga(kode, harga)
-            
-            p_new = get_produk_by_kode(kode)
-            update.message.reply_text(
-                f"✅ <b>Harga produk berhasil diupdate!</b>\n\n"
-                f"Produk: <b>{kode}</b> - {p_new['nama']}\n"
-                f"Harga lama: <s>Rp {old_harga:,}</s>\n"
-                f"Harga baru: <b>Rp {p_new['harga']:,}</b>\n"
-                f"Deskripsi: {p_new['deskripsi']}",
-                parse_mode="HTML",
-                reply_markup=get_menu(update.effective_user.id)
-            )
-        except Exception as e:
-            update.message.reply_text(
-                f"❌ <b>Gagal update harga produk!</b>\n"
-                f"Produk: <b>{kode}</b> - {p['nama']}\n"
-                f"Error: {e}",
-                parse_mode="HTML",
-                reply_markup=get_menu(update.effective_user.id)
-            )
-        return ConversationHandler.END
-
-    elif field == "deskripsi":
-        try:
-            old_deskripsi = p["deskripsi"]
-            
-            # Simpan ke database menggunakan fungsi dari db.py
-            db.set_produk_admin_deskripsi(kode, value)
-            
-            p_new = get_produk_by_kode(kode)
-            update.message.reply_text(
-                f"✅ <b>Deskripsi produk berhasil diupdate!</b>\n\n"
-                f"Produk: <b>{kode}</b> - {p_new['nama']}\n"
-                f"Deskripsi lama: <code>{old_deskripsi}</code>\n"
-                f"Deskripsi baru: <b>{p_new['deskripsi']}</b>",
-                parse_mode="HTML",
-                reply_markup=get_menu(update.effective_user.id)
-            )
-        except Exception as e:
-            update.message.reply_text(
-                f"❌ <b>Gagal update deskripsi produk!</b>\n"
-                f"Produk: <b>{kode}</b> - {p['nama']}\n"
-                f"Error: {e}",
-                parse_mode="HTML",
-                reply_markup=get_menu(update.effective_user.id)
-            )
-        return ConversationHandler.END
+        _catat_mutasi(conn, user_id, jumlah, jenis, ref)
+        return conn.execute("SELECT saldo FROM users WHERE user_id = ?", (user_id,)).fetchone()[0]
 
-    else:
-        update.message.reply_text(
-            "❌ Field tidak dikenal.",
-            reply_markup=get_menu(update.effective_user.id)
+def debit_saldo(user_id, jumlah, jenis="debit", ref=""):
+    """Debit saldo hanya jika saldo >= jumlah. Return saldo akhir, atau None jika saldo tidak cukup."""
+    jumlah = int(jumlah)
+    with transaksi() as conn:
+        cur = conn.execute(
+            "UPDATE users SET saldo = saldo - ? WHERE user_id = ? AND saldo >= ?",
+            (jumlah, user_id, jumlah),
+        )
+        if cur.rowcount != 1:
+            return None
+        _catat_mutasi(conn, user_id, -jumlah, jenis, ref)
+        return conn.execute("SELECT saldo FROM users WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+def kurang_saldo(user_id, jumlah):
+    """Debit saldo (bersyarat). Return True jika berhasil."""
+    return debit_saldo(user_id, jumlah) is not None
+
+def buat_hold(hold_id, user_id, jumlah):
+    """
+    Tahan saldo selama transaksi diproses provider: saldo langsung didebit jika cukup
+    dan dicatat sebagai hold. Return saldo akhir, atau None jika saldo tidak cukup.
+    """
+    jumlah = int(jumlah)
+    with transaksi() as conn:
+        cur = conn.execute(
+            "UPDATE users SET saldo = saldo - ? WHERE user_id = ? AND saldo >= ?",
+            (jumlah, user_id, jumlah),
         )
-        return ConversationHandler.END
-
-def produk_pilih_callback(update: Update, context: CallbackContext):
-    query = update.callback_query
-    user = query.from_user
-    data = query.data
-    query.answer()
-    
-    if data.startswith("produk_static|"):
-        idx = int(data.split("|")[1])
-        produk_list = get_produk_list()
-        if idx >= len(produk_list):
-            query.edit_message_text("Produk tidak valid.", reply_markup=get_menu(user.id))
-            return ConversationHandler.END
-        p = produk_list[idx]
-        context.user_data["produk"] = p
-        query.edit_message_text(
-            f"Produk yang dipilih:\n<b>{p['kode']}</b> - {p['nama']}\nHarga: Rp {p['harga']:,}\nKuota: {p['kuota']}\n\nSilakan input nomor tujuan:",
-            parse_mode=ParseMode.HTML
+        if cur.rowcount != 1:
+            return None
+        conn.execute(
+            "INSERT INTO saldo_hold (id, user_id, jumlah) VALUES (?, ?, ?)", (hold_id, user_id, jumlah)
         )
-        return INPUT_TUJUAN
-    return ConversationHandler.END
-
-def input_tujuan_step(update: Update, context: CallbackContext):
-    tujuan = update.message.text.strip()
-    if not tujuan.isdigit() or len(tujuan) < 9:
-        update.message.reply_text("Format nomor tidak valid. Masukkan ulang.")
-        return INPUT_TUJUAN
-    context.user_data["tujuan"] = tujuan
-    p = context.user_data.get("produk")
-    update.message.reply_text(
-        f"Konfirmasi pesanan:\nProduk: <b>{p['kode']}</b> - {p['nama']}\nHarga: Rp {p['harga']:,}\nNomor: <b>{tujuan}</b>\n\nKetik 'YA' untuk konfirmasi atau 'BATAL' untuk membatalkan.",
-        parse_mode=ParseMode.HTML
+        _catat_mutasi(conn, user_id, -jumlah, "hold", hold_id)
+        return conn.execute("SELECT saldo FROM users WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+def capture_hold(hold_id):
+    """Jadikan hold sebagai pembayaran final. Return False jika hold tidak aktif."""
+    with transaksi() as conn:
+        cur = conn.execute(
+            "UPDATE saldo_hold SET status = 'capture' WHERE id = ? AND status = 'hold'", (hold_id,)
+        )
+        return cur.rowcount == 1
+
+def release_hold(hold_id):
+    """Batalkan hold dan kembalikan saldo. Return saldo akhir, atau None jika hold tidak aktif."""
+    with transaksi() as conn:
+        row = conn.execute(
+            "SELECT user_id, jumlah FROM saldo_hold WHERE id = ? AND status = 'hold'", (hold_id,)
+        ).fetchone()
+        if not row:
+            return None
+        user_id, jumlah = row
+        conn.execute("UPDATE saldo_hold SET status = 'release' WHERE id = ?", (hold_id,))
+        conn.execute("UPDATE users SET saldo = saldo + ? WHERE user_id = ?", (jumlah, user_id))
+        _catat_mutasi(conn, user_id, jumlah, "release", hold_id)
+        return conn.execute("SELECT saldo FROM users WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+def get_hold_kedaluwarsa(umur_menit, limit=100):
+    """Id hold yang masih berstatus 'hold' lebih dari `umur_menit` menit (proses mati sebelum capture/release)."""
+    return [row[0] for row in get_conn().execute(
+        "SELECT id FROM saldo_hold WHERE status = 'hold' AND created_at < datetime('now', ?) "
+        "ORDER BY created_at LIMIT ?",
+        (f"-{int(umur_menit)} minutes", limit),
+    )]
+
+# ========== RIWAYAT ==========
+
+def log_riwayat(id, user_id, produk, tujuan, harga, waktu="", status_text="pending", keterangan=""):
+    get_conn().execute(
+        f"INSERT OR REPLACE INTO riwayat ({RIWAYAT_COLS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (id, user_id, produk, tujuan, int(harga), waktu or "", status_text or "pending", keterangan or ""),
     )
-    return KONFIRMASI
-
-def konfirmasi_step(update: Update, context: CallbackContext):
-    text = update.message.text.strip().upper()
-    if text == "BATAL":
-        update.message.reply_text("Transaksi dibatalkan.", reply_markup=get_menu(update.effective_user.id))
-        return ConversationHandler.END
-    if text != "YA":
-        update.message.reply_text("Ketik 'YA' untuk konfirmasi atau 'BATAL' untuk batal.")
-        return KONFIRMASI
-        
-    p = context.user_data.get("produk")
-    harga = p["harga"]
-    tujuan = context.user_data.get("tujuan")
-    user = update.effective_user
-    
-    # Cek saldo user dari database
-    saldo_user = db.get_saldo(user.id)
-    if saldo_user < harga:
-        update.message.reply_text("Saldo Anda tidak cukup.", reply_markup=get_menu(user.id))
-        return ConversationHandler.END
-        
-    # Panggil API provider
-    data = create_trx(p["kode"], tujuan)
-    
-    if not data or not data.get("refid"):
-        err_msg = data.get("message", "Gagal membuat transaksi.") if data else "Tidak ada respon API."
-        update.message.reply_text(f"Gagal membuat transaksi:\n<b>{err_msg}</b>", parse_mode=ParseMode.HTML, reply_markup=get_menu(user.id))
-        return ConversationHandler.END
-        
-    # Kurangi saldo user
-    db.kurang_saldo(user.id, harga)
-    
-    # Simpan riwayat transaksi ke database
-    refid = data["refid"]
-    db.log_riwayat(
-        id=refid,
-        user_id=user.id,
-        produk=p["kode"],
-        tujuan=tujuan,
-        harga=harga,
-        waktu=data.get("waktu", ""),
-        status_text=data.get("status", "pending"),
-        keterangan=data.get("message", "")
+
+def get_riwayat_by_refid(refid):
+    return get_conn().execute(
+        f"SELECT {RIWAYAT_COLS} FROM riwayat WHERE reffid = ?", (refid,)
+    ).fetchone()
+
+def update_riwayat_status(reffid, status_text, keterangan=""):
+    get_conn().execute(
+        "UPDATE riwayat SET status_text = ?, keterangan = ? WHERE reffid = ?",
+        (status_text, keterangan or "", reffid),
     )
-    
-    update.message.reply_text(
-        f"✅ Transaksi berhasil!\n"
-        f"Produk: {p['kode']}\n"
-        f"Tujuan: {tujuan}\n"
-        f"RefID: <code>{refid}</code>\n"
-        f"Status: {data.get('status','pending')}\n"
-        f"Saldo tersisa: Rp {saldo_user - harga:,}",
-        parse_mode=ParseMode.HTML,
-        reply_markup=get_menu(user.id)
+
+# Status dianggap final jika mengandung salah satu kata ini (sama seperti sebelumnya di webhook.py)
+def status_final(status_text):
+    status_text = (status_text or "").lower()
+    return any(s in status_text for s in STATUS_FINAL)
+
+def status_refund(status_text):
+    status_text = (status_text or "").lower()
+    return any(s in status_text for s in STATUS_REFUND)
+
+def terapkan_status_trx(reffid, trxid, status_text, keterangan="", conn=None):
+    """
+    Terapkan status dari provider (callback/rekonsiliasi) secara idempotent:
+      - event (reffid, trxid, status) yang sama hanya diproses sekali (tabel webhook_event)
+      - status diganti dengan compare-and-set: hanya jika status lama belum final
+      - transaksi gagal/batal di-refund di transaksi DB yang sama
+    Return (hasil, riwayat, saldo_akhir) dengan hasil salah satu dari
+    "tidak_ditemukan", "duplikat", "sudah_final", "diupdate".
+    """
+    if conn is None:
+        with transaksi() as conn:
+            return terapkan_status_trx(reffid, trxid, status_text, keterangan, conn=conn)
+    riwayat = conn.execute(f"SELECT {RIWAYAT_COLS} FROM riwayat WHERE reffid = ?", (reffid,)).fetchone()
+    if not riwayat:
+        return "tidak_ditemukan", None, None
+    cur = conn.execute(
+        "INSERT OR IGNORE INTO webhook_event (reffid, trxid, status) VALUES (?, ?, ?)",
+        (reffid, str(trxid or ""), (status_text or "").lower()),
+    )
+    if cur.rowcount == 0:
+        return "duplikat", riwayat, None
+    cur = conn.execute(
+        f"UPDATE riwayat SET status_text = ?, keterangan = ? WHERE reffid = ? AND {_SQL_BELUM_FINAL}",
+        ((status_text or "").upper(), keterangan or "", reffid),
     )
-    return ConversationHandler.END
+    if cur.rowcount == 0:
+        return "sudah_final", riwayat, None
+    user_id, harga = riwayat[1], riwayat[4]
+    if status_refund(status_text):
+        conn.execute("UPDATE users SET saldo = saldo + ? WHERE user_id = ?", (harga, user_id))
+        _catat_mutasi(conn, user_id, harga, "refund", reffid)
+    row = conn.execute("SELECT saldo FROM users WHERE user_id = ?", (user_id,)).fetchone()
+    return "diupdate", riwayat, (row[0] if row else 0)
 
-def topup_nominal_step(update: Update, context: CallbackContext):
-    text = update.message.text.strip()
-    try:
-        nominal = int(text.replace(".", "").replace(",", ""))
-        if nominal < 10000:
-            raise Exception
-    except Exception:
-        update.message.reply_text("Nominal minimal 10.000. Masukkan kembali nominal:")
-        return TOPUP_NOMINAL
-        
-    context.user_data["topup_nominal"] = nominal
-
-    # Generate QRIS
-    resp = generate_qris(nominal)
-    if resp.get("status") != "success":
-        update.message.reply_text(f"Gagal generate QRIS: {resp.get('message')}")
-        return ConversationHandler.END
-        
-    qris_base64 = resp.get("qris_base64")
-    msg = f"Silakan lakukan pembayaran Top Up sebesar <b>Rp {nominal:,}</b>\n\nScan QRIS berikut:"
-    
-    if qris_base64:
-        update.message.reply_photo(photo=f"data:image/png;base64,{qris_base64}", caption=msg, parse_mode=ParseMode.HTML)
-    else:
-        update.message.reply_text(msg, parse_mode=ParseMode.HTML)
-        
-    return ConversationHandler.END
-
-def riwayat_user(query, context):
-    user = query.from_user
-    # Ambil riwayat dari database
-    riwayat_items = db.get_riwayat_user(user.id, limit=10)
-    msg = "<b>Riwayat Transaksi Anda:</b>\n"
-    
-    for r in riwayat_items:
-        msg += (
-            f"{r[5]} | <code>{r[0]}</code>\n"
-            f"{r[2]} ke {r[3]} | Rp {r[4]:,}\n"
-            f"Status: <b>{r[6]}</b>\n\n"
+def terapkan_status_batch(events, susun_notif=None):
+    """
+    Terapkan banyak event (reffid, trxid, status_text, keterangan) dalam satu transaksi DB.
+    `susun_notif(hasil)` (opsional) mengembalikan [(chat_id, teks, parse_mode), ...] yang
+    dimasukkan ke notif_queue di transaksi yang sama (outbox).
+    Return list hasil terapkan_status_trx dengan urutan sama seperti `events`.
+    """
+    with transaksi() as conn:
+        hasil = [terapkan_status_trx(reffid, trxid, status_text, keterangan, conn=conn)
+                 for reffid, trxid, status_text, keterangan in events]
+        if susun_notif:
+            for chat_id, teks, parse_mode in susun_notif(hasil):
+                tambah_notif(chat_id, teks, parse_mode, conn=conn)
+        return hasil
+
+def get_riwayat_pending(umur_menit, maks_umur_jam=48, limit=100):
+    """Transaksi belum final (selain CEK MANUAL) yang dibuat antara `maks_umur_jam` jam dan `umur_menit` menit lalu, paling lama dulu."""
+    return get_conn().execute(
+        f"SELECT {RIWAYAT_COLS} FROM riwayat WHERE {_SQL_BELUM_FINAL} AND status_text != ? "
+        "AND created_at < datetime('now', ?) AND created_at > datetime('now', ?) "
+        "ORDER BY created_at LIMIT ?",
+        (STATUS_CEK_MANUAL, f"-{int(umur_menit)} minutes", f"-{int(maks_umur_jam)} hours", limit),
+    ).fetchall()
+
+def get_riwayat_kedaluwarsa(maks_umur_jam, limit=100):
+    """Transaksi belum final (selain CEK MANUAL) yang dibuat lebih dari `maks_umur_jam` jam lalu, paling lama dulu."""
+    return get_conn().execute(
+        f"SELECT {RIWAYAT_COLS} FROM riwayat WHERE {_SQL_BELUM_FINAL} AND status_text != ? "
+        "AND created_at <= datetime('now', ?) ORDER BY created_at LIMIT ?",
+        (STATUS_CEK_MANUAL, f"-{int(maks_umur_jam)} hours", limit),
+    ).fetchall()
+
+def get_riwayat_user(user_id, limit=10):
+    return get_conn().execute(
+        f"SELECT {RIWAYAT_COLS} FROM riwayat WHERE user_id = ? ORDER BY rowid DESC LIMIT ?",
+        (user_id, limit),
+    ).fetchall()
+
+def get_all_riwayat(limit=30):
+    return get_conn().execute(
+        f"SELECT {RIWAYAT_COLS} FROM riwayat ORDER BY rowid DESC LIMIT ?", (limit,)
+    ).fetchall()
+
+def get_riwayat_halaman(sebelum=None, limit=30):
+    """
+    Riwayat semua user (paling baru dulu) beserta username, dalam satu query JOIN.
+    Keyset pagination: `sebelum` = rowid baris terakhir yang tampil di halaman sebelumnya,
+    None untuk halaman pertama. Return (rows, masih_ada); setiap row = rowid + kolom
+    RIWAYAT_COLS + username, masih_ada True jika ada baris setelah `limit` baris ini.
+    """
+    rows = get_conn().execute(
+        "SELECT r.rowid, r.reffid, r.user_id, r.produk, r.tujuan, r.harga, r.waktu, r.status_text, "
+        "r.keterangan, COALESCE(u.username, '') FROM riwayat r LEFT JOIN users u ON u.user_id = r.user_id "
+        "WHERE r.rowid < ? ORDER BY r.rowid DESC LIMIT ?",
+        (sebelum if sebelum is not None else 2 ** 63 - 1, limit + 1),
+    ).fetchall()
+    return rows[:limit], len(rows) > limit
+
+# ========== TOPUP ==========
+
+def tambah_topup_pending(user_id, username, nama, nominal, bukti_file_id=None, bukti_caption=None):
+    cur = get_conn().execute(
+        "INSERT INTO topup_pending (user_id, username, nama, nominal, bukti_file_id, bukti_caption) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (user_id, username or "", nama or "", int(nominal), bukti_file_id, bukti_caption),
+    )
+    return cur.lastrowid
+
+def update_topup_status(topup_id, status):
+    get_conn().execute("UPDATE topup_pending SET status = ? WHERE id = ?", (status, topup_id))
+
+def get_all_topup():
+    return get_conn().execute(
+        "SELECT id, user_id, username, nama, nominal, waktu, status, bukti_file_id, bukti_caption "
+        "FROM topup_pending ORDER BY id"
+    ).fetchall()
+
+# ========== ANTRIAN NOTIFIKASI ==========
+
+def tambah_notif(chat_id, teks, parse_mode=None, conn=None):
+    cur = (conn or get_conn()).execute(
+        "INSERT INTO notif_queue (chat_id, teks, parse_mode) VALUES (?, ?, ?)", (chat_id, teks, parse_mode)
+    )
+    return cur.lastrowid
+
+def ambil_notif_siap(sekarang, limit=50):
+    """Notifikasi pending yang sudah waktunya dikirim: (id, chat_id, teks, parse_mode, percobaan)."""
+    return get_conn().execute(
+        "SELECT id, chat_id, teks, parse_mode, percobaan FROM notif_queue "
+        "WHERE status = 'pending' AND next_at <= ? ORDER BY id LIMIT ?",
+        (sekarang, limit),
+    ).fetchall()
+
+def tandai_notif_terkirim(notif_id):
+    get_conn().execute("UPDATE notif_queue SET status = 'terkirim' WHERE id = ?", (notif_id,))
+
+def jadwal_ulang_notif(notif_id, next_at, error="", tambah_percobaan=True):
+    get_conn().execute(
+        "UPDATE notif_queue SET next_at = ?, error = ?, percobaan = percobaan + ? WHERE id = ?",
+        (next_at, error, 1 if tambah_percobaan else 0, notif_id),
+    )
+
+def tandai_notif_gagal(notif_id, error=""):
+    get_conn().execute("UPDATE notif_queue SET status = 'gagal', error = ? WHERE id = ?", (error, notif_id))
+
+def hapus_notif_terkirim(batas_hari=7):
+    get_conn().execute(
+        "DELETE FROM notif_queue WHERE status = 'terkirim' AND created_at < datetime('now', ?)",
+        (f"-{int(batas_hari)} days",),
+    )
+
+# ========== KATALOG PRODUK (SINKRON DARI PROVIDER) ==========
+
+def get_katalog_produk():
+    """Produk aktif di katalog lokal, urut sesuai daftar provider: [(kode, nama, harga, deskripsi), ...]"""
+    conn = get_conn()
+    rows = conn.execute("SELECT kode, nama, harga, deskripsi FROM katalog_produk WHERE aktif = 1").fetchall()
+    row = conn.execute("SELECT nilai FROM katalog_meta WHERE kunci = 'urutan'").fetchone()
+    posisi = {kode: i for i, kode in enumerate(json.loads(row[0]))} if row else {}
+    return sorted(rows, key=lambda r: (posisi.get(r[0], len(posisi)), r[0]))
+
+def sinkron_katalog(produk_list):
+    """
+    Samakan katalog lokal dengan daftar produk provider [(kode, nama, harga, deskripsi), ...].
+    Hanya baris yang isinya berubah yang ditulis; produk yang hilang dari provider dinonaktifkan
+    (tidak dihapus). Urutan daftar disimpan terpisah di katalog_meta dan tidak dihitung sebagai
+    perubahan baris. Return (baru, berubah, nonaktif, urutan_berubah).
+    """
+    with transaksi() as conn:
+        lama = {
+            row[0]: row[1:]
+            for row in conn.execute("SELECT kode, nama, harga, deskripsi, aktif FROM katalog_produk")
+        }
+        baru, berubah = [], []
+        for kode, nama, harga, deskripsi in produk_list:
+            nilai = (nama, harga, deskripsi, 1)
+            if kode not in lama:
+                baru.append((kode,) + nilai)
+            elif lama[kode] != nilai:
+                berubah.append(nilai + (kode,))
+        ada = {kode for kode, *_ in produk_list}
+        nonaktif = [(kode,) for kode, row in lama.items() if row[3] == 1 and kode not in ada]
+        conn.executemany(
+            "INSERT INTO katalog_produk (kode, nama, harga, deskripsi, aktif) VALUES (?, ?, ?, ?, ?)", baru
         )
-        
-    if not riwayat_items:
-        msg += "Belum ada transaksi."
-        
-    query.edit_message_text(msg, parse_mode=ParseMode.HTML, reply_markup=get_menu(user.id))
-
-def semua_riwayat(query, context):
-    # Ambil semua riwayat dari database (hanya admin)
-    riwayat_items = db.get_all_riwayat(limit=30)
-    msg = "<b>Semua Riwayat Transaksi (max 30):</b>\n"
-    
-    for r in riwayat_items:
-        # Ambil info user dari database
-        user_info = db.get_user(r[1])
-        username = user_info[1] if user_info else "-"
-        
-        msg += (
-            f"{r[5]} | <code>{r[0]}</code>\n"
-            f"{r[2]} ke {r[3]} | Rp {r[4]:,}\n"
-            f"Status: <b>{r[6]}</b> | User: {username}\n\n"
+        conn.executemany(
+            "UPDATE katalog_produk SET nama = ?, harga = ?, deskripsi = ?, aktif = ?, "
+            "updated_at = CURRENT_TIMESTAMP WHERE kode = ?", berubah
         )
-        
-    if not riwayat_items:
-        msg += "Belum ada transaksi."
-        
-    query.edit_message_text(msg, parse_mode=ParseMode.HTML, reply_markup=get_menu(query.from_user.id))
-
-def handle_text(update: Update, context: CallbackContext):
-    text = update.message.text.strip()
-    user = update.effective_user
-    isadmin = is_admin(user.id)
-    
-    # Pastikan user ada di database
-    db.tambah_user(user.id, user.username or "", user.full_name)
-    
-    if text.startswith("CEK|"):
-        refid = text.split("|", 1)[1]
-        # Cek di database dulu
-        riwayat = db.get_riwayat_by_refid(refid)
-        if riwayat:
-            msg = f"Status transaksi <code>{refid}</code>:\n"
-            msg += f"Produk: {riwayat[2]}\n"
-            msg += f"Tujuan: {riwayat[3]}\n"
-            msg += f"Harga: Rp {riwayat[4]:,}\n"
-            msg += f"Waktu: {riwayat[5]}\n"
-            msg += f"Status: <b>{riwayat[6]}</b>\n"
-            msg += f"Keterangan: {riwayat[7]}\n"
-            update.message.reply_text(msg, parse_mode=ParseMode.HTML, reply_markup=get_menu(user.id))
-        else:
-            # Fallback ke API provider
-            data = history(refid)
-            update.message.reply_text(
-                f"<b>Respon API:</b>\n<pre>{json.dumps(data, indent=2, ensure_ascii=False)}</pre>",
-                parse_mode=ParseMode.HTML,
-                reply_markup=get_menu(user.id)
-            )
-            
-    elif text.startswith("TAMBAH|") and isadmin:
-        try:
-            tambah = int(text.split("|", 1)[1])
-            # Tambah saldo bot (ini untuk saldo global, bukan user tertentu)
-            # Sesuaikan dengan kebutuhan Anda
-            update.message.reply_text(f"Fitur tambah saldo global sedang dalam pengembangan.", reply_markup=get_menu(user.id))
-        except Exception:
-            update.message.reply_text("Nilai tidak valid.", reply_markup=get_menu(user.id))
-    else:
-        update.message.reply_text("Gunakan menu.", reply_markup=get_menu(user.id))
-
-# Tambahkan fungsi bantu jika diperlukan
-def format_stock_akrab(raw):
-    """Format data stock dari provider"""
-    if isinstance(raw, dict):
-        return json.dumps(raw, indent=2, ensure_ascii=False)
-    return str(raw)
+        conn.executemany(
+            "UPDATE katalog_produk SET aktif = 0, updated_at = CURRENT_TIMESTAMP WHERE kode = ?", nonaktif
+        )
+        cur = conn.execute(
+            "INSERT INTO katalog_meta (kunci, nilai) VALUES ('urutan', ?) "
+            "ON CONFLICT(kunci) DO UPDATE SET nilai = excluded.nilai WHERE nilai != excluded.nilai",
+            (json.dumps([kode for kode, *_ in produk_list]),),
+        )
+    return len(baru), len(berubah), len(nonaktif), cur.rowcount == 1
+
+# ========== PRODUK (override admin) ==========
+# Override harga/deskripsi tetap disimpan di produk_custom.json agar katalog produk
+# (produk.get_produk_by_kode) langsung membaca nilai baru.
+
+def set_produk_admin_harga(kode, harga):
+    from produk import edit_produk
+    if not edit_produk(kode, harga=harga):
+        raise ValueError(f"Gagal menyimpan harga produk {kode}")
+
+def set_produk_admin_deskripsi(kode, deskripsi):
+    from produk import edit_produk
+    if not edit_produk(kode, deskripsi=deskripsi):
+        raise ValueError(f"Gagal menyimpan deskripsi produk {kode}")
+
+# ========== BACKUP ==========
+
+def backup(dst):
+    """Salin database ke file lain dengan backup API SQLite (aman untuk mode WAL)."""
+    target = sqlite3.connect(dst)
+    try:
+        get_conn().backup(target)
+    finally:
+        target.close()
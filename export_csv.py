@@ -13,13 +13,7 @@ def export_transaksi_csv(filename="riwayat_transaksi.csv"):
     print(f"Export transaksi selesai ke {filename}")
 
 def export_topup_csv(filename="topup.csv"):
-    # Mirip, silakan buat get_all_topup() di db.py jika ingin semua data, atau pakai SELECT * FROM topup_pending
-    import sqlite3
-    conn = sqlite3.connect("botdata.db")
-    c = conn.cursor()
-    c.execute("SELECT * FROM topup_pending")
-    rows = c.fetchall()
-    conn.close()
+    rows = db.get_all_topup()
     with open(filename, "w", newline="", encoding="utf-8") as f:
         writer = csv.writer(f)
         writer.writerow([
@@ -0,0 +1,161 @@
+import re
+import html
+import time
+import itertools
+from telegram import InlineKeyboardButton
+
+# Renderer pesan panjang (daftar produk, riwayat) yang selalu muat dalam batas
+# 4096 karakter Telegram. Baris dibaca satu per satu dari iterable (generator),
+# dikumpulkan ke list lalu di-join sekali, dan berhenti begitu halaman penuh,
+# sehingga hanya potongan data yang diminta yang diambil/diformat.
+#
+# Halaman dihitung dari awal data secara deterministik (halaman k selalu mulai
+# di index yang sama selama datanya sama), jadi tombol ⬅️/➡️ cukup membawa
+# index baris awal halaman di callback_data, misal "riwayat|20". Awal halaman
+# yang sudah dilewati disimpan di tumpukan (chat_data) agar tombol ⬅️ tidak perlu
+# membaca ulang data dari baris 0; tanpa tumpukan (mis. setelah restart) baru
+# dihitung ulang dengan halaman_sebelumnya().
+
+BATAS_PESAN = 4096
+BATAS_HALAMAN = 3800  # sisakan ruang untuk tambahan di luar renderer (info umur stok, dsb)
+
+_TAG = re.compile(r"<[^>]*>")
+
+def _ruang(batas, kepala, ekor):
+    return max(batas - len(kepala) - len(ekor), 1)
+
+def _potong(baris, ruang):
+    """Baris yang sendirian pun tidak muat: buang tag HTML lalu potong, agar HTML tetap valid."""
+    polos = html.escape(html.unescape(_TAG.sub("", baris)))
+    return polos[:max(ruang - 2, 0)] + "…\n"
+
+def isi_halaman(baris, batas=BATAS_HALAMAN, kepala="", ekor="", maks_baris=None):
+    """
+    Ambil baris dari iterable `baris` sampai halaman penuh (atau `maks_baris` baris).
+    Setiap baris sudah termasuk "\\n"-nya sendiri.
+    Return (teks, jumlah_baris_dipakai, masih_ada).
+    """
+    ruang = _ruang(batas, kepala, ekor)
+    bagian = [kepala]
+    pakai = 0
+    for b in baris:
+        if len(b) > ruang:
+            b = _potong(b, ruang)
+        if len(bagian) > 1 and (pakai + len(b) > ruang or len(bagian) - 1 == maks_baris):
+            bagian.append(ekor)
+            return "".join(bagian), len(bagian) - 2, True
+        bagian.append(b)
+        pakai += len(b)
+    bagian.append(ekor)
+    return "".join(bagian), len(bagian) - 2, False
+
+def awal_halaman(baris, batas=BATAS_HALAMAN, kepala="", ekor="", maks_baris=None):
+    """Generator index baris awal setiap halaman (0, ...), dengan aturan yang sama seperti isi_halaman."""
+    ruang = _ruang(batas, kepala, ekor)
+    pakai = jumlah = 0
+    for i, b in enumerate(baris):
+        panjang = len(b) if len(b) <= ruang else len(_potong(b, ruang))
+        if i == 0:
+            yield 0
+        elif pakai + panjang > ruang or jumlah == maks_baris:
+            yield i
+            pakai = jumlah = 0
+        pakai += panjang
+        jumlah += 1
+
+def halaman_sebelumnya(baris, mulai, **opsi):
+    """Index awal halaman sebelum halaman yang dimulai di `mulai` (baris dibaca dari awal sampai `mulai` saja)."""
+    sebelumnya = 0
+    for awal in awal_halaman(baris, **opsi):
+        if awal >= mulai:
+            break
+        sebelumnya = awal
+    return sebelumnya
+
+def tumpukan(penyimpanan, prefix):
+    """Tumpukan awal halaman untuk `prefix` di dict `penyimpanan` (context.chat_data); None jika tidak ada."""
+    if penyimpanan is None:
+        return None
+    return penyimpanan.setdefault("halaman", {}).setdefault(prefix, [])
+
+def render(sumber, mulai=0, kosong="", riwayat=None, **opsi):
+    """
+    Render halaman yang dimulai di baris `mulai`.
+    `sumber(dari)` harus mengembalikan iterable baris mulai dari index `dari`.
+    `kosong` = teks pengganti jika tidak ada baris sama sekali.
+    `riwayat` = list awal halaman yang sudah dilewati (dari tumpukan()), diperbarui di tempat.
+    Return (teks, sebelumnya, berikutnya); sebelumnya/berikutnya None jika tidak ada.
+    """
+    mulai = max(int(mulai), 0)
+    teks, dipakai, masih_ada = isi_halaman(sumber(mulai), **opsi)
+    if dipakai == 0 and mulai > 0:
+        # Data menyusut (misal kursor lama): kembali ke halaman pertama
+        return render(sumber, 0, kosong, riwayat, **opsi)
+    if riwayat is not None:
+        riwayat[:] = [awal for awal in riwayat if awal < mulai]
+    if dipakai == 0:
+        return opsi.get("kepala", "") + kosong + opsi.get("ekor", ""), None, None
+    if mulai == 0:
+        sebelumnya = None
+    elif riwayat:
+        sebelumnya = riwayat[-1]
+    else:
+        sebelumnya = halaman_sebelumnya(sumber(0), mulai, **opsi)
+    if riwayat is not None:
+        riwayat.append(mulai)
+    return teks, sebelumnya, (mulai + dipakai if masih_ada else None)
+
+def tombol_navigasi(prefix, sebelumnya, berikutnya):
+    """Baris tombol ⬅️/➡️ dengan callback_data "<prefix>|<index awal>"; list kosong jika hanya satu halaman."""
+    nav = []
+    if sebelumnya is not None:
+        nav.append(InlineKeyboardButton("⬅️ Sebelumnya", callback_data=f"{prefix}|{sebelumnya}"))
+    if berikutnya is not None:
+        nav.append(InlineKeyboardButton("➡️ Berikutnya", callback_data=f"{prefix}|{berikutnya}"))
+    return nav
+
+def dari_list(items, format_baris):
+    """Sumber untuk render() dari list/tuple di memori: hanya potongan yang dibaca yang diformat."""
+    return lambda dari: (format_baris(x) for x in itertools.islice(items, dari, None))
+
+# ========== BENCHMARK (python halaman.py) ==========
+
+def _bench(jumlah_baris=5000, ulang=200):
+    items = [{"kode": f"XLA{i}", "nama": "Paket Akrab " * (1 + i % 5), "harga": 10000 + i} for i in range(jumlah_baris)]
+    fmt = lambda p: f"<code>{p['kode']}</code> | {p['nama']} | <b>Rp {p['harga']:,}</b>\n"
+
+    t0 = time.perf_counter()
+    for _ in range(ulang):
+        msg = "<b>Daftar Produk:</b>\n"
+        for p in items:
+            msg += fmt(p)
+    lama = (time.perf_counter() - t0) / ulang * 1e3
+
+    sumber = dari_list(items, fmt)
+    t0 = time.perf_counter()
+    for _ in range(ulang):
+        teks, _, berikutnya = render(sumber, 0, kepala="<b>Daftar Produk:</b>\n")
+    pertama = (time.perf_counter() - t0) / ulang * 1e3
+
+    mulai, halaman = 0, 0
+    t0 = time.perf_counter()
+    while mulai is not None:
+        teks, _, mulai = render(sumber, mulai, kepala="<b>Daftar Produk:</b>\n")
+        assert len(teks) <= BATAS_PESAN
+        halaman += 1
+    semua = (time.perf_counter() - t0) * 1e3
+
+    mulai, riwayat, halaman = 0, [], 0
+    t0 = time.perf_counter()
+    while mulai is not None:
+        teks, sebelumnya, mulai = render(sumber, mulai, riwayat=riwayat, kepala="<b>Daftar Produk:</b>\n")
+        halaman += 1
+    dengan_tumpukan = (time.perf_counter() - t0) * 1e3
+
+    print(f"{jumlah_baris} baris, concat += seluruh daftar : {lama:.2f} ms/pesan ({len(msg)} karakter, tidak terkirim)")
+    print(f"render halaman pertama             : {pertama:.3f} ms ({len(render(sumber, 0)[0])} karakter)")
+    print(f"render semua {halaman} halaman berurutan  : {semua:.1f} ms total (⬅️ dihitung ulang dari baris 0)")
+    print(f"render semua {halaman} halaman + tumpukan : {dengan_tumpukan:.1f} ms total")
+
+if __name__ == "__main__":
+    _bench()
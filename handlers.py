@@ -1,30 +1,45 @@
 import json
-from telegram import Update, ParseMode, InlineKeyboardButton, InlineKeyboardMarkup
+import time
+import uuid
+import logging
+from telegram import Update, ParseMode, InlineKeyboardMarkup
 from telegram.ext import CallbackContext, ConversationHandler, MessageHandler, Filters
-from provider import create_trx, history, cek_stock_akrab
-from provider_qris import generate_qris
-from markup import get_menu, produk_inline_keyboard, admin_edit_produk_keyboard, is_admin
-from produk import get_produk_list, edit_produk, get_produk_by_kode
+from provider import create_trx
+from cek_status import cek_status
+from telegram.error import BadRequest
+from provider_qris import generate_qris_png, png_bytesio, get_qris_file_id, simpan_qris_file_id, hapus_qris_file_id
+from markup import get_menu, produk_inline_keyboard, admin_produk_list_keyboard, admin_edit_produk_keyboard
+from peran import admin_dari
+from halaman import render, tombol_navigasi, dari_list, tumpukan
+from produk import (
+    get_katalog, edit_produk, get_produk_by_kode, get_stok_snapshot, info_umur_stok
+)
 from utils import (
-    get_saldo, set_saldo, load_riwayat, save_riwayat, load_topup, save_topup, format_stock_akrab
+    get_saldo, tambah_saldo, hold_saldo, capture_saldo, release_saldo, load_topup, save_topup, format_stock_akrab
 )
+import riwayat_log
+import antrian_trx
+
+logger = logging.getLogger(__name__)
 
 CHOOSING_PRODUK, INPUT_TUJUAN, KONFIRMASI, TOPUP_NOMINAL, ADMIN_EDIT = range(5)
 
 def start(update: Update, context: CallbackContext):
     user = update.effective_user
+    isadmin = admin_dari(context, user.id)
     update.message.reply_text(
         f"Halo <b>{user.first_name}</b>!\nGunakan menu di bawah.",
         parse_mode=ParseMode.HTML,
-        reply_markup=get_menu(user.id)
+        reply_markup=get_menu(user.id, isadmin)
     )
 
 def cancel(update: Update, context: CallbackContext):
     user = update.effective_user
+    isadmin = admin_dari(context, user.id)
     context.user_data.clear()
     update.message.reply_text(
         "Operasi dibatalkan.",
-        reply_markup=get_menu(user.id)
+        reply_markup=get_menu(user.id, isadmin)
     )
     return ConversationHandler.END
 
@@ -33,13 +48,16 @@ def main_menu_callback(update: Update, context: CallbackContext):
     user = query.from_user
     data = query.data
     query.answer()
-    
-    if data == 'lihat_produk':
-        produk_list = get_produk_list()
-        msg = "<b>Daftar Produk:</b>\n"
-        for p in produk_list:
-            msg += f"<code>{p['kode']}</code> | {p['nama']} | <b>Rp {p['harga']:,}</b> | Kuota: {p['kuota']}\n"
-        query.edit_message_text(msg, parse_mode=ParseMode.HTML, reply_markup=get_menu(user.id))
+    isadmin = admin_dari(context, user.id)  # peran ditentukan sekali per update
+    
+    if data == 'lihat_produk' or data.startswith('lihat_produk|'):
+        umur = info_umur_stok()
+        msg, sebelumnya, berikutnya = render(
+            dari_list(get_katalog().produk, _baris_produk), _mulai_dari(data),
+            kepala="<b>Daftar Produk:</b>\n", ekor=f"\n{umur}" if umur else "",
+            kosong="Belum ada produk.", riwayat=tumpukan(context.chat_data, "lihat_produk"),
+        )
+        _edit_halaman(query, msg, "lihat_produk", sebelumnya, berikutnya, get_menu(user.id, isadmin))
         return ConversationHandler.END
     
     elif data == 'beli_produk':
@@ -61,7 +79,7 @@ def main_menu_callback(update: Update, context: CallbackContext):
         query.edit_message_text(
             "Kirim format: <code>CEK|refid</code>\nContoh: <code>CEK|TRX123456</code>", 
             parse_mode=ParseMode.HTML, 
-            reply_markup=get_menu(user.id)
+            reply_markup=get_menu(user.id, isadmin)
         )
         return ConversationHandler.END
     
@@ -69,45 +87,51 @@ def main_menu_callback(update: Update, context: CallbackContext):
         riwayat_user(query, context)
         return ConversationHandler.END
     
+    elif data.startswith("riwayat|"):
+        riwayat_user(query, context, mulai=_mulai_dari(data))
+        return ConversationHandler.END
+    
     elif data == 'stock_akrab':
         try:
-            raw = cek_stock_akrab()
+            raw = get_stok_snapshot()["raw"]
             msg = format_stock_akrab(raw)
             if isinstance(msg, str) and msg.strip().lower().startswith("<html"):
                 msg = "❌ Provider membalas data tidak valid."
-            query.edit_message_text(msg, parse_mode=ParseMode.HTML, reply_markup=get_menu(user.id))
+            umur = info_umur_stok()
+            if umur:
+                msg += f"\n{umur}"
+            query.edit_message_text(msg, parse_mode=ParseMode.HTML, reply_markup=get_menu(user.id, isadmin))
         except Exception as e:
-            query.edit_message_text(f"❌ Error cek stock: {str(e)}", parse_mode=ParseMode.HTML, reply_markup=get_menu(user.id))
+            query.edit_message_text(f"❌ Error cek stock: {str(e)}", parse_mode=ParseMode.HTML, reply_markup=get_menu(user.id, isadmin))
         return ConversationHandler.END
     
-    elif data == 'semua_riwayat' and is_admin(user.id):
+    elif data == 'semua_riwayat' and isadmin:
         semua_riwayat(query, context)
         return ConversationHandler.END
     
-    elif data == 'lihat_saldo' and is_admin(user.id):
+    elif data.startswith('semua_riwayat|') and isadmin:
+        semua_riwayat(query, context, mulai=_mulai_dari(data))
+        return ConversationHandler.END
+    
+    elif data == 'lihat_saldo' and isadmin:
         saldo = get_saldo()
-        query.edit_message_text(f"Saldo bot: <b>Rp {saldo:,}</b>", parse_mode=ParseMode.HTML, reply_markup=get_menu(user.id))
+        query.edit_message_text(f"Saldo bot: <b>Rp {saldo:,}</b>", parse_mode=ParseMode.HTML, reply_markup=get_menu(user.id, isadmin))
         return ConversationHandler.END
     
-    elif data == 'tambah_saldo' and is_admin(user.id):
-        query.edit_message_text("Kirim format: <code>TAMBAH|jumlah</code>", parse_mode=ParseMode.HTML, reply_markup=get_menu(user.id))
+    elif data == 'tambah_saldo' and isadmin:
+        query.edit_message_text("Kirim format: <code>TAMBAH|jumlah</code>", parse_mode=ParseMode.HTML, reply_markup=get_menu(user.id, isadmin))
         return ConversationHandler.END
     
-    elif data == 'manajemen_produk' and is_admin(user.id):
-        produk_list = get_produk_list()
+    elif (data == 'manajemen_produk' or data.startswith('manajemen_produk|')) and isadmin:
         msg = "<b>Manajemen Produk:</b>\n"
-        keyboard = []
-        for p in produk_list:
-            keyboard.append([InlineKeyboardButton(f"{p['kode']} | {p['nama']}", callback_data=f"admin_edit_produk|{p['kode']}")])
-        keyboard.append([InlineKeyboardButton("⬅️ Kembali", callback_data="back_admin")])
-        query.edit_message_text(msg, parse_mode=ParseMode.HTML, reply_markup=InlineKeyboardMarkup(keyboard))
+        query.edit_message_text(msg, parse_mode=ParseMode.HTML, reply_markup=admin_produk_list_keyboard(_mulai_dari(data)))
         return ConversationHandler.END
     
-    elif data.startswith("admin_edit_produk|") and is_admin(user.id):
+    elif data.startswith("admin_edit_produk|") and isadmin:
         kode = data.split("|")[1]
         p = get_produk_by_kode(kode)
         if not p:
-            query.edit_message_text("Produk tidak ditemukan.", reply_markup=get_menu(user.id))
+            query.edit_message_text("Produk tidak ditemukan.", reply_markup=get_menu(user.id, isadmin))
             return ConversationHandler.END
         msg = (f"<b>Edit Produk {p['kode']}:</b>\n"
                f"Nama: {p['nama']}\nHarga: Rp {p['harga']:,}\nKuota: {p['kuota']}\nDeskripsi: {p['deskripsi']}\n\n"
@@ -116,7 +140,7 @@ def main_menu_callback(update: Update, context: CallbackContext):
         context.user_data["edit_kode"] = kode
         return ADMIN_EDIT
     
-    elif data.startswith("editharga|") and is_admin(user.id):
+    elif data.startswith("editharga|") and isadmin:
         kode = data.split("|")[1]
         context.user_data["edit_kode"] = kode
         context.user_data["edit_field"] = "harga"
@@ -126,7 +150,7 @@ def main_menu_callback(update: Update, context: CallbackContext):
         )
         return ADMIN_EDIT
     
-    elif data.startswith("editdeskripsi|") and is_admin(user.id):
+    elif data.startswith("editdeskripsi|") and isadmin:
         kode = data.split("|")[1]
         context.user_data["edit_kode"] = kode
         context.user_data["edit_field"] = "deskripsi"
@@ -136,30 +160,31 @@ def main_menu_callback(update: Update, context: CallbackContext):
         )
         return ADMIN_EDIT
     
-    elif data.startswith("resetcustom|") and is_admin(user.id):
+    elif data.startswith("resetcustom|") and isadmin:
         from produk import reset_produk_custom
         kode = data.split("|")[1]
         ok = reset_produk_custom(kode)
         if ok:
-            query.edit_message_text(f"✅ Sukses reset custom produk <b>{kode}</b> ke default.", parse_mode=ParseMode.HTML, reply_markup=get_menu(user.id))
+            query.edit_message_text(f"✅ Sukses reset custom produk <b>{kode}</b> ke default.", parse_mode=ParseMode.HTML, reply_markup=get_menu(user.id, isadmin))
         else:
-            query.edit_message_text(f"❌ Gagal reset custom produk <b>{kode}</b>.", parse_mode=ParseMode.HTML, reply_markup=get_menu(user.id))
+            query.edit_message_text(f"❌ Gagal reset custom produk <b>{kode}</b>.", parse_mode=ParseMode.HTML, reply_markup=get_menu(user.id, isadmin))
         return ConversationHandler.END
     
     elif data == "back_admin":
-        query.edit_message_text("Kembali ke menu admin.", reply_markup=get_menu(user.id))
+        query.edit_message_text("Kembali ke menu admin.", reply_markup=get_menu(user.id, isadmin))
         return ConversationHandler.END
     
     elif data == "back_main":
-        query.edit_message_text("Kembali ke menu utama.", reply_markup=get_menu(user.id))
+        query.edit_message_text("Kembali ke menu utama.", reply_markup=get_menu(user.id, isadmin))
         return ConversationHandler.END
     
     else:
-        query.edit_message_text("Menu tidak dikenal.", reply_markup=get_menu(user.id))
+        query.edit_message_text("Menu tidak dikenal.", reply_markup=get_menu(user.id, isadmin))
         return ConversationHandler.END
 
 def admin_edit_produk_step(update: Update, context: CallbackContext):
     # Handle text input for admin editing
+    isadmin = admin_dari(context, update.effective_user.id)
     kode = context.user_data.get("edit_kode")
     field = context.user_data.get("edit_field")
     value = update.message.text.strip()
@@ -167,7 +192,7 @@ def admin_edit_produk_step(update: Update, context: CallbackContext):
     if not kode or not field:
         update.message.reply_text(
             "❌ Kueri tidak valid. Silakan ulangi.",
-            reply_markup=get_menu(update.effective_user.id)
+            reply_markup=get_menu(update.effective_user.id, isadmin)
         )
         return ConversationHandler.END
 
@@ -175,7 +200,7 @@ def admin_edit_produk_step(update: Update, context: CallbackContext):
     if not p:
         update.message.reply_text(
             "❌ Produk tidak ditemukan.",
-            reply_markup=get_menu(update.effective_user.id)
+            reply_markup=get_menu(update.effective_user.id, isadmin)
         )
         return ConversationHandler.END
 
@@ -195,7 +220,7 @@ def admin_edit_produk_step(update: Update, context: CallbackContext):
                     f"Harga baru: <b>Rp {p_new['harga']:,}</b>\n"
                     f"Deskripsi: {p_new['deskripsi']}",
                     parse_mode="HTML",
-                    reply_markup=get_menu(update.effective_user.id)
+                    reply_markup=get_menu(update.effective_user.id, isadmin)
                 )
             except ValueError as e:
                 update.message.reply_text(
@@ -214,13 +239,13 @@ def admin_edit_produk_step(update: Update, context: CallbackContext):
                 f"Deskripsi lama: <code>{old_deskripsi}</code>\n"
                 f"Deskripsi baru: <b>{p_new['deskripsi']}</b>",
                 parse_mode="HTML",
-                reply_markup=get_menu(update.effective_user.id)
+                reply_markup=get_menu(update.effective_user.id, isadmin)
             )
         
         else:
             update.message.reply_text(
                 "❌ Field tidak dikenal.",
-                reply_markup=get_menu(update.effective_user.id)
+                reply_markup=get_menu(update.effective_user.id, isadmin)
             )
     
     except Exception as e:
@@ -229,7 +254,7 @@ def admin_edit_produk_step(update: Update, context: CallbackContext):
             f"Produk: <b>{kode}</b> - {p['nama']}\n"
             f"Error: {str(e)}",
             parse_mode="HTML",
-            reply_markup=get_menu(update.effective_user.id)
+            reply_markup=get_menu(update.effective_user.id, isadmin)
         )
     
     finally:
@@ -244,6 +269,7 @@ def admin_edit_produk_step(update: Update, context: CallbackContext):
 def produk_pilih_callback(update: Update, context: CallbackContext):
     query = update.callback_query
     user = query.from_user
+    isadmin = admin_dari(context, user.id)
     data = query.data
     query.answer()
     
@@ -251,13 +277,11 @@ def produk_pilih_callback(update: Update, context: CallbackContext):
     
     if data.startswith("produk_static|"):
         try:
-            idx = int(data.split("|")[1])
-            produk_list = get_produk_list()
-            if idx < 0 or idx >= len(produk_list):
-                query.edit_message_text("❌ Produk tidak valid.", reply_markup=get_menu(user.id))
+            p = get_produk_by_kode(data.split("|", 1)[1])
+            if not p:
+                query.edit_message_text("❌ Produk tidak valid.", reply_markup=get_menu(user.id, isadmin))
                 return ConversationHandler.END
             
-            p = produk_list[idx]
             context.user_data["produk"] = p
             query.edit_message_text(
                 f"✅ Produk yang dipilih:\n<b>{p['kode']}</b> - {p['nama']}\nHarga: Rp {p['harga']:,}\nKuota: {p['kuota']}\n\nSilakan input nomor tujuan:\n\nKetik /batal untuk membatalkan.",
@@ -267,17 +291,22 @@ def produk_pilih_callback(update: Update, context: CallbackContext):
         
         except (ValueError, IndexError) as e:
             print(f"❌ Error memilih produk: {e}")
-            query.edit_message_text("❌ Error memilih produk.", reply_markup=get_menu(user.id))
+            query.edit_message_text("❌ Error memilih produk.", reply_markup=get_menu(user.id, isadmin))
             return ConversationHandler.END
     
+    elif data.startswith("beli_produk|"):
+        # Pindah halaman daftar produk, tetap di state pilih produk
+        query.edit_message_reply_markup(reply_markup=produk_inline_keyboard(_mulai_dari(data)))
+        return CHOOSING_PRODUK
+    
     elif data == "back_main":
-        query.edit_message_text("Kembali ke menu utama.", reply_markup=get_menu(user.id))
+        query.edit_message_text("Kembali ke menu utama.", reply_markup=get_menu(user.id, isadmin))
         return ConversationHandler.END
     
     else:
         # Jika callback tidak dikenali, arahkan ke main menu
         print(f"❌ Callback tidak dikenali: {data}")
-        query.edit_message_text("Menu tidak dikenal.", reply_markup=get_menu(user.id))
+        query.edit_message_text("Menu tidak dikenal.", reply_markup=get_menu(user.id, isadmin))
         return ConversationHandler.END
 def input_tujuan_step(update: Update, context: CallbackContext):
     tujuan = update.message.text.strip()
@@ -297,10 +326,11 @@ def input_tujuan_step(update: Update, context: CallbackContext):
     return KONFIRMASI
 
 def konfirmasi_step(update: Update, context: CallbackContext):
+    isadmin = admin_dari(context, update.effective_user.id)
     text = update.message.text.strip().upper()
     
     if text == "BATAL":
-        update.message.reply_text("❌ Transaksi dibatalkan.", reply_markup=get_menu(update.effective_user.id))
+        update.message.reply_text("❌ Transaksi dibatalkan.", reply_markup=get_menu(update.effective_user.id, isadmin))
         return ConversationHandler.END
     
     if text != "YA":
@@ -312,32 +342,58 @@ def konfirmasi_step(update: Update, context: CallbackContext):
     tujuan = context.user_data.get("tujuan")
     
     if not p or not tujuan:
-        update.message.reply_text("❌ Data transaksi tidak lengkap.", reply_markup=get_menu(update.effective_user.id))
+        update.message.reply_text("❌ Data transaksi tidak lengkap.", reply_markup=get_menu(update.effective_user.id, isadmin))
         return ConversationHandler.END
     
     harga = p["harga"]
-    saldo = get_saldo()
+    reff_id = str(uuid.uuid4())
+    user = update.effective_user
+    context.user_data.clear()
     
-    # Check balance
-    if saldo < harga:
-        update.message.reply_text("❌ Saldo bot tidak cukup.", reply_markup=get_menu(update.effective_user.id))
+    # Tahan saldo (debit atomic jika saldo cukup) sebelum memanggil provider
+    saldo_akhir = hold_saldo(reff_id, harga)
+    if saldo_akhir is None:
+        update.message.reply_text("❌ Saldo bot tidak cukup.", reply_markup=get_menu(user.id, isadmin))
         return ConversationHandler.END
     
-    # Create transaction
+    # Panggilan provider jalan di antrian transaksi; user langsung dapat pesan "diproses"
+    # yang nanti di-edit dengan hasilnya
+    pesan = update.message.reply_text(
+        f"⏳ Transaksi sedang diproses...\n\n📦 Produk: {p['kode']}\n📱 Tujuan: {tujuan}\n🔢 RefID: <code>{reff_id}</code>",
+        parse_mode=ParseMode.HTML
+    )
+    pembeli = {"id": user.id, "username": user.username or "", "nama": user.full_name, "admin": isadmin}
     try:
-        data = create_trx(p["kode"], tujuan)
+        antrian_trx.submit(_proses_trx, context.bot, pesan.chat_id, pesan.message_id,
+                           p, tujuan, reff_id, saldo_akhir, pembeli)
+    except antrian_trx.AntrianPenuh:
+        release_saldo(reff_id)
+        pesan.edit_text("❌ Antrian transaksi sedang penuh, silakan coba lagi sebentar.", reply_markup=get_menu(user.id, isadmin))
+    
+    return ConversationHandler.END
+
+def _proses_trx(bot, chat_id, message_id, p, tujuan, reff_id, saldo_akhir, pembeli):
+    """Dijalankan di antrian_trx: panggil provider lalu edit pesan "diproses" dengan hasilnya."""
+    harga = p["harga"]
+    captured = False
+    try:
+        data = create_trx(p["kode"], tujuan, reff_id)
         
         if not data or not data.get("refid"):
+            release_saldo(reff_id)
+            captured = True  # hold sudah selesai (dikembalikan)
             err_msg = data.get("message", "Gagal membuat transaksi.") if data else "Tidak ada respon API."
-            update.message.reply_text(f"❌ Gagal membuat transaksi:\n<b>{err_msg}</b>", parse_mode=ParseMode.HTML, reply_markup=get_menu(update.effective_user.id))
-            return ConversationHandler.END
+            bot.edit_message_text(f"❌ Gagal membuat transaksi:\n<b>{err_msg}</b>", chat_id=chat_id, message_id=message_id,
+                                  parse_mode=ParseMode.HTML, reply_markup=get_menu(pembeli["id"], pembeli.get("admin")))
+            return
+        
+        capture_saldo(reff_id)
+        captured = True
         
-        # Save transaction history
-        riwayat = load_riwayat()
+        # Save transaction history (append satu baris ke log transaksi)
         refid = data["refid"]
-        user = update.effective_user
         
-        riwayat[refid] = {
+        riwayat_log.tambah(refid, {
             "trxid": data.get("trxid", ""),
             "reffid": refid,
             "produk": p["kode"],
@@ -347,32 +403,44 @@ def konfirmasi_step(update: Update, context: CallbackContext):
             "keterangan": data.get("message", ""),
             "waktu": data.get("waktu", ""),
             "harga": harga,
-            "user_id": user.id,
-            "username": user.username or "",
-            "nama": user.full_name,
-        }
-        save_riwayat(riwayat)
-        
-        # Update balance
-        set_saldo(saldo - harga)
+            "user_id": pembeli["id"],
+            "username": pembeli["username"],
+            "nama": pembeli["nama"],
+            "dibuat": time.time(),
+        })
         
-        update.message.reply_text(
-            f"✅ Transaksi berhasil!\n\n📦 Produk: {p['kode']}\n📱 Tujuan: {tujuan}\n🔢 RefID: <code>{refid}</code>\n📊 Status: {data.get('status','pending')}\n💰 Saldo bot: Rp {saldo-harga:,}",
+        bot.edit_message_text(
+            f"✅ Transaksi berhasil!\n\n📦 Produk: {p['kode']}\n📱 Tujuan: {tujuan}\n🔢 RefID: <code>{refid}</code>\n📊 Status: {data.get('status','pending')}\n💰 Saldo bot: Rp {saldo_akhir:,}",
+            chat_id=chat_id, message_id=message_id,
             parse_mode=ParseMode.HTML,
-            reply_markup=get_menu(user.id)
+            reply_markup=get_menu(pembeli["id"], pembeli.get("admin"))
         )
         
     except Exception as e:
-        update.message.reply_text(
+        if not captured:
+            release_saldo(reff_id)
+        bot.edit_message_text(
             f"❌ Error membuat transaksi: {str(e)}",
+            chat_id=chat_id, message_id=message_id,
             parse_mode=ParseMode.HTML,
-            reply_markup=get_menu(update.effective_user.id)
+            reply_markup=get_menu(pembeli["id"], pembeli.get("admin"))
         )
-    
-    finally:
-        context.user_data.clear()
-    
-    return ConversationHandler.END
+
+def antrian_status(update: Update, context: CallbackContext):
+    """/antrian (admin): jumlah transaksi di antrian dan yang sedang diproses provider."""
+    user = update.effective_user
+    isadmin = admin_dari(context, user.id)
+    if not isadmin:
+        return
+    st = antrian_trx.statistik()
+    update.message.reply_text(
+        f"<b>📊 Antrian Transaksi</b>\n\n"
+        f"Menunggu: <b>{st['antri']}</b> / {st['kapasitas_antrian']}\n"
+        f"Diproses: <b>{st['jalan']}</b> / {st['workers']} worker\n"
+        f"Selesai: {st['selesai']} | Error: {st['error']} | Ditolak: {st['ditolak']}",
+        parse_mode=ParseMode.HTML,
+        reply_markup=get_menu(user.id, isadmin)
+    )
 
 def topup_nominal_step(update: Update, context: CallbackContext):
     text = update.message.text.strip()
@@ -383,21 +451,37 @@ def topup_nominal_step(update: Update, context: CallbackContext):
             update.message.reply_text("❌ Nominal minimal 10.000. Masukkan kembali nominal:")
             return TOPUP_NOMINAL
         
+        msg = f"💰 Silakan lakukan pembayaran Top Up sebesar <b>Rp {nominal:,}</b>\n\nScan QRIS berikut:"
+        
+        # Nominal ini sudah pernah dikirim: pakai ulang file_id Telegram (tanpa generate & upload)
+        file_id = get_qris_file_id(nominal)
+        if file_id:
+            try:
+                update.message.reply_photo(photo=file_id, caption=msg, parse_mode=ParseMode.HTML)
+                return ConversationHandler.END
+            except BadRequest:
+                hapus_qris_file_id(nominal)
+        
         # Generate QRIS
-        resp = generate_qris(nominal)
+        resp = generate_qris_png(nominal)
         if resp.get("status") != "success":
             update.message.reply_text(f"❌ Gagal generate QRIS: {resp.get('message', 'Unknown error')}")
             return ConversationHandler.END
         
-        qris_base64 = resp.get("qris_base64")
-        msg = f"💰 Silakan lakukan pembayaran Top Up sebesar <b>Rp {nominal:,}</b>\n\nScan QRIS berikut:"
+        qris_png = resp.get("qris_png")
         
-        if qris_base64:
-            update.message.reply_photo(
-                photo=f"data:image/png;base64,{qris_base64}", 
+        if qris_png:
+            # Upload bytes PNG langsung (multipart) dari memori
+            mulai = time.monotonic()
+            sent = update.message.reply_photo(
+                photo=png_bytesio(qris_png), 
                 caption=msg, 
                 parse_mode=ParseMode.HTML
             )
+            logger.info(f"[QRIS] Upload Rp {nominal:,} ({len(qris_png)} byte, {resp.get('sumber')}) "
+                        f"selesai dalam {(time.monotonic() - mulai) * 1000:.0f} ms")
+            if sent and sent.photo:
+                simpan_qris_file_id(nominal, sent.photo[-1].file_id)
         else:
             update.message.reply_text(msg + "\n\n❌ QRIS tidak tersedia", parse_mode=ParseMode.HTML)
             
@@ -409,50 +493,73 @@ def topup_nominal_step(update: Update, context: CallbackContext):
     
     return ConversationHandler.END
 
-def riwayat_user(query, context):
+RIWAYAT_PER_HALAMAN = 10
+
+def _mulai_dari(data):
+    """Index baris awal halaman dari callback_data "<prefix>|<mulai>" (0 jika tidak ada)."""
+    try:
+        return max(int(data.split("|")[1]), 0)
+    except (IndexError, ValueError):
+        return 0
+
+def _edit_halaman(query, msg, prefix, sebelumnya, berikutnya, menu):
+    """Edit pesan dengan satu halaman teks; tombol ⬅️/➡️ ditaruh di atas menu."""
+    nav = tombol_navigasi(prefix, sebelumnya, berikutnya)
+    reply_markup = InlineKeyboardMarkup([nav] + list(menu.inline_keyboard)) if nav else menu
+    query.edit_message_text(msg, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
+
+def _baris_produk(p):
+    return f"<code>{p['kode']}</code> | {p['nama']} | <b>Rp {p['harga']:,}</b> | Kuota: {p['kuota']}\n"
+
+def _baris_riwayat(r, dengan_user=False):
+    baris = (
+        f"⏰ {r.get('waktu','')}\n"
+        f"🔢 RefID: <code>{r['reffid']}</code>\n"
+        f"📦 {r['produk']} ke {r['tujuan']}\n"
+        f"💰 Rp {r['harga']:,}\n"
+        f"📊 Status: <b>{r['status_text']}</b>\n"
+    )
+    if dengan_user:
+        baris += f"👤 User: {r.get('username','-')}\n"
+    return baris + "\n"
+
+def _sumber_riwayat(ambil, dengan_user=False):
+    """Sumber halaman dari riwayat_log: dibaca per RIWAYAT_PER_HALAMAN transaksi, hanya sebanyak yang dirender."""
+    def sumber(dari):
+        while True:
+            items = ambil(RIWAYAT_PER_HALAMAN, dari)
+            for r in items:
+                yield _baris_riwayat(r, dengan_user)
+            if len(items) < RIWAYAT_PER_HALAMAN:
+                return
+            dari += len(items)
+    return sumber
+
+def riwayat_user(query, context, mulai=0):
     user = query.from_user
+    isadmin = admin_dari(context, user.id)
     try:
-        riwayat = load_riwayat()
-        items = [r for r in riwayat.values() if r.get("user_id") == user.id]
-        items = sorted(items, key=lambda x: x.get("waktu", ""), reverse=True)
-        
-        msg = "<b>📜 Riwayat Transaksi Anda:</b>\n\n"
-        for r in items[:10]:
-            msg += (
-                f"⏰ {r.get('waktu','')}\n"
-                f"🔢 RefID: <code>{r['reffid']}</code>\n"
-                f"📦 {r['produk']} ke {r['tujuan']}\n"
-                f"💰 Rp {r['harga']:,}\n"
-                f"📊 Status: <b>{r['status_text']}</b>\n\n"
-            )
-        if not items:
-            msg += "Belum ada transaksi."
-            
-        query.edit_message_text(msg, parse_mode=ParseMode.HTML, reply_markup=get_menu(user.id))
+        sumber = _sumber_riwayat(lambda limit, offset: riwayat_log.terbaru_user(user.id, limit=limit, offset=offset)[0])
+        msg, sebelumnya, berikutnya = render(
+            sumber, mulai, kepala="<b>📜 Riwayat Transaksi Anda:</b>\n\n",
+            kosong="Belum ada transaksi.", maks_baris=RIWAYAT_PER_HALAMAN,
+            riwayat=tumpukan(context.chat_data, "riwayat"),
+        )
+        _edit_halaman(query, msg, "riwayat", sebelumnya, berikutnya, get_menu(user.id, isadmin))
     except Exception as e:
-        query.edit_message_text(f"❌ Error memuat riwayat: {str(e)}", parse_mode=ParseMode.HTML, reply_markup=get_menu(user.id))
+        query.edit_message_text(f"❌ Error memuat riwayat: {str(e)}", parse_mode=ParseMode.HTML, reply_markup=get_menu(user.id, isadmin))
 
-def semua_riwayat(query, context):
+def semua_riwayat(query, context, mulai=0):
+    isadmin = admin_dari(context, query.from_user.id)
     try:
-        riwayat = list(load_riwayat().values())
-        riwayat = sorted(riwayat, key=lambda x: x.get("waktu", ""), reverse=True)
-        
-        msg = "<b>📜 Semua Riwayat Transaksi (max 30):</b>\n\n"
-        for r in riwayat[:30]:
-            msg += (
-                f"⏰ {r.get('waktu','')}\n"
-                f"🔢 RefID: <code>{r['reffid']}</code>\n"
-                f"📦 {r['produk']} ke {r['tujuan']}\n"
-                f"💰 Rp {r['harga']:,}\n"
-                f"📊 Status: <b>{r['status_text']}</b>\n"
-                f"👤 User: {r.get('username','-')}\n\n"
-            )
-        if not riwayat:
-            msg += "Belum ada transaksi."
-            
-        query.edit_message_text(msg, parse_mode=ParseMode.HTML, reply_markup=get_menu(query.from_user.id))
+        sumber = _sumber_riwayat(lambda limit, offset: riwayat_log.terbaru(limit=limit, offset=offset), dengan_user=True)
+        msg, sebelumnya, berikutnya = render(
+            sumber, mulai, kepala="<b>📜 Semua Riwayat Transaksi:</b>\n\n", kosong="Belum ada transaksi.",
+            riwayat=tumpukan(context.chat_data, "semua_riwayat"),
+        )
+        _edit_halaman(query, msg, "semua_riwayat", sebelumnya, berikutnya, get_menu(query.from_user.id, isadmin))
     except Exception as e:
-        query.edit_message_text(f"❌ Error memuat riwayat: {str(e)}", parse_mode=ParseMode.HTML, reply_markup=get_menu(query.from_user.id))
+        query.edit_message_text(f"❌ Error memuat riwayat: {str(e)}", parse_mode=ParseMode.HTML, reply_markup=get_menu(query.from_user.id, isadmin))
 
 def handle_text(update: Update, context: CallbackContext):
     # Hanya handle text yang bukan bagian dari conversation
@@ -463,50 +570,52 @@ def handle_text(update: Update, context: CallbackContext):
     
     text = update.message.text.strip()
     user = update.effective_user
-    isadmin = is_admin(user.id)
+    isadmin = admin_dari(context, user.id)
     
     if text.startswith("CEK|"):
         try:
             refid = text.split("|", 1)[1].strip()
             if not refid:
-                update.message.reply_text("❌ RefID tidak boleh kosong.", reply_markup=get_menu(user.id))
+                update.message.reply_text("❌ RefID tidak boleh kosong.", reply_markup=get_menu(user.id, isadmin))
                 return
                 
-            data = history(refid)
+            # Status final dijawab dari data lokal/cache; provider hanya untuk yang belum final
+            data, sumber = cek_status(refid)
             
             if not data:
-                update.message.reply_text("❌ Gagal cek status transaksi.", reply_markup=get_menu(user.id))
+                update.message.reply_text("❌ Gagal cek status transaksi.", reply_markup=get_menu(user.id, isadmin))
                 return
                 
             msg = f"🔍 Status transaksi <code>{refid}</code>:\n\n"
             for k, v in data.items():
                 msg += f"<b>{k}</b>: {v}\n"
-            update.message.reply_text(msg, parse_mode=ParseMode.HTML, reply_markup=get_menu(user.id))
+            if sumber != "provider":
+                msg += f"\n<i>(data {sumber})</i>"
+            update.message.reply_text(msg, parse_mode=ParseMode.HTML, reply_markup=get_menu(user.id, isadmin))
             
         except Exception as e:
-            update.message.reply_text(f"❌ Error cek status: {str(e)}", reply_markup=get_menu(user.id))
+            update.message.reply_text(f"❌ Error cek status: {str(e)}", reply_markup=get_menu(user.id, isadmin))
     
     elif text.startswith("TAMBAH|") and isadmin:
         try:
             tambah_text = text.split("|", 1)[1].strip()
             if not tambah_text:
-                update.message.reply_text("❌ Nilai tidak boleh kosong.", reply_markup=get_menu(user.id))
+                update.message.reply_text("❌ Nilai tidak boleh kosong.", reply_markup=get_menu(user.id, isadmin))
                 return
                 
             tambah = int(tambah_text)
-            saldo = get_saldo() + tambah
-            set_saldo(saldo)
-            update.message.reply_text(f"✅ Saldo ditambah. Saldo sekarang: <b>Rp {saldo:,}</b>", parse_mode=ParseMode.HTML, reply_markup=get_menu(user.id))
+            saldo = tambah_saldo(tambah, ref=f"admin:{user.id}")
+            update.message.reply_text(f"✅ Saldo ditambah. Saldo sekarang: <b>Rp {saldo:,}</b>", parse_mode=ParseMode.HTML, reply_markup=get_menu(user.id, isadmin))
             
         except ValueError:
-            update.message.reply_text("❌ Format nilai tidak valid.", reply_markup=get_menu(user.id))
+            update.message.reply_text("❌ Format nilai tidak valid.", reply_markup=get_menu(user.id, isadmin))
         except Exception as e:
-            update.message.reply_text(f"❌ Error: {str(e)}", reply_markup=get_menu(user.id))
+            update.message.reply_text(f"❌ Error: {str(e)}", reply_markup=get_menu(user.id, isadmin))
     
     else:
         update.message.reply_text(
             "❌ Perintah tidak dikenali. Gunakan menu di bawah.", 
-            reply_markup=get_menu(user.id)
+            reply_markup=get_menu(user.id, isadmin)
         )
 
 # Create conversation handler
@@ -1,14 +1,93 @@
-from telegram.ext import Updater, CommandHandler, CallbackQueryHandler, MessageHandler, Filters, ConversationHandler
-from config import TOKEN
+import signal
+import threading
+from telegram import Update
+from telegram.ext import (
+    Updater, CommandHandler, CallbackQueryHandler, MessageHandler, TypeHandler, Filters, ConversationHandler
+)
+from config import (
+    TOKEN, STOK_REFRESH_INTERVAL, REKON_INTERVAL, KATALOG_SYNC_INTERVAL, BOT_MODE, WEBHOOK_URL, WEBHOOK_PORT, WEBHOOK_LISTEN,
+    TELEGRAM_WEBHOOK_SECRET, TELEGRAM_WEBHOOK_URL, WEBHOOK_CERT, WEBHOOK_KEY
+)
+from produk import refresh_stok_job, sinkron_katalog_job
+from rekonsiliasi import rekonsiliasi_job, sapu_hold_job
+from peran import tandai_peran
+import riwayat_log
+import antrian_trx
+import webhook
+import notifikasi
+import pengguna
 from handlers import (
     start, main_menu_callback, produk_pilih_callback, input_tujuan_step, konfirmasi_step,
-    topup_nominal_step, admin_edit_produk_step, handle_text, cancel,
+    topup_nominal_step, admin_edit_produk_step, handle_text, cancel, antrian_status,
     CHOOSING_PRODUK, INPUT_TUJUAN, KONFIRMASI, TOPUP_NOMINAL, ADMIN_EDIT
 )
 
+def jalankan_flask():
+    """Server Flask webhook.py: callback provider (/webhook) dan update Telegram (/telegram/<secret>)."""
+    ssl_context = (WEBHOOK_CERT, WEBHOOK_KEY) if WEBHOOK_CERT and WEBHOOK_KEY else None
+    webhook.app.run(host=WEBHOOK_LISTEN, port=WEBHOOK_PORT, ssl_context=ssl_context,
+                    threaded=True, use_reloader=False)
+
+def telegram_webhook_url():
+    base = TELEGRAM_WEBHOOK_URL
+    if not base:
+        # Default: domain yang sama dengan callback provider (WEBHOOK_URL)
+        host = WEBHOOK_URL.split("://")[-1].split("/")[0]
+        base = f"https://{host}"
+    return f"{base.rstrip('/')}/telegram/{TELEGRAM_WEBHOOK_SECRET}"
+
+def jalankan_polling(updater):
+    threading.Thread(target=jalankan_flask, name="flask-webhook", daemon=True).start()
+    updater.start_polling()
+    updater.idle()
+
+def _pasang_sinyal_berhenti():
+    """
+    SIGTERM (systemctl/docker stop) & SIGINT di mode webhook: keluar dari app.run()
+    secara normal agar dispatcher, job queue, antrian transaksi dan notifikasi
+    dihentikan dengan rapi (mode polling sudah ditangani updater.idle()).
+    """
+    def berhenti(signum, frame):
+        # Sinyal berikutnya diabaikan supaya proses pembersihan tidak terputus
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, signal.SIG_IGN)
+        print(f"🛑 Sinyal {signal.Signals(signum).name} diterima, bot dihentikan...")
+        raise KeyboardInterrupt
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, berhenti)
+
+def jalankan_webhook(updater):
+    if not TELEGRAM_WEBHOOK_SECRET:
+        raise SystemExit("❌ TELEGRAM_WEBHOOK_SECRET wajib diisi untuk BOT_MODE=webhook")
+    # Dispatcher & JobQueue dijalankan manual; update masuk lewat Flask -> update_queue
+    updater.job_queue.start()
+    threading.Thread(target=updater.dispatcher.start, name="dispatcher", daemon=True).start()
+    certificate = open(WEBHOOK_CERT, "rb") if WEBHOOK_CERT else None
+    try:
+        updater.bot.set_webhook(url=telegram_webhook_url(), certificate=certificate, max_connections=40)
+    finally:
+        if certificate:
+            certificate.close()
+    _pasang_sinyal_berhenti()
+    try:
+        jalankan_flask()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        updater.dispatcher.stop()
+        updater.job_queue.stop()
+
 def main():
+    # ✅ Bangun index riwayat transaksi dari log sekali saat startup
+    riwayat_log.muat()
+
     updater = Updater(TOKEN, use_context=True)
     dp = updater.dispatcher
+    webhook.updater = updater
+    notifikasi.mulai(updater.bot)
+
+    # ✅ Peran user (admin/user) ditentukan sekali per update, dipakai handler lewat context.admin
+    dp.add_handler(TypeHandler(Update, tandai_peran), group=-1)
 
     # ✅ VERSI FIXED - Pattern matching yang benar
     conv_handler = ConversationHandler(
@@ -18,7 +97,7 @@ def main():
         ],
         states={
             CHOOSING_PRODUK: [
-                CallbackQueryHandler(produk_pilih_callback, pattern="^produk_static\\|"),
+                CallbackQueryHandler(produk_pilih_callback, pattern="^(produk_static|beli_produk)\\|"),
                 CallbackQueryHandler(main_menu_callback, pattern="^back_main$"),
             ],
             INPUT_TUJUAN: [
@@ -53,13 +132,34 @@ def main():
     dp.add_handler(CommandHandler("start", start))
     dp.add_handler(CommandHandler("cancel", cancel))
     dp.add_handler(CommandHandler("batal", cancel))
+    dp.add_handler(CommandHandler("antrian", antrian_status))
     
     # ✅ Handler untuk pesan teks
     dp.add_handler(MessageHandler(Filters.text & ~Filters.command, handle_text))
 
-    print("🚀 Bot Akrab Started Successfully!")
-    updater.start_polling()
-    updater.idle()
+    # ✅ Refresh stok provider di background agar menu tidak menunggu provider
+    updater.job_queue.run_repeating(refresh_stok_job, interval=STOK_REFRESH_INTERVAL, first=0)
+    # ✅ Katalog produk disinkronkan dari provider.list_product (hanya baris yang berubah ditulis)
+    updater.job_queue.run_repeating(sinkron_katalog_job, interval=KATALOG_SYNC_INTERVAL, first=5)
+    updater.job_queue.run_repeating(notifikasi.bersihkan_job, interval=6 * 3600, first=600)
+    # ✅ Transaksi pending yang callback-nya tidak datang dicek ke provider.history
+    updater.job_queue.run_repeating(rekonsiliasi_job, interval=REKON_INTERVAL, first=60)
+    # ✅ Hold saldo yang tertinggal (proses mati sebelum capture/release) diselesaikan saat startup & berkala
+    updater.job_queue.run_repeating(sapu_hold_job, interval=600, first=0)
+    # ✅ last_seen user yang terkumpul di memori disimpan berkala (walau bot sedang sepi)
+    updater.job_queue.run_repeating(pengguna.flush_job, interval=pengguna.FLUSH_INTERVAL, first=pengguna.FLUSH_INTERVAL)
+
+    print(f"🚀 Bot Akrab Started Successfully! (mode: {BOT_MODE})")
+    try:
+        if BOT_MODE == "webhook":
+            jalankan_webhook(updater)
+        else:
+            jalankan_polling(updater)
+    finally:
+        # ✅ Tunggu transaksi yang sedang diproses provider selesai sebelum keluar
+        antrian_trx.shutdown(wait=True)
+        notifikasi.berhenti()
+        pengguna.flush_last_seen()
 
 if __name__ == "__main__":
     main()
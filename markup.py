@@ -1,14 +1,32 @@
+import threading
+from functools import lru_cache
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-from config import ADMIN_IDS
-from produk import get_produk_list
+from peran import is_admin
+from produk import get_katalog
 
-def is_admin(user_id):
-    """Cek apakah user adalah admin berdasarkan ADMIN_IDS dari config."""
-    return user_id in ADMIN_IDS
+class KeyboardTetap(InlineKeyboardMarkup):
+    """
+    InlineKeyboardMarkup yang tidak pernah diubah setelah dibuat: baris disimpan
+    sebagai tuple dan hasil to_json() di-cache, sehingga objek yang sama bisa
+    dipakai ulang di setiap reply tanpa serialisasi ulang.
+    """
 
+    __slots__ = ("_json",)
+
+    def __init__(self, inline_keyboard, **kwargs):
+        super().__init__(inline_keyboard, **kwargs)
+        self.inline_keyboard = tuple(tuple(row) for row in self.inline_keyboard)
+        self._json = None
+
+    def to_json(self):
+        if self._json is None:
+            self._json = super().to_json()
+        return self._json
+
+@lru_cache(maxsize=None)
 def menu_user():
-    """Menu utama untuk user biasa."""
-    return InlineKeyboardMarkup([
+    """Menu utama untuk user biasa (dibuat sekali, objek yang sama dipakai ulang)."""
+    return KeyboardTetap([
         [
             InlineKeyboardButton("📦 Lihat Produk", callback_data='lihat_produk'),
             InlineKeyboardButton("🛒 Beli Produk", callback_data='beli_produk')
@@ -23,9 +41,10 @@ def menu_user():
         ],
     ])
 
+@lru_cache(maxsize=None)
 def menu_admin():
-    """Menu utama untuk admin (fitur tambahan & layout modern)."""
-    return InlineKeyboardMarkup([
+    """Menu utama untuk admin (fitur tambahan & layout modern), dibuat sekali."""
+    return KeyboardTetap([
         [
             InlineKeyboardButton("📦 Produk", callback_data='lihat_produk'),
             InlineKeyboardButton("🛒 Beli", callback_data='beli_produk'),
@@ -46,37 +65,86 @@ def menu_admin():
         ],
     ])
 
-def get_menu(user_id):
-    """Ambil menu sesuai role user."""
-    return menu_admin() if is_admin(user_id) else menu_user()
+def get_menu(user_id, admin=None):
+    """Ambil menu sesuai role user (`admin` dari context.admin jika sudah diketahui)."""
+    if admin is None:
+        admin = is_admin(user_id)
+    return menu_admin() if admin else menu_user()
+
+# Keyboard produk di-cache per versi katalog (Katalog.kunci) dan per halaman. Jika
+# katalog berubah tapi label tombol halaman itu sama (misal hanya stok yang berubah),
+# objek lama dipakai lagi. Katalog bisa berisi ratusan produk, jadi tombol dibagi
+# per PRODUK_PER_HALAMAN dengan navigasi "<prefix>|<index awal>".
+PRODUK_PER_HALAMAN = 40
+
+_keyboard_produk = {}  # (jenis, mulai) -> (kunci katalog, label, KeyboardTetap)
+_keyboard_lock = threading.Lock()
 
-def produk_inline_keyboard():
-    """Tampilkan produk yang bisa dipilih user saat pembelian."""
-    produk_list = get_produk_list()
+def _keyboard_katalog(jenis, bangun, mulai=0):
+    kat = get_katalog()
+    if not 0 <= mulai < len(kat.produk):
+        mulai = 0
+    mulai -= mulai % PRODUK_PER_HALAMAN
+    simpan = _keyboard_produk.get((jenis, mulai))
+    if simpan and simpan[0] == kat.kunci:
+        return simpan[2]
+    akhir = mulai + PRODUK_PER_HALAMAN
+    label = (mulai, len(kat.produk)) + tuple((p["kode"], p["nama"]) for p in kat.produk[mulai:akhir])
+    with _keyboard_lock:
+        simpan = _keyboard_produk.get((jenis, mulai))
+        if simpan and simpan[1] == label:
+            markup = simpan[2]
+        else:
+            markup = bangun(label)
+        _keyboard_produk[(jenis, mulai)] = (kat.kunci, label, markup)
+    return markup
+
+def _navigasi_produk(prefix, mulai, total):
+    nav = []
+    if mulai > 0:
+        nav.append(InlineKeyboardButton("⬅️ Sebelumnya", callback_data=f"{prefix}|{mulai - PRODUK_PER_HALAMAN}"))
+    if mulai + PRODUK_PER_HALAMAN < total:
+        nav.append(InlineKeyboardButton("➡️ Berikutnya", callback_data=f"{prefix}|{mulai + PRODUK_PER_HALAMAN}"))
+    return [nav] if nav else []
+
+def _bangun_produk_keyboard(label):
+    mulai, total = label[:2]
     keyboard = []
-    for i, p in enumerate(produk_list):
+    for kode, nama in label[2:]:
+        # Kode (bukan posisi) di callback_data: keyboard lama tetap memilih produk yang sama
+        # walau katalog sudah disinkron ulang dan urutannya bergeser
         keyboard.append([
-            InlineKeyboardButton(f"{p['kode']} | {p['nama']}", callback_data=f"produk_static|{i}")
+            InlineKeyboardButton(f"{kode} | {nama}", callback_data=f"produk_static|{kode}")
         ])
+    keyboard += _navigasi_produk("beli_produk", mulai, total)
     keyboard.append([InlineKeyboardButton("⬅️ Kembali", callback_data="back_main")])
-    return InlineKeyboardMarkup(keyboard)
+    return KeyboardTetap(keyboard)
 
-def admin_produk_list_keyboard():
-    """List produk untuk admin (edit produk)."""
-    produk_list = get_produk_list()
+def _bangun_admin_produk_keyboard(label):
+    mulai, total = label[:2]
     keyboard = []
-    for p in produk_list:
+    for kode, nama in label[2:]:
         keyboard.append([
             InlineKeyboardButton(
-                f"{p['kode']} | {p['nama']} (Edit)", callback_data=f"admin_edit_produk|{p['kode']}"
+                f"{kode} | {nama} (Edit)", callback_data=f"admin_edit_produk|{kode}"
             )
         ])
+    keyboard += _navigasi_produk("manajemen_produk", mulai, total)
     keyboard.append([InlineKeyboardButton("⬅️ Kembali", callback_data="back_admin")])
-    return InlineKeyboardMarkup(keyboard)
+    return KeyboardTetap(keyboard)
+
+def produk_inline_keyboard(mulai=0):
+    """Tampilkan produk yang bisa dipilih user saat pembelian (satu halaman mulai dari produk ke-`mulai`)."""
+    return _keyboard_katalog("user", _bangun_produk_keyboard, mulai)
+
+def admin_produk_list_keyboard(mulai=0):
+    """List produk untuk admin (edit produk), satu halaman mulai dari produk ke-`mulai`."""
+    return _keyboard_katalog("admin", _bangun_admin_produk_keyboard, mulai)
 
+@lru_cache(maxsize=256)
 def admin_edit_produk_keyboard(kode):
     """Keyboard untuk edit produk di menu admin."""
-    return InlineKeyboardMarkup([
+    return KeyboardTetap([
         [
             InlineKeyboardButton("💵 Edit Harga", callback_data=f"editharga|{kode}"),
             InlineKeyboardButton("📝 Edit Deskripsi", callback_data=f"editdeskripsi|{kode}")
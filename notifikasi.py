@@ -0,0 +1,117 @@
+import time
+import logging
+import threading
+from telegram.error import RetryAfter, BadRequest, Unauthorized
+import db
+
+logger = logging.getLogger(__name__)
+
+# Antrian notifikasi keluar yang disimpan di db (tabel notif_queue).
+# kirim_nanti() hanya menulis satu baris lalu kembali, jadi request webhook tidak
+# menunggu Telegram. Thread pengirim mengirim dengan batas global (30 pesan/detik)
+# dan per chat (1 pesan/detik). Baris baru ditandai terkirim setelah Telegram
+# menerima pesannya, jadi notifikasi yang belum terkirim saat proses mati akan
+# dikirim ulang setelah restart (at-least-once).
+
+GLOBAL_PER_DETIK = 30
+JEDA_PER_CHAT = 1.0  # detik antar pesan ke chat yang sama
+MAKS_PERCOBAAN = 8
+MAKS_BACKOFF = 300  # detik
+
+_bangun = threading.Event()
+_stop = threading.Event()
+_thread = None
+
+def kirim_nanti(chat_id, teks, parse_mode=None):
+    """Simpan notifikasi ke antrian (durable). Return id antrian."""
+    notif_id = db.tambah_notif(chat_id, teks, parse_mode)
+    _bangun.set()
+    return notif_id
+
+def bangunkan():
+    """Beri tahu thread pengirim bahwa ada baris baru di notif_queue (mis. ditulis langsung lewat db)."""
+    _bangun.set()
+
+class _TokenBucket:
+    def __init__(self, per_detik):
+        self.per_detik = per_detik
+        self.token = float(per_detik)
+        self.terakhir = time.monotonic()
+
+    def ambil(self):
+        """Tunggu sampai ada token, lalu pakai satu."""
+        while True:
+            now = time.monotonic()
+            self.token = min(self.per_detik, self.token + (now - self.terakhir) * self.per_detik)
+            self.terakhir = now
+            if self.token >= 1:
+                self.token -= 1
+                return
+            time.sleep((1 - self.token) / self.per_detik)
+
+def _loop(bot):
+    bucket = _TokenBucket(GLOBAL_PER_DETIK)
+    terakhir_chat = {}  # chat_id -> waktu kirim terakhir (monotonic)
+    while not _stop.is_set():
+        try:
+            batch = db.ambil_notif_siap(time.time())
+        except Exception:
+            logger.exception("[NOTIF] Gagal membaca antrian")
+            batch = []
+        if not batch:
+            _bangun.wait(1.0)
+            _bangun.clear()
+            continue
+        for notif_id, chat_id, teks, parse_mode, percobaan in batch:
+            if _stop.is_set():
+                break
+            jeda = JEDA_PER_CHAT - (time.monotonic() - terakhir_chat.get(chat_id, 0))
+            if jeda > 0:
+                # Chat ini baru saja dikirimi pesan: tunda tanpa menghitung sebagai percobaan
+                db.jadwal_ulang_notif(notif_id, time.time() + jeda, tambah_percobaan=False)
+                continue
+            bucket.ambil()
+            try:
+                bot.send_message(chat_id, teks, parse_mode=parse_mode)
+                terakhir_chat[chat_id] = time.monotonic()
+                db.tandai_notif_terkirim(notif_id)
+            except RetryAfter as e:
+                # Flood-wait berlaku untuk bot, jadi seluruh pengiriman ikut berhenti sejenak
+                logger.warning(f"[NOTIF] RetryAfter {e.retry_after}s")
+                db.jadwal_ulang_notif(notif_id, time.time() + e.retry_after, str(e), tambah_percobaan=False)
+                _stop.wait(e.retry_after)
+                break
+            except (BadRequest, Unauthorized) as e:
+                # Chat tidak valid / bot diblokir: tidak ada gunanya diulang
+                logger.warning(f"[NOTIF] Gagal permanen ke {chat_id}: {e}")
+                db.tandai_notif_gagal(notif_id, str(e))
+            except Exception as e:
+                # TimedOut/NetworkError/dll: coba lagi dengan backoff eksponensial
+                if percobaan + 1 >= MAKS_PERCOBAAN:
+                    logger.error(f"[NOTIF] Menyerah kirim ke {chat_id} setelah {percobaan + 1}x: {e}")
+                    db.tandai_notif_gagal(notif_id, str(e))
+                else:
+                    backoff = min(2 ** percobaan, MAKS_BACKOFF)
+                    db.jadwal_ulang_notif(notif_id, time.time() + backoff, str(e))
+        if len(terakhir_chat) > 10000:
+            batas = time.monotonic() - JEDA_PER_CHAT
+            terakhir_chat = {k: v for k, v in terakhir_chat.items() if v > batas}
+
+def mulai(bot):
+    """Jalankan thread pengirim notifikasi (sekali saat startup)."""
+    global _thread
+    if _thread and _thread.is_alive():
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_loop, args=(bot,), name="notifikasi", daemon=True)
+    _thread.start()
+
+def berhenti(timeout=5):
+    _stop.set()
+    _bangun.set()
+    if _thread:
+        _thread.join(timeout)
+
+def bersihkan_job(context):
+    """Job JobQueue: hapus notifikasi terkirim yang sudah lama."""
+    db.hapus_notif_terkirim()
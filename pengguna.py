@@ -0,0 +1,61 @@
+import time
+import logging
+import threading
+import db
+
+logger = logging.getLogger(__name__)
+
+# Cache user yang sudah dikenal (user_id -> (username, nama)) agar handler tidak
+# menulis ke tabel users di setiap klik. Tulis ke db hanya jika user baru atau
+# username/nama berubah; last_seen dikumpulkan di memori lalu disimpan
+# sekaligus tiap FLUSH_INTERVAL detik.
+
+FLUSH_INTERVAL = 60  # detik
+
+_dikenal = {}
+_last_seen = {}  # user_id -> timestamp terakhir terlihat (belum disimpan)
+_terakhir_flush = time.monotonic()
+_lock = threading.Lock()
+_flush_lock = threading.Lock()
+
+def catat_user(user):
+    """Pastikan user Telegram ada di db (upsert hanya jika berubah) dan catat last_seen."""
+    global _terakhir_flush
+    info = (user.username or "", user.full_name or "")
+    with _lock:
+        lama = _dikenal.get(user.id)
+        _last_seen[user.id] = time.time()
+        perlu_flush = time.monotonic() - _terakhir_flush >= FLUSH_INTERVAL
+    if lama != info:
+        if lama is None and tuple(db.get_user_info(user.id) or ()) == info:
+            pass  # sudah ada dan sama persis (misal setelah restart): cukup dicache
+        else:
+            db.tambah_user(user.id, *info)
+        with _lock:
+            _dikenal[user.id] = info
+    if perlu_flush:
+        flush_last_seen()
+
+def flush_last_seen():
+    """Simpan semua last_seen yang terkumpul dalam satu transaksi db."""
+    global _terakhir_flush
+    if not _flush_lock.acquire(blocking=False):
+        return  # flush lain sedang berjalan
+    try:
+        with _lock:
+            daftar = list(_last_seen.items())
+            _last_seen.clear()
+            _terakhir_flush = time.monotonic()
+        try:
+            db.simpan_last_seen(daftar)
+        except Exception:
+            logger.exception("[USER] Gagal menyimpan last_seen")
+            with _lock:
+                for user_id, ts in daftar:
+                    _last_seen[user_id] = max(ts, _last_seen.get(user_id, 0))
+    finally:
+        _flush_lock.release()
+
+def flush_job(context):
+    """Job JobQueue: flush last_seen walau tidak ada interaksi baru."""
+    flush_last_seen()
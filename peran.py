@@ -0,0 +1,65 @@
+import os
+import json
+import time
+import logging
+import threading
+from config import ADMIN_IDS
+
+logger = logging.getLogger(__name__)
+
+# Peran user (admin / user) dari ADMIN_IDS di config.json, disimpan sebagai
+# frozenset supaya cek keanggotaan O(1). File config dicek paling sering tiap
+# CEK_INTERVAL detik; jika berubah (mtime/ukuran/inode), ADMIN_IDS dibaca ulang
+# tanpa restart bot. Peran tiap update ditentukan sekali oleh tandai_peran()
+# (TypeHandler group -1) dan disimpan di context.admin untuk handler berikutnya.
+
+CONFIG_FILE = "config.json"
+CEK_INTERVAL = 5  # detik
+
+def _signature():
+    try:
+        st = os.stat(CONFIG_FILE)
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+    except OSError:
+        return None
+
+_admin_ids = frozenset(ADMIN_IDS)
+_signature_dimuat = _signature()
+_terakhir_cek = time.monotonic()
+_lock = threading.Lock()
+
+def muat_ulang(paksa=False):
+    """Baca ulang ADMIN_IDS jika config.json berubah. Return frozenset admin yang berlaku."""
+    global _admin_ids, _signature_dimuat, _terakhir_cek
+    if not paksa and time.monotonic() - _terakhir_cek < CEK_INTERVAL:
+        return _admin_ids
+    with _lock:
+        _terakhir_cek = time.monotonic()
+        sig = _signature()
+        if not paksa and sig == _signature_dimuat:
+            return _admin_ids
+        try:
+            with open(CONFIG_FILE) as f:
+                baru = frozenset(int(x) for x in json.load(f)["ADMIN_IDS"])
+        except Exception as e:
+            # Config sedang ditulis / rusak: tetap pakai daftar admin lama
+            logger.error(f"Gagal membaca ADMIN_IDS dari {CONFIG_FILE}: {e}")
+            return _admin_ids
+        if baru != _admin_ids:
+            logger.info(f"ADMIN_IDS dimuat ulang: {len(baru)} admin")
+        _admin_ids = baru
+        _signature_dimuat = sig
+        return _admin_ids
+
+def is_admin(user_id):
+    return user_id in muat_ulang()
+
+def tandai_peran(update, context):
+    """TypeHandler (group -1): tentukan peran user sekali per update, simpan di context.admin."""
+    user = update.effective_user if update else None
+    context.admin = bool(user) and is_admin(user.id)
+
+def admin_dari(context, user_id):
+    """Peran dari context.admin (jika sudah ditandai), atau cek langsung."""
+    admin = getattr(context, "admin", None)
+    return is_admin(user_id) if admin is None else admin
@@ -1,11 +1,20 @@
 import json
 import os
+import time
+import tempfile
 import logging
-from provider import cek_stock_akrab
+import threading
+from provider import cek_stock_akrab, list_product
+import db
+import halaman
+from config import STOK_TTL
 
 # Setup logger
 logger = logging.getLogger(__name__)
 
+# Katalog awal sebelum sinkron pertama dengan provider berhasil. Untuk kode yang
+# ada di sini, nama/harga/deskripsi di bawah tetap dipakai walau provider
+# mengirim nilai lain (harga jual kita, bukan harga provider).
 LIST_PRODUK_TETAP = [
     {"kode": "bpal1",    "nama": "Bonus Akrab L - 1 hari",   "harga": 5000,  "deskripsi": "Paket harian murah", "kuota": 0},
     {"kode": "bpal11",   "nama": "Bonus Akrab L - 11 hari",  "harga": 50000, "deskripsi": "Paket 11 hari hemat", "kuota": 0},
@@ -36,90 +45,419 @@ LIST_PRODUK_TETAP = [
 
 CUSTOM_FILE = "produk_custom.json"
 
+# ========== OVERLAY CUSTOM (produk_custom.json) ==========
+# Isi produk_custom.json disimpan di memori dan hanya dibaca ulang jika
+# mtime/ukuran/inode file berubah (misal diedit manual). Tulis selalu atomic
+# (file sementara + os.replace) lalu memanggil pendengar perubahan, sehingga
+# cache yang bergantung (katalog, keyboard produk) langsung tidak berlaku.
+
+class OverlayCustom:
+    def __init__(self, path):
+        self.path = path
+        self.versi = 0  # naik setiap kali isi overlay berubah (dibaca ulang / ditulis)
+        self._data = {}
+        self._overrides = {}
+        self._signature = None
+        self._dimuat = False
+        self._lock = threading.Lock()
+        self._tulis_lock = threading.RLock()  # dipegang ubah() selama read-modify-write, lalu tulis()
+        self._pendengar = []
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_mtime_ns, st.st_size, st.st_ino)
+        except OSError:
+            return None
+
+    def _pasang(self, data, signature):
+        # Dipanggil dengan self._lock dipegang
+        self._data = data
+        self._overrides = {
+            k.lower(): {kk: vv for kk, vv in v.items() if kk != "nama"}
+            for k, v in data.items() if isinstance(v, dict)
+        }
+        self._signature = signature
+        self._dimuat = True
+        self.versi += 1
+
+    def periksa(self):
+        """Baca ulang file jika berubah sejak terakhir dibaca. Return True jika isi berubah."""
+        sig = self._stat()
+        if self._dimuat and sig == self._signature:
+            return False
+        with self._lock:
+            if self._dimuat and sig == self._signature:
+                return False
+            data = {}
+            if sig is not None:
+                try:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        data = json.load(f)
+                    if not isinstance(data, dict):
+                        raise ValueError("isi bukan object JSON")
+                except Exception as e:
+                    # File rusak / sedang ditulis manual: tetap pakai isi lama
+                    logger.error(f"Error loading custom produk: {e}")
+                    self._signature = sig
+                    self._dimuat = True
+                    return False
+            self._pasang(data, sig)
+        self._beritahu()
+        return True
+
+    def semua(self):
+        """Salinan isi file {kode: {...}} (boleh diubah pemanggil)."""
+        self.periksa()
+        with self._lock:
+            return {k: dict(v) if isinstance(v, dict) else v for k, v in self._data.items()}
+
+    def overrides(self):
+        """{kode_lower: {harga, deskripsi, ...}} tanpa field nama. Jangan diubah (dipakai bersama)."""
+        self.periksa()
+        return self._overrides
+
+    def tulis(self, data):
+        """Tulis atomic (file sementara unik + fsync + rename) lalu beritahu pendengar. Return True jika berhasil."""
+        with self._tulis_lock:
+            fd, tmp = tempfile.mkstemp(prefix=os.path.basename(self.path) + ".",
+                                       suffix=".tmp", dir=os.path.dirname(self.path) or ".")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(data, f, indent=2, ensure_ascii=False)
+                    f.flush()
+                    os.fsync(f.fileno())
+                # mkstemp membuat file 0600: samakan dengan izin file lama
+                os.chmod(tmp, os.stat(self.path).st_mode & 0o777 if os.path.exists(self.path) else 0o644)
+                os.replace(tmp, self.path)
+            except Exception as e:
+                logger.error(f"Error saving custom produk: {e}")
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+                return False
+            with self._lock:
+                self._pasang(data, self._stat())
+        self._beritahu()
+        return True
+
+    def ubah(self, fn):
+        """Read-modify-write: fn(data) mengubah salinan isi overlay, lalu ditulis. Return hasil tulis()."""
+        with self._tulis_lock:
+            data = self.semua()
+            fn(data)
+            return self.tulis(data)
+
+    def dengarkan(self, callback):
+        """Daftarkan callback() yang dipanggil setiap kali isi overlay berubah."""
+        self._pendengar.append(callback)
+
+    def _beritahu(self):
+        for callback in list(self._pendengar):
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Error pendengar overlay custom: {e}")
+
+_custom = OverlayCustom(CUSTOM_FILE)
+
 def load_custom_produk():
-    try:
-        if os.path.exists(CUSTOM_FILE):
-            with open(CUSTOM_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-        return {}
-    except Exception as e:
-        logger.error(f"Error loading custom produk: {e}")
-        return {}
+    return _custom.semua()
 
 def save_custom_produk(data):
-    try:
-        with open(CUSTOM_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
-        return True
-    except Exception as e:
-        logger.error(f"Error saving custom produk: {e}")
-        return False
+    return _custom.tulis(data)
 
 def get_all_custom_produk():
     try:
-        data = load_custom_produk()
-        result = {}
-        for k, v in data.items():
-            if isinstance(v, dict):
-                v_copy = v.copy()
-                v_copy.pop("nama", None)
-                result[k.lower()] = v_copy
-        return result
+        return {k: dict(v) for k, v in _custom.overrides().items()}
     except Exception as e:
         logger.error(f"Error getting custom produk: {e}")
         return {}
 
+def _parse_stock(stok_raw):
+    """Ubah respon cek_stock_akrab jadi {type: sisa_slot}. Return None jika respon tidak valid."""
+    if isinstance(stok_raw, dict):
+        stok_data = stok_raw
+    elif isinstance(stok_raw, str):
+        if not stok_raw.strip():
+            return None
+        if stok_raw.strip().lower().startswith("<html"):
+            logger.warning("Provider returned HTML instead of JSON")
+            return None
+        stok_data = json.loads(stok_raw)
+    else:
+        logger.warning(f"Unexpected stock format: {type(stok_raw)}")
+        return None
+    if "data" in stok_data and isinstance(stok_data["data"], list):
+        slot_map = {}
+        for item in stok_data["data"]:
+            if isinstance(item, dict) and "type" in item:
+                product_type = item["type"].lower()
+                sisa_slot = item.get("sisa_slot", 0)
+                try:
+                    sisa_slot = int(sisa_slot) if sisa_slot not in [None, ""] else 0
+                except (ValueError, TypeError):
+                    sisa_slot = 0
+                slot_map[product_type] = sisa_slot
+        return slot_map
+    return {}
+
 def parse_stock_from_provider():
     try:
-        stok_raw = cek_stock_akrab()
-        if isinstance(stok_raw, dict):
-            stok_data = stok_raw
-        elif isinstance(stok_raw, str):
-            if stok_raw.strip().lower().startswith("<html"):
-                logger.warning("Provider returned HTML instead of JSON")
-                return {}
-            stok_data = json.loads(stok_raw)
-        else:
-            logger.warning(f"Unexpected stock format: {type(stok_raw)}")
-            return {}
-        if "data" in stok_data and isinstance(stok_data["data"], list):
-            slot_map = {}
-            for item in stok_data["data"]:
-                if isinstance(item, dict) and "type" in item:
-                    product_type = item["type"].lower()
-                    sisa_slot = item.get("sisa_slot", 0)
-                    try:
-                        sisa_slot = int(sisa_slot) if sisa_slot not in [None, ""] else 0
-                    except (ValueError, TypeError):
-                        sisa_slot = 0
-                    slot_map[product_type] = sisa_slot
-            return slot_map
-        return {}
+        return _parse_stock(cek_stock_akrab()) or {}
     except Exception as e:
         logger.error(f"Error parsing stock from provider: {e}")
         return {}
 
+# ========== SNAPSHOT STOK (TTL + REFRESH BACKGROUND) ==========
+# Semua handler membaca snapshot yang sama; provider hanya dipanggil oleh satu
+# thread refresh dalam satu waktu (single-flight). Jika provider lambat/gagal,
+# data lama tetap dipakai dan umurnya bisa dilihat lewat info_umur_stok().
+
+_STOK_JEDA_GAGAL = 5  # detik, jeda sebelum mencoba lagi saat belum ada data sama sekali
+_stok_refresh_lock = threading.Lock()
+_stok_snapshot = {"slot_map": {}, "raw": "", "fetched_at": 0.0, "versi": 0}
+_stok_last_attempt = 0.0
+
+def refresh_stok():
+    """Ambil stok terbaru dari provider. Return False jika refresh lain sedang berjalan."""
+    if not _stok_refresh_lock.acquire(blocking=False):
+        return False
+    try:
+        _refresh_stok_locked()
+        return True
+    finally:
+        _stok_refresh_lock.release()
+
+def _refresh_stok_locked():
+    global _stok_snapshot, _stok_last_attempt
+    _stok_last_attempt = time.time()
+    try:
+        raw = cek_stock_akrab()
+        slot_map = _parse_stock(raw)
+    except Exception as e:
+        logger.error(f"Error refresh stok provider: {e}")
+        slot_map = None
+    old = _stok_snapshot
+    if slot_map is None:
+        # Provider gagal: pertahankan data lama, jangan perbarui fetched_at
+        return
+    versi = old["versi"] + 1 if slot_map != old["slot_map"] else old["versi"]
+    # Ganti dict snapshot sekaligus agar pembaca tidak melihat data setengah jadi
+    _stok_snapshot = {"slot_map": slot_map, "raw": raw, "fetched_at": time.time(), "versi": versi}
+
+def _refresh_stok_background():
+    if _stok_refresh_lock.locked():
+        return
+    threading.Thread(target=refresh_stok, name="refresh-stok", daemon=True).start()
+
+def get_stok_snapshot():
+    """Return snapshot stok {slot_map, raw, fetched_at, versi} tanpa menunggu provider jika sudah ada data."""
+    snap = _stok_snapshot
+    if not snap["fetched_at"]:
+        # Belum pernah berhasil: tunggu refresh yang sedang berjalan (atau jalankan sendiri)
+        with _stok_refresh_lock:
+            if not _stok_snapshot["fetched_at"] and time.time() - _stok_last_attempt > _STOK_JEDA_GAGAL:
+                _refresh_stok_locked()
+        return _stok_snapshot
+    if time.time() - snap["fetched_at"] > STOK_TTL:
+        _refresh_stok_background()
+    return snap
+
+def get_umur_stok():
+    """Umur snapshot stok dalam detik (None jika belum pernah berhasil diambil)."""
+    fetched_at = _stok_snapshot["fetched_at"]
+    return time.time() - fetched_at if fetched_at else None
+
+def info_umur_stok():
+    """Penanda data stok basi untuk ditampilkan ke user, string kosong jika masih segar."""
+    umur = get_umur_stok()
+    if umur is None:
+        return "⚠️ Data stok belum tersedia dari provider."
+    if umur > STOK_TTL:
+        return f"⚠️ Data stok terakhir diperbarui {int(umur)} detik lalu."
+    return ""
+
+def refresh_stok_job(context):
+    """Job untuk JobQueue Updater: refresh stok berkala di background."""
+    refresh_stok()
+
+# ========== KATALOG DASAR (SINKRON DARI provider.list_product) ==========
+# Daftar produk provider disimpan di tabel katalog_produk (db.sinkron_katalog hanya
+# menulis baris yang berubah). Handler membaca salinan di memori (_katalog_dasar);
+# salinan ini hanya diganti jika sinkron mengubah sesuatu, lalu versinya naik
+# sehingga Katalog dan keyboard produk dibangun ulang.
+
+_TETAP_BY_KODE = {p["kode"].lower(): p for p in LIST_PRODUK_TETAP}
+_katalog_dasar = None  # {"produk": (dict, ...), "versi": int}
+_dasar_lock = threading.Lock()
+_sinkron_lock = threading.Lock()
+
+# Kode produk dipakai di callback_data tombol (markup.py): "<prefix>|<kode>", maks 64 byte
+# (batas Telegram). Prefix terpanjang menentukan panjang kode yang masih muat.
+MAKS_CALLBACK_DATA = 64
+PREFIX_CALLBACK_KODE = ("produk_static|", "admin_edit_produk|", "editharga|", "editdeskripsi|", "resetcustom|")
+_MAKS_BYTE_KODE = MAKS_CALLBACK_DATA - max(len(p.encode()) for p in PREFIX_CALLBACK_KODE)
+
+def _normalisasi_produk(item):
+    """Satu item list_product -> (kode, nama, harga, deskripsi), None jika tidak valid / nonaktif."""
+    if not isinstance(item, dict):
+        return None
+    kode = str(item.get("kode") or item.get("kode_produk") or "").strip()
+    if not kode:
+        return None
+    if "|" in kode or len(kode.encode("utf-8")) > _MAKS_BYTE_KODE:
+        logger.warning(f"Kode produk provider dilewati (mengandung '|' atau lebih dari {_MAKS_BYTE_KODE} byte): {kode!r}")
+        return None
+    status = item.get("status", item.get("aktif", 1))
+    if str(status).strip().lower() in ("0", "false", "nonaktif", "gangguan", "off"):
+        return None
+    try:
+        harga = int(float(item.get("harga") or 0))
+    except (ValueError, TypeError):
+        logger.warning(f"Invalid harga provider untuk {kode}: {item.get('harga')}")
+        return None
+    nama = str(item.get("nama") or item.get("nama_produk") or kode).strip()
+    deskripsi = str(item.get("deskripsi") or item.get("keterangan") or "").strip()
+    return (kode, nama, harga, deskripsi)
+
+def _produk_dasar(rows):
+    output = []
+    for kode, nama, harga, deskripsi in rows:
+        tetap = _TETAP_BY_KODE.get(kode.lower())
+        if tetap:
+            output.append(dict(tetap, kode=kode))
+        else:
+            output.append({"kode": kode, "nama": nama, "harga": harga, "deskripsi": deskripsi, "kuota": 0})
+    return tuple(output)
+
+def _muat_katalog_dasar(versi):
+    try:
+        rows = db.get_katalog_produk()
+    except Exception as e:
+        logger.error(f"Error loading katalog produk dari db: {e}")
+        rows = []
+    # Belum pernah sinkron: pakai LIST_PRODUK_TETAP
+    produk = _produk_dasar(rows) if rows else tuple(dict(p) for p in LIST_PRODUK_TETAP)
+    return {"produk": produk, "versi": versi}
+
+def get_katalog_dasar():
+    """Katalog dasar {produk, versi} dari memori (dibaca dari db sekali saat pertama dipakai)."""
+    global _katalog_dasar
+    dasar = _katalog_dasar
+    if dasar is None:
+        with _dasar_lock:
+            if _katalog_dasar is None:
+                _katalog_dasar = _muat_katalog_dasar(0)
+            dasar = _katalog_dasar
+    return dasar
+
+def sinkron_katalog_provider():
+    """
+    Ambil list_product dari provider lalu samakan dengan katalog lokal.
+    Return (baru, berubah, nonaktif, urutan_berubah), atau None jika provider gagal / sinkron lain sedang berjalan.
+    """
+    global _katalog_dasar
+    if not _sinkron_lock.acquire(blocking=False):
+        return None
+    try:
+        rows, dilihat = [], set()
+        for item in list_product():
+            row = _normalisasi_produk(item)
+            if row and row[0].lower() not in dilihat:
+                dilihat.add(row[0].lower())
+                rows.append(row)
+        if not rows:
+            # Respon kosong biasanya berarti provider gagal: jangan nonaktifkan seluruh katalog
+            logger.warning("list_product kosong, sinkron katalog dilewati")
+            return None
+        hasil = db.sinkron_katalog(rows)
+        if any(hasil) or _katalog_dasar is None:
+            with _dasar_lock:
+                versi = _katalog_dasar["versi"] + 1 if _katalog_dasar else 0
+                _katalog_dasar = _muat_katalog_dasar(versi)
+        if any(hasil):
+            logger.info(f"Sinkron katalog: {hasil[0]} baru, {hasil[1]} berubah, {hasil[2]} nonaktif"
+                        + (", urutan berubah" if hasil[3] else ""))
+        return hasil
+    except Exception as e:
+        logger.error(f"Error sinkron katalog provider: {e}")
+        return None
+    finally:
+        _sinkron_lock.release()
+
+def sinkron_katalog_job(context):
+    """Job untuk JobQueue Updater: sinkron katalog produk dari provider secara berkala."""
+    sinkron_katalog_provider()
+
+def _bangun_list_produk(produk_dasar, slot_map, custom_data):
+    output = []
+    for produk in produk_dasar:
+        kode = produk["kode"].lower()
+        produk_copy = produk.copy()
+        if kode in custom_data:
+            custom = custom_data[kode]
+            if custom.get("harga") is not None:
+                try:
+                    produk_copy["harga"] = int(custom["harga"])
+                except (ValueError, TypeError):
+                    logger.warning(f"Invalid harga for {kode}: {custom.get('harga')}")
+            if custom.get("deskripsi"):
+                produk_copy["deskripsi"] = custom["deskripsi"]
+        produk_copy["sisa_slot"] = slot_map.get(kode, 0)
+        produk_copy["kuota"] = produk_copy["sisa_slot"]
+        output.append(produk_copy)
+    return output
+
+# ========== KATALOG (INDEX KODE) ==========
+
+class Katalog:
+    """
+    Snapshot katalog produk yang sudah jadi (katalog dasar + custom + stok).
+    Tidak pernah diubah setelah dibuat; perubahan data membuat objek Katalog baru
+    yang menggantikan objek lama sekaligus.
+    """
+
+    __slots__ = ("produk", "by_kode", "kunci")
+
+    def __init__(self, produk, kunci):
+        self.produk = tuple(produk)  # urutan tampil (daftar & keyboard produk)
+        self.by_kode = {p["kode"].lower(): p for p in self.produk}
+        self.kunci = kunci
+
+    def get(self, kode):
+        return self.by_kode.get(kode.lower())
+
+_katalog = None
+_katalog_lock = threading.Lock()
+
+def _invalidasi_katalog():
+    global _katalog
+    _katalog = None
+
+_custom.dengarkan(_invalidasi_katalog)
+
+def get_katalog():
+    """Return Katalog terbaru; dibangun ulang hanya jika katalog dasar, overlay custom atau snapshot stok berubah."""
+    global _katalog
+    snap = get_stok_snapshot()
+    dasar = get_katalog_dasar()
+    _custom.periksa()
+    kunci = (snap["versi"], _custom.versi, dasar["versi"])
+    kat = _katalog
+    if kat is not None and kat.kunci == kunci:
+        return kat
+    with _katalog_lock:
+        kat = _katalog
+        if kat is None or kat.kunci != kunci:
+            kat = Katalog(_bangun_list_produk(dasar["produk"], snap["slot_map"], _custom.overrides()), kunci)
+            _katalog = kat
+    return kat
+
 def get_list_stok_fixed():
     try:
-        slot_map = parse_stock_from_provider()
-        custom_data = get_all_custom_produk()
-        output = []
-        for produk in LIST_PRODUK_TETAP:
-            kode = produk["kode"].lower()
-            produk_copy = produk.copy()
-            if kode in custom_data:
-                custom = custom_data[kode]
-                if custom.get("harga") is not None:
-                    try:
-                        produk_copy["harga"] = int(custom["harga"])
-                    except (ValueError, TypeError):
-                        logger.warning(f"Invalid harga for {kode}: {custom.get('harga')}")
-                if custom.get("deskripsi"):
-                    produk_copy["deskripsi"] = custom["deskripsi"]
-            produk_copy["sisa_slot"] = slot_map.get(kode, 0)
-            produk_copy["kuota"] = produk_copy["sisa_slot"]
-            output.append(produk_copy)
-        return output
+        return [p.copy() for p in get_katalog().produk]
     except Exception as e:
         logger.error(f"Error getting product list with stock: {e}")
         return LIST_PRODUK_TETAP.copy()
@@ -131,12 +469,8 @@ def get_produk_by_kode(kode):
     if not kode:
         return None
     try:
-        kode = kode.lower()
-        all_products = get_list_stok_fixed()
-        for produk in all_products:
-            if produk["kode"].lower() == kode:
-                return produk
-        return None
+        produk = get_katalog().get(kode)
+        return produk.copy() if produk else None
     except Exception as e:
         logger.error(f"Error getting product by kode {kode}: {e}")
         return None
@@ -146,30 +480,40 @@ def edit_produk(kode, harga=None, deskripsi=None):
         return False
     try:
         kode = kode.lower()
-        custom_data = load_custom_produk()
-        if kode not in custom_data:
-            custom_data[kode] = {}
         if harga is not None:
             try:
-                custom_data[kode]["harga"] = int(harga)
+                harga = int(harga)
             except (ValueError, TypeError):
                 return False
-        if deskripsi is not None:
-            custom_data[kode]["deskripsi"] = deskripsi.strip()
-        return save_custom_produk(custom_data)
+
+        def ubah(custom_data):
+            custom_data.setdefault(kode, {})
+            if harga is not None:
+                custom_data[kode]["harga"] = harga
+            if deskripsi is not None:
+                custom_data[kode]["deskripsi"] = deskripsi.strip()
+
+        return _custom.ubah(ubah)
     except Exception as e:
         logger.error(f"Error editing product {kode}: {e}")
         return False
 
-def format_list_stok_fixed():
+def _baris_stok(item):
+    status = "✅ Tersedia" if item['sisa_slot'] > 0 else "❌ Habis"
+    return (
+        f"<code>{item['kode']}</code> | {item['nama']}\n"
+        f"💰 Rp {item['harga']:,} | 📦 {item['sisa_slot']} slot | {status}\n"
+        f"📝 {item['deskripsi']}\n\n"
+    )
+
+def format_list_stok_fixed(mulai=0):
+    """Satu halaman daftar produk (maks 4096 karakter) mulai dari produk ke-`mulai`."""
     try:
-        items = get_list_stok_fixed()
-        msg = "<b>Daftar Produk Tersedia:</b>\n\n"
-        for item in items:
-            status = "✅ Tersedia" if item['sisa_slot'] > 0 else "❌ Habis"
-            msg += f"<code>{item['kode']}</code> | {item['nama']}\n"
-            msg += f"💰 Rp {item['harga']:,} | 📦 {item['sisa_slot']} slot | {status}\n"
-            msg += f"📝 {item['deskripsi']}\n\n"
+        kepala = "<b>Daftar Produk Tersedia:</b>\n\n"
+        umur = info_umur_stok()
+        if umur:
+            kepala += f"{umur}\n\n"
+        msg, _, _ = halaman.render(halaman.dari_list(get_katalog().produk, _baris_stok), mulai, kepala=kepala)
         return msg
     except Exception as e:
         logger.error(f"Error formatting product list: {e}")
@@ -177,13 +521,11 @@ def format_list_stok_fixed():
 
 def get_produk_list_for_admin():
     try:
-        products = get_list_stok_fixed()
-        custom_data = get_all_custom_produk()
+        custom_data = _custom.overrides()
         result = []
-        for p in products:
-            kode = p["kode"].lower()
+        for p in get_katalog().produk:
             product_info = p.copy()
-            product_info["is_customized"] = kode in custom_data
+            product_info["is_customized"] = p["kode"].lower() in custom_data
             result.append(product_info)
         return result
     except Exception as e:
@@ -193,11 +535,9 @@ def get_produk_list_for_admin():
 def reset_produk_custom(kode):
     try:
         kode = kode.lower()
-        custom_data = load_custom_produk()
-        if kode in custom_data:
-            del custom_data[kode]
-            return save_custom_produk(custom_data)
-        return True
+        if kode not in _custom.overrides():
+            return True
+        return _custom.ubah(lambda custom_data: custom_data.pop(kode, None))
     except Exception as e:
         logger.error(f"Error resetting product {kode}: {e}")
         return False
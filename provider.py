@@ -1,5 +1,10 @@
 import requests
 import json
+import time
+import uuid
+import random
+import threading
+from requests.adapters import HTTPAdapter
 
 # Load config dari file config.json
 with open("config.json") as f:
@@ -9,12 +14,112 @@ API_KEY = CONFIG.get("API_KEY", "")
 BASE_URL = "https://panel.khfy-store.com/api_v2"
 BASE_URL_V3 = "https://panel.khfy-store.com/api_v3"
 
+# Timeout per endpoint: (connect, read) dalam detik
+TIMEOUTS = {
+    "list_product": (5, 15),
+    "trx": (5, 20),
+    "history": (5, 10),
+    "cek_stock_akrab": (5, 10),
+}
+MAX_RETRY = 2  # retry tambahan, hanya untuk endpoint idempotent (bukan trx)
+
+class ProviderTidakTersedia(Exception):
+    """Circuit breaker terbuka: provider dianggap down, request tidak dikirim."""
+
+class CircuitBreaker:
+    """
+    Setelah `ambang_gagal` request gagal berturut-turut, semua request langsung
+    ditolak selama `jeda_buka` detik. Setelah itu satu request percobaan diizinkan
+    (half-open); jika berhasil breaker tertutup lagi, jika gagal terbuka lagi.
+    Hanya pemilik request percobaan (percobaan=True dari boleh()) yang boleh
+    melepas penandanya.
+    """
+
+    def __init__(self, ambang_gagal=5, jeda_buka=30):
+        self.ambang_gagal = ambang_gagal
+        self.jeda_buka = jeda_buka
+        self._lock = threading.Lock()
+        self._gagal = 0
+        self._dibuka_pada = None
+        self._percobaan_jalan = False
+
+    def boleh(self):
+        """Return (boleh, percobaan): percobaan=True jika pemanggil memegang request percobaan half-open."""
+        with self._lock:
+            if self._dibuka_pada is None:
+                return True, False
+            if self._percobaan_jalan or time.monotonic() - self._dibuka_pada < self.jeda_buka:
+                return False, False
+            self._percobaan_jalan = True
+            return True, True
+
+    def sukses(self, percobaan=False):
+        with self._lock:
+            self._gagal = 0
+            self._dibuka_pada = None
+            if percobaan:
+                self._percobaan_jalan = False
+
+    def gagal(self, percobaan=False):
+        with self._lock:
+            self._gagal += 1
+            if percobaan or self._gagal >= self.ambang_gagal:
+                self._dibuka_pada = time.monotonic()
+            if percobaan:
+                self._percobaan_jalan = False
+
+    def akhiri_percobaan(self):
+        """Lepas penanda request percobaan half-open; hanya dipanggil pemiliknya."""
+        with self._lock:
+            self._percobaan_jalan = False
+
+    @property
+    def terbuka(self):
+        return self._dibuka_pada is not None
+
+# Satu Session untuk semua request: koneksi TCP+TLS ke panel dipakai ulang (keep-alive)
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=16))
+_breaker = CircuitBreaker()
+
+def _get(endpoint, url, params, idempotent=True, parse_json=True):
+    """
+    GET ke provider lewat circuit breaker. Return isi JSON (atau Response jika parse_json=False).
+    Error request dan respon yang bukan JSON valid dihitung sebagai satu kegagalan breaker
+    per pemanggilan, setelah semua retry habis.
+    """
+    boleh, percobaan = _breaker.boleh()
+    if not boleh:
+        raise ProviderTidakTersedia("Provider sedang gangguan, coba beberapa saat lagi.")
+    # Request percobaan half-open tidak di-retry
+    jumlah_coba = MAX_RETRY + 1 if idempotent and not percobaan else 1
+    try:
+        for i in range(jumlah_coba):
+            try:
+                resp = _session.get(url, params=params, timeout=TIMEOUTS[endpoint])
+                if resp.status_code >= 500:
+                    raise requests.exceptions.HTTPError(f"HTTP {resp.status_code}", response=resp)
+                hasil = resp.json() if parse_json else resp
+            except (requests.exceptions.RequestException, ValueError):
+                # ValueError: body bukan JSON (mis. halaman error HTML dari proxy)
+                if i == jumlah_coba - 1 or _breaker.terbuka:
+                    _breaker.gagal(percobaan)
+                    raise
+                # Backoff eksponensial dengan full jitter: 0-0.5s, 0-1s, ...
+                time.sleep(random.uniform(0, 0.5 * (2 ** i)))
+                continue
+            _breaker.sukses(percobaan)
+            return hasil
+    finally:
+        if percobaan:
+            # Error lain yang tidak terduga: jangan biarkan breaker macet di half-open
+            _breaker.akhiri_percobaan()
+
 def list_product():
     try:
         url = f"{BASE_URL}/list_product"
         params = {"api_key": API_KEY}
-        resp = requests.get(url, params=params, timeout=15)
-        data = resp.json()
+        data = _get("list_product", url, params)
         return data.get("data", []) if isinstance(data, dict) else []
     except Exception as e:
         print("Error list_product:", e)
@@ -22,7 +127,6 @@ def list_product():
 
 def create_trx(produk, tujuan, reff_id=None):
     try:
-        import uuid
         if not reff_id:
             reff_id = str(uuid.uuid4())
         url = f"{BASE_URL}/trx"
@@ -32,8 +136,8 @@ def create_trx(produk, tujuan, reff_id=None):
             "reff_id": reff_id,
             "api_key": API_KEY
         }
-        resp = requests.get(url, params=params, timeout=15)
-        data = resp.json()
+        # Tidak di-retry: request trx yang timeout bisa saja sudah diproses provider
+        data = _get("trx", url, params, idempotent=False)
         return data
     except Exception as e:
         print("Error create_trx:", e)
@@ -46,18 +150,18 @@ def history(refid):
             "api_key": API_KEY,
             "refid": refid
         }
-        resp = requests.get(url, params=params, timeout=15)
-        data = resp.json()
+        data = _get("history", url, params)
         return data
     except Exception as e:
         print("Error history:", e)
-        return {"status": "error", "message": str(e)}
+        # "gangguan": request gagal di sisi kita, bukan jawaban dari provider
+        return {"status": "error", "message": str(e), "gangguan": True}
 
 def cek_stock_akrab():
     try:
         url = f"{BASE_URL_V3}/cek_stock_akrab"
         params = {"api_key": API_KEY}
-        resp = requests.get(url, params=params, timeout=15)
+        resp = _get("cek_stock_akrab", url, params, parse_json=False)
         return resp.text
     except Exception as e:
         print("Error cek_stock_akrab:", e)
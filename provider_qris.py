@@ -1,10 +1,108 @@
 import requests
 import base64
 import re
-from typing import Dict, Optional, Union, Any
+from typing import Dict, Optional, Union, Any, List, Tuple
 import io
 import tempfile
 import os
+from cache import LRUCache
+
+try:
+    import segno  # render QR lokal (opsional); tanpa segno dipakai API remote
+except ImportError:
+    segno = None
+
+# ========== QRIS / EMV TLV LOKAL ==========
+# Payload QRIS = deretan TLV: tag 2 digit + panjang 2 digit + nilai.
+# QRIS dinamis = QRIS statis dengan tag 01 = "12", tag 54 = nominal, dan
+# CRC16-CCITT (tag 63) dihitung ulang.
+
+def crc16_ccitt(data: bytes) -> str:
+    """CRC16-CCITT (poly 0x1021, init 0xFFFF) dalam 4 digit hex kapital."""
+    crc = 0xFFFF
+    for byte in data:
+        crc ^= byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+            crc &= 0xFFFF
+    return f"{crc:04X}"
+
+def parse_tlv(payload: str) -> List[Tuple[str, str]]:
+    """Pecah payload QRIS menjadi list (tag, nilai) level teratas."""
+    items = []
+    i = 0
+    while i < len(payload):
+        if i + 4 > len(payload):
+            raise ValueError(f"TLV terpotong di posisi {i}")
+        tag = payload[i:i + 2]
+        panjang = payload[i + 2:i + 4]
+        if not (tag.isdigit() and panjang.isdigit()):
+            raise ValueError(f"TLV tidak valid di posisi {i}")
+        akhir = i + 4 + int(panjang)
+        if akhir > len(payload):
+            raise ValueError(f"Nilai tag {tag} melebihi panjang payload")
+        items.append((tag, payload[i + 4:akhir]))
+        i = akhir
+    return items
+
+def build_tlv(items: List[Tuple[str, str]]) -> str:
+    return "".join(f"{tag}{len(nilai):02d}{nilai}" for tag, nilai in items)
+
+def buat_qris_dinamis(qris_statis: str, nominal: int) -> str:
+    """Ubah QRIS statis menjadi QRIS dinamis dengan nominal tertentu (tanpa request ke luar)."""
+    items = [(tag, nilai) for tag, nilai in parse_tlv(qris_statis.strip()) if tag not in ("54", "63")]
+    items = [(tag, "12") if tag == "01" else (tag, nilai) for tag, nilai in items]
+    items.append(("54", str(int(nominal))))
+    items.sort(key=lambda item: item[0])  # urutan tag harus naik (54 sebelum 58)
+    tanpa_crc = build_tlv(items) + "6304"
+    return tanpa_crc + crc16_ccitt(tanpa_crc.encode("utf-8"))
+
+def render_qris_png(payload: str, scale: int = 8, border: int = 4) -> bytes:
+    """Render payload QRIS menjadi PNG di memori (butuh paket segno)."""
+    if segno is None:
+        raise RuntimeError("Paket segno belum terinstall")
+    bio = io.BytesIO()
+    segno.make(payload, error="m", micro=False).save(bio, kind="png", scale=scale, border=border)
+    return bio.getvalue()
+
+QRIS_STATIS_DEFAULT = (
+    "00020101021126610014COM.GO-JEK.WWW01189360091434506469550210G4506469550303UMI51440014ID.CO.QRIS.WWW0215"
+    "ID10243341364120303UMI5204569753033605802ID5923Amifi Store, Kmb, TLGSR6009BONDOWOSO61056827262070703A01630431E8"
+)
+
+# ========== CACHE QRIS PER NOMINAL ==========
+# Nominal top up biasanya itu-itu saja (10rb, 20rb, 50rb, 100rb), jadi PNG hasil
+# generate dan file_id foto dari Telegram disimpan per (qris_statis, nominal).
+
+QRIS_CACHE_SIZE = 64
+_png_cache = LRUCache(QRIS_CACHE_SIZE)      # (qris_statis, nominal) -> {"png", "qris_string", "sumber"}
+_file_id_cache = LRUCache(QRIS_CACHE_SIZE)  # (qris_statis, nominal) -> file_id Telegram
+
+def _cache_key(nominal: Union[int, str], qris_statis: Optional[str] = None) -> Tuple[str, int]:
+    return ((qris_statis or QRIS_STATIS_DEFAULT).strip(), int(nominal))
+
+def get_qris_file_id(nominal: Union[int, str], qris_statis: Optional[str] = None) -> Optional[str]:
+    """file_id Telegram untuk QRIS nominal ini yang pernah dikirim, atau None."""
+    return _file_id_cache.get(_cache_key(nominal, qris_statis))
+
+def simpan_qris_file_id(nominal: Union[int, str], file_id: str, qris_statis: Optional[str] = None) -> None:
+    """Simpan file_id foto QRIS agar pengiriman berikutnya tanpa generate & upload ulang."""
+    if file_id:
+        _file_id_cache.set(_cache_key(nominal, qris_statis), file_id)
+
+def hapus_qris_file_id(nominal: Union[int, str], qris_statis: Optional[str] = None) -> None:
+    """Buang file_id yang ditolak Telegram (misal sudah tidak valid)."""
+    _file_id_cache.pop(_cache_key(nominal, qris_statis))
+
+def png_bytesio(png: bytes) -> io.BytesIO:
+    """
+    Bungkus bytes PNG sebagai file upload Telegram (multipart), tanpa file temporary.
+    BytesIO dari objek bytes memakai buffer yang sama (tidak disalin) selama tidak
+    ditulisi, jadi PNG di cache bisa dipakai ulang untuk banyak upload.
+    """
+    bio = io.BytesIO(png)
+    bio.name = "qris.png"
+    return bio
 
 class QRISGenerator:
     """
@@ -16,14 +114,13 @@ class QRISGenerator:
         self,
         qris_statis: str = None,
         api_url: str = "https://qrisku.my.id/api",
-        timeout: int = 30
+        timeout: int = 30,
+        remote_fallback: bool = True
     ):
         self.api_url = api_url
         self.timeout = timeout
-        self.qris_statis_default = qris_statis or (
-            "00020101021126610014COM.GO-JEK.WWW01189360091434506469550210G4506469550303UMI51440014ID.CO.QRIS.WWW0215"
-            "ID10243341364120303UMI5204569753033605802ID5923Amifi Store, Kmb, TLGSR6009BONDOWOSO61056827262070703A01630431E8"
-        )
+        self.remote_fallback = remote_fallback
+        self.qris_statis_default = qris_statis or QRIS_STATIS_DEFAULT
 
     def _clean_base64(self, base64_string: str) -> str:
         """Membersihkan dan memperbaiki base64 (whitespace, padding, karakter non-base64)."""
@@ -43,6 +140,22 @@ class QRISGenerator:
         """
         Generate QRIS dinamis dengan nominal tertentu.
         """
+        result = self.generate_qris_png(nominal, qris_statis)
+        if result["status"] != "success":
+            return result
+        result = dict(result)
+        result["qris_base64"] = base64.b64encode(result.pop("qris_png")).decode("ascii")
+        return result
+
+    def generate_qris_png(
+        self,
+        nominal: Union[int, str],
+        qris_statis: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Seperti generate_qris, tapi gambar dikembalikan sebagai bytes PNG ("qris_png"),
+        tanpa encode base64 (untuk upload langsung ke Telegram).
+        """
         qris_statis = qris_statis or self.qris_statis_default
         if not qris_statis:
             return {"status": "error", "message": "QRIS statis tidak tersedia"}
@@ -53,6 +166,45 @@ class QRISGenerator:
         except (ValueError, TypeError):
             return {"status": "error", "message": "Nominal harus berupa angka"}
 
+        key = _cache_key(nominal_int, qris_statis)
+        cached = _png_cache.get(key)
+        if cached:
+            return self._hasil_png(cached, nominal_int)
+
+        # Utamakan generate lokal (milidetik, tanpa API luar); API remote hanya cadangan
+        try:
+            qris_string = buat_qris_dinamis(qris_statis, nominal_int)
+            entry = {"png": render_qris_png(qris_string), "qris_string": qris_string, "sumber": "lokal"}
+            _png_cache.set(key, entry)
+            return self._hasil_png(entry, nominal_int)
+        except Exception as e:
+            if not self.remote_fallback:
+                return {"status": "error", "message": f"Gagal generate QRIS lokal: {str(e)}"}
+            print(f"[QRIS] Generate lokal gagal, pakai API remote: {e}")
+        result = self._generate_qris_remote(nominal_int, qris_statis)
+        if result["status"] != "success":
+            return result
+        try:
+            # Decode base64 sekali saja; selanjutnya bytes dari cache yang dipakai
+            entry = {"png": base64.b64decode(result["qris_base64"]), "qris_string": None, "sumber": "remote"}
+        except Exception as e:
+            return {"status": "error", "message": f"Error decode base64: {str(e)}"}
+        _png_cache.set(key, entry)
+        return self._hasil_png(entry, nominal_int)
+
+    @staticmethod
+    def _hasil_png(entry: Dict[str, Any], nominal_int: int) -> Dict[str, Any]:
+        return {
+            "status": "success",
+            "message": "QRIS berhasil digenerate",
+            "qris_png": entry["png"],
+            "qris_string": entry["qris_string"],
+            "nominal": nominal_int,
+            "sumber": entry["sumber"]
+        }
+
+    def _generate_qris_remote(self, nominal_int: int, qris_statis: str) -> Dict[str, Any]:
+        """Generate QRIS lewat API qrisku.my.id (cadangan jika generate lokal gagal)."""
         payload = {"amount": str(nominal_int), "qris_statis": qris_statis.strip()}
         headers = {"Content-Type": "application/json"}
 
@@ -68,7 +220,8 @@ class QRISGenerator:
                     "status": "success",
                     "message": data.get("message", "QRIS berhasil digenerate"),
                     "qris_base64": cleaned_base64,
-                    "nominal": nominal_int
+                    "nominal": nominal_int,
+                    "sumber": "remote"
                 }
             error_message = data.get("message", "Unknown error from QRIS API")
             return {"status": "error", "message": f"API Error: {error_message}"}
@@ -84,21 +237,11 @@ class QRISGenerator:
         Generate QRIS dan return BytesIO PNG (siap upload Telegram).
         Return None jika gagal.
         """
-        result = self.generate_qris(nominal, qris_statis)
+        result = self.generate_qris_png(nominal, qris_statis)
         if result["status"] != "success":
             print(f"[QRIS] Gagal generate: {result['message']}")
             return None
-        qris_base64 = result["qris_base64"]
-        cleaned_base64 = self._clean_base64(qris_base64)
-        try:
-            qris_bytes = base64.b64decode(cleaned_base64)
-            bio = io.BytesIO(qris_bytes)
-            bio.name = "qris.png"
-            bio.seek(0)
-            return bio
-        except Exception as e:
-            print(f"[QRIS] Error decode base64: {e}")
-            return None
+        return png_bytesio(result["qris_png"])
 
     def generate_qris_image_file(self, nominal: Union[int, str], qris_statis: Optional[str] = None) -> Optional[str]:
         """
@@ -130,6 +273,12 @@ def generate_qris(nominal: Union[int, str], qris_statis: Optional[str] = None) -
     """
     return QRISGenerator().generate_qris(nominal, qris_statis)
 
+def generate_qris_png(nominal: Union[int, str], qris_statis: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Generate QRIS dinamis (return dict dengan bytes PNG di "qris_png").
+    """
+    return QRISGenerator().generate_qris_png(nominal, qris_statis)
+
 def get_qris_bytesio(nominal: Union[int, str], qris_statis: Optional[str] = None) -> Optional[io.BytesIO]:
     """
     Generate QRIS dan return BytesIO PNG (siap upload Telegram).
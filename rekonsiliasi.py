@@ -0,0 +1,209 @@
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from telegram import ParseMode
+import db
+import riwayat_log
+import notifikasi
+import peran
+import webhook
+from provider import history
+from cek_status import status_dari_history, tidak_ditemukan
+from utils import tambah_saldo
+from config import REKON_UMUR_MENIT, REKON_WORKERS, REKON_PER_DETIK, REKON_BATCH, REKON_MAKS_UMUR_JAM, HOLD_MAKS_MENIT
+
+logger = logging.getLogger(__name__)
+
+# Rekonsiliasi transaksi yang callback-nya tidak pernah datang: transaksi yang
+# masih pending lebih dari REKON_UMUR_MENIT menit dicek ke provider.history
+# (maks REKON_WORKERS request bersamaan, REKON_PER_DETIK request/detik), lalu
+# status final diterapkan dengan logika yang sama seperti callback webhook.
+# Dua penyimpanan transaksi ikut dicek: tabel riwayat (db) dan riwayat_log.
+#
+# Transaksi yang sudah pending lebih dari REKON_MAKS_UMUR_JAM jam (dan entri log
+# lama tanpa field "dibuat", yang umurnya tidak diketahui) tidak pernah di-refund
+# hanya karena umurnya. Refund otomatis hanya jika provider memberi status final
+# gagal/batal, atau menjawab transaksi tidak ditemukan untuk transaksi kedaluwarsa.
+# Jika provider menjawab tapi statusnya belum final, transaksi ditandai CEK MANUAL
+# (keluar dari antrian rekonsiliasi, tanpa refund) dan admin diberi tahu. Jika
+# history gagal / tidak terbaca, transaksi tetap pending dan dicek lagi nanti.
+
+JEDA_CEK_ULANG = 600  # detik, transaksi yang sama tidak dicek ulang sebelum jeda ini
+KET_TIDAK_DITEMUKAN = "Transaksi tidak ditemukan di provider (kedaluwarsa)"
+KET_CEK_MANUAL = "Tidak ada status final dari provider, perlu dicek admin"
+
+_terakhir_dicek = {}  # refid -> waktu cek terakhir (monotonic)
+_jalan = threading.Lock()
+
+class _PembatasLaju:
+    """Jarak minimal antar request (thread-safe), agar rekonsiliasi tidak membanjiri provider."""
+
+    def __init__(self, per_detik):
+        self.jeda = 1.0 / per_detik
+        self._berikutnya = 0.0
+        self._lock = threading.Lock()
+
+    def tunggu(self):
+        with self._lock:
+            now = time.monotonic()
+            jadwal = max(now, self._berikutnya)
+            self._berikutnya = jadwal + self.jeda
+        if jadwal > now:
+            time.sleep(jadwal - now)
+
+def _belum_dicek(refid, now):
+    return now - _terakhir_dicek.get(refid, 0) >= JEDA_CEK_ULANG
+
+def _pilih(kandidat, refid_dari, now):
+    """Ambil maks REKON_BATCH kandidat yang belum dicek baru-baru ini; hanya yang terpilih ditandai sudah dicek."""
+    terpilih = [k for k in kandidat if _belum_dicek(refid_dari(k), now)][:REKON_BATCH]
+    for k in terpilih:
+        _terakhir_dicek[refid_dari(k)] = now
+    return terpilih
+
+def _jumlah_kandidat():
+    # Paling banyak len(_terakhir_dicek) kandidat dilewati, jadi batch tetap bisa penuh
+    return REKON_BATCH + len(_terakhir_dicek)
+
+def _status_akhir(st, ket, tidak_ada, kedaluwarsa):
+    """
+    (status, keterangan) yang diterapkan, atau None jika transaksi dibiarkan pending.
+    `kedaluwarsa` None berarti umur tidak diketahui: tidak pernah di-refund otomatis.
+    """
+    if st and db.status_final(st):
+        return st, ket
+    if not st and not tidak_ada:
+        return None  # history gagal / tidak terbaca: jangan ambil keputusan
+    if kedaluwarsa is False:
+        return None  # masih dalam REKON_MAKS_UMUR_JAM: tunggu callback / cek berikutnya
+    if tidak_ada and kedaluwarsa:
+        return "GAGAL", KET_TIDAK_DITEMUKAN
+    return db.STATUS_CEK_MANUAL, KET_CEK_MANUAL
+
+def _kabari_admin(refids):
+    teks = (f"⚠️ {len(refids)} transaksi tanpa status final dari provider, ditandai {db.STATUS_CEK_MANUAL}:\n"
+            + "\n".join(f"<code>{r}</code>" for r in refids))
+    for admin_id in peran.muat_ulang():
+        notifikasi.kirim_nanti(admin_id, teks, parse_mode=ParseMode.HTML)
+
+def _cek_semua(refids):
+    """
+    Panggil history untuk setiap refid dengan konkurensi dan laju terbatas.
+    Return {refid: (status, keterangan, tidak_ditemukan)}.
+    """
+    pembatas = _PembatasLaju(REKON_PER_DETIK)
+
+    def cek(refid):
+        pembatas.tunggu()
+        data = history(refid)
+        return refid, (*status_dari_history(data), tidak_ditemukan(data))
+
+    with ThreadPoolExecutor(max_workers=REKON_WORKERS, thread_name_prefix="rekon") as pool:
+        return {refid: hasil for refid, hasil in pool.map(cek, refids)}
+
+def _rekon_db(now):
+    """Transaksi di tabel riwayat: status final diterapkan lewat webhook.proses_batch (refund + notifikasi)."""
+    n = _jumlah_kandidat()
+    kedaluwarsa = db.get_riwayat_kedaluwarsa(REKON_MAKS_UMUR_JAM, limit=n)
+    pending = db.get_riwayat_pending(REKON_UMUR_MENIT, REKON_MAKS_UMUR_JAM, limit=n)
+    rows = _pilih(kedaluwarsa + pending, lambda r: r[0], now)
+    if not rows:
+        return 0
+    refid_kedaluwarsa = {r[0] for r in kedaluwarsa}
+    status = _cek_semua([r[0] for r in rows])
+    events = []
+    for reffid, (st, ket, tidak_ada) in status.items():
+        akhir = _status_akhir(st, ket, tidak_ada, reffid in refid_kedaluwarsa)
+        if akhir:
+            events.append((reffid, "rekon", akhir[0], akhir[1]))
+    if events:
+        webhook.proses_batch(events)
+    manual = [e[0] for e in events if e[2] == db.STATUS_CEK_MANUAL]
+    if manual:
+        logger.warning(f"[REKON] {len(manual)} transaksi ditandai {db.STATUS_CEK_MANUAL}: {', '.join(manual)}")
+        _kabari_admin(manual)
+    return len(events) - len(manual)
+
+def _rekon_log(now):
+    """Transaksi di riwayat_log (saldo bot): status diupdate, saldo bot dikembalikan jika gagal/batal."""
+    sekarang = time.time()
+    batas_kedaluwarsa = sekarang - REKON_MAKS_UMUR_JAM * 3600
+    items = _pilih(riwayat_log.pending(sebelum=sekarang - REKON_UMUR_MENIT * 60, limit=_jumlah_kandidat()),
+                   lambda t: t["refid"], now)
+    if not items:
+        return 0
+    # Entri log lama tanpa "dibuat": umur tidak diketahui (None), bukan kedaluwarsa
+    kedaluwarsa = {t["refid"]: t["dibuat"] < batas_kedaluwarsa if t.get("dibuat") else None for t in items}
+    status = _cek_semua([t["refid"] for t in items])
+    jumlah = 0
+    manual = []
+    for refid, (st, ket, tidak_ada) in status.items():
+        akhir = _status_akhir(st, ket, tidak_ada, kedaluwarsa[refid])
+        if not akhir:
+            continue
+        st, ket = akhir
+        lama = riwayat_log.terapkan_status(refid, st.upper(), ket)
+        if lama is None:
+            continue  # sudah final lebih dulu (mis. lewat CEK)
+        if st == db.STATUS_CEK_MANUAL:
+            manual.append(refid)
+            continue
+        jumlah += 1
+        if db.status_refund(st):
+            tambah_saldo(lama.get("harga", 0), ref=f"refund:{refid}")
+        if lama.get("user_id"):
+            ikon, hasil = ("✅", "BERHASIL") if "sukses" in st.lower() else ("❌", "GAGAL")
+            notifikasi.kirim_nanti(
+                lama["user_id"],
+                f"{ikon} Transaksi [{lama.get('produk', '')}] ke {lama.get('tujuan', '')} {hasil}.\n"
+                f"RefID: <code>{refid}</code>\nKeterangan: {ket}",
+                parse_mode=ParseMode.HTML
+            )
+    if manual:
+        logger.warning(f"[REKON] {len(manual)} transaksi log ditandai {db.STATUS_CEK_MANUAL}: {', '.join(manual)}")
+        _kabari_admin(manual)
+    return jumlah
+
+def rekonsiliasi_job(context):
+    """Job JobQueue: cek transaksi pending yang terlalu lama ke provider.history."""
+    if not _jalan.acquire(blocking=False):
+        return  # putaran sebelumnya belum selesai
+    try:
+        now = time.monotonic()
+        for refid in [r for r, t in _terakhir_dicek.items() if now - t > JEDA_CEK_ULANG]:
+            del _terakhir_dicek[refid]
+        jumlah = _rekon_db(now) + _rekon_log(now)
+        if jumlah:
+            logger.info(f"[REKON] {jumlah} transaksi pending diselesaikan dari provider.history")
+    except Exception:
+        logger.exception("[REKON] Rekonsiliasi gagal")
+    finally:
+        _jalan.release()
+
+# ========== HOLD SALDO YANG TERTINGGAL ==========
+# Jika proses mati di antara buat_hold() dan capture/release, baris saldo_hold
+# tetap berstatus 'hold' dan saldo user tertahan. Hold yang lebih tua dari
+# HOLD_MAKS_MENIT diselesaikan: jika transaksinya tercatat di riwayat (db atau
+# riwayat_log), hold di-capture (refund selanjutnya lewat status transaksi);
+# jika tidak ada, transaksi tidak pernah tercatat dan saldo dikembalikan.
+
+def sapu_hold():
+    """Selesaikan hold yang tertinggal. Return (jumlah_capture, jumlah_release)."""
+    capture = release = 0
+    for hold_id in db.get_hold_kedaluwarsa(HOLD_MAKS_MENIT):
+        if db.get_riwayat_by_refid(hold_id) or riwayat_log.get(hold_id):
+            capture += db.capture_hold(hold_id)
+        elif db.release_hold(hold_id) is not None:
+            release += 1
+            logger.warning(f"[REKON] Hold {hold_id} tertinggal tanpa riwayat, saldo dikembalikan")
+    return capture, release
+
+def sapu_hold_job(context):
+    """Job JobQueue: jalankan sapu_hold saat startup dan berkala."""
+    try:
+        capture, release = sapu_hold()
+        if capture or release:
+            logger.info(f"[REKON] Hold tertinggal: {capture} di-capture, {release} dikembalikan")
+    except Exception:
+        logger.exception("[REKON] Gagal menyelesaikan hold tertinggal")
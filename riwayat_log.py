@@ -0,0 +1,208 @@
+import os
+import json
+import logging
+import threading
+from config import RIWAYAT_FILE, RIWAYAT_LOG_FILE
+from db import status_final, STATUS_CEK_MANUAL
+
+logger = logging.getLogger(__name__)
+
+# Log transaksi append-only: setiap transaksi/perubahan status ditulis sebagai
+# satu baris JSON di akhir file, sehingga biaya I/O per pembelian tetap kecil
+# berapa pun jumlah riwayatnya. Isi log dibaca sekali saat startup ke index
+# di memori; kompaksi() menulis ulang log menjadi satu baris per transaksi.
+#
+# Format baris:
+#   {"op": "set", "refid": "...", "data": {...}}     -> transaksi baru / ganti penuh
+#   {"op": "update", "refid": "...", "data": {...}}  -> update sebagian field
+
+_lock = threading.RLock()
+_index = {}
+_urutan = []  # refid urut sesuai waktu masuk log (akses halaman terbaru() per index, bukan scan)
+_per_user = {}  # user_id -> [refid, ...] urut sesuai waktu masuk log
+_pending = set()  # refid yang status_text-nya belum final (untuk rekonsiliasi)
+_file = None
+_jumlah_baris = 0
+_dimuat = False
+
+def _terapkan(rec):
+    refid = rec.get("refid")
+    data = rec.get("data") or {}
+    if not refid:
+        return
+    if rec.get("op") == "update" and refid in _index:
+        _index[refid] = {**_index[refid], **data}
+    else:
+        if refid not in _index:
+            _urutan.append(refid)
+            if data.get("user_id") is not None:
+                _per_user.setdefault(data["user_id"], []).append(refid)
+        _index[refid] = dict(data)
+    if status_final(_index[refid].get("status_text")):
+        _pending.discard(refid)
+    else:
+        _pending.add(refid)
+
+def _tulis(rec):
+    global _file, _jumlah_baris
+    if _file is None:
+        _file = open(RIWAYAT_LOG_FILE, "a", encoding="utf-8")
+    _file.write(json.dumps(rec, ensure_ascii=False, separators=(",", ":")) + "\n")
+    _file.flush()
+    os.fsync(_file.fileno())
+    _jumlah_baris += 1
+
+def _migrasi_json_lama():
+    """Pindahkan isi riwayat_transaksi.json lama ke log (hanya jika log belum ada)."""
+    if not os.path.exists(RIWAYAT_FILE):
+        return
+    try:
+        with open(RIWAYAT_FILE, encoding="utf-8") as f:
+            lama = json.load(f)
+    except Exception as e:
+        logger.error(f"Gagal membaca {RIWAYAT_FILE} untuk migrasi: {e}")
+        return
+    if isinstance(lama, dict):
+        for refid, data in lama.items():
+            rec = {"op": "set", "refid": refid, "data": data}
+            _tulis(rec)
+            _terapkan(rec)
+        logger.info(f"Migrasi {len(lama)} transaksi dari {RIWAYAT_FILE} ke {RIWAYAT_LOG_FILE}")
+
+def _tutup_baris_terpotong():
+    # Pastikan append berikutnya mulai di baris baru walau baris terakhir terpotong
+    with open(RIWAYAT_LOG_FILE, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() == 0:
+            return
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b"\n":
+            f.write(b"\n")
+
+def muat():
+    """Bangun ulang index di memori dari log. Dipanggil sekali saat startup."""
+    global _dimuat, _jumlah_baris
+    with _lock:
+        _index.clear()
+        _urutan.clear()
+        _per_user.clear()
+        _pending.clear()
+        _jumlah_baris = 0
+        if not os.path.exists(RIWAYAT_LOG_FILE):
+            _migrasi_json_lama()
+            _dimuat = True
+            return
+        with open(RIWAYAT_LOG_FILE, encoding="utf-8") as f:
+            for no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    _terapkan(json.loads(line))
+                except ValueError:
+                    # Baris terakhir bisa terpotong jika proses mati saat menulis
+                    logger.warning(f"Baris {no} di {RIWAYAT_LOG_FILE} rusak, dilewati.")
+                    continue
+                _jumlah_baris += 1
+        _tutup_baris_terpotong()
+        _dimuat = True
+        if _jumlah_baris > 2 * len(_index) + 1000:
+            kompaksi()
+
+def _pastikan_dimuat():
+    if not _dimuat:
+        muat()
+
+def tambah(refid, data):
+    """Simpan transaksi baru (O(1): satu baris di-append)."""
+    rec = {"op": "set", "refid": refid, "data": data}
+    with _lock:
+        _pastikan_dimuat()
+        _tulis(rec)
+        _terapkan(rec)
+
+def update(refid, **fields):
+    """Update sebagian field transaksi, misal status_text/keterangan. Return False jika refid tidak ada."""
+    rec = {"op": "update", "refid": refid, "data": fields}
+    with _lock:
+        _pastikan_dimuat()
+        if refid not in _index:
+            return False
+        _tulis(rec)
+        _terapkan(rec)
+        return True
+
+def terapkan_status(refid, status_text, keterangan=""):
+    """
+    Ganti status hanya jika status lama belum final (compare-and-set).
+    Return data transaksi sebelum diupdate, atau None jika refid tidak ada / sudah final.
+    """
+    with _lock:
+        _pastikan_dimuat()
+        lama = _index.get(refid)
+        if lama is None or refid not in _pending:
+            return None
+        lama = dict(lama)
+        update(refid, status_text=status_text, keterangan=keterangan)
+        return lama
+
+def pending(sebelum=None, limit=100):
+    """Transaksi belum final (selain CEK MANUAL) yang dibuat sebelum timestamp `sebelum` (epoch), yang paling lama dulu."""
+    with _lock:
+        _pastikan_dimuat()
+        urut = sorted((_index[r].get("dibuat", 0), r) for r in _pending
+                      if _index[r].get("status_text") != STATUS_CEK_MANUAL)
+        return [dict(_index[r], refid=r) for dibuat, r in urut[:limit]
+                if sebelum is None or dibuat < sebelum]
+
+def get(refid):
+    with _lock:
+        _pastikan_dimuat()
+        data = _index.get(refid)
+        return dict(data) if data else None
+
+def semua():
+    """Salinan semua transaksi {refid: data} (urutan sesuai waktu masuk log)."""
+    with _lock:
+        _pastikan_dimuat()
+        return {k: dict(v) for k, v in _index.items()}
+
+def terbaru_user(user_id, limit=10, offset=0):
+    """
+    Transaksi terbaru milik user, dari yang paling baru.
+    offset = jumlah transaksi terbaru yang dilewati (kursor halaman).
+    Return (items, next_offset); next_offset None jika tidak ada halaman berikutnya.
+    """
+    with _lock:
+        _pastikan_dimuat()
+        refids = _per_user.get(user_id, [])
+        akhir = max(len(refids) - offset, 0)
+        awal = max(akhir - limit, 0)
+        items = [dict(_index[r]) for r in reversed(refids[awal:akhir])]
+        return items, (offset + limit if awal > 0 else None)
+
+def terbaru(limit=30, offset=0):
+    """Transaksi terbaru dari semua user (paling baru dulu), melewati `offset` transaksi terbaru."""
+    with _lock:
+        _pastikan_dimuat()
+        akhir = max(len(_urutan) - offset, 0)
+        return [dict(_index[r]) for r in reversed(_urutan[max(akhir - limit, 0):akhir])]
+
+def kompaksi():
+    """Tulis ulang log menjadi satu baris 'set' per transaksi (atomic via rename)."""
+    global _file, _jumlah_baris
+    with _lock:
+        _pastikan_dimuat()
+        tmp = RIWAYAT_LOG_FILE + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for refid, data in _index.items():
+                f.write(json.dumps({"op": "set", "refid": refid, "data": data},
+                                   ensure_ascii=False, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        if _file is not None:
+            _file.close()
+            _file = None
+        os.replace(tmp, RIWAYAT_LOG_FILE)
+        _jumlah_baris = len(_index)
+        logger.info(f"Kompaksi {RIWAYAT_LOG_FILE} selesai: {_jumlah_baris} transaksi")
@@ -0,0 +1,104 @@
+import time
+import unittest
+from unittest import mock
+import db
+import rekonsiliasi
+from config import REKON_BATCH
+
+# Uji rekonsiliasi tanpa provider / Telegram (db, riwayat_log dan history di-mock):
+#   python tes_rekonsiliasi.py
+
+GAGAL_KONEKSI = {"status": "error", "message": "timeout", "gangguan": True}
+PENDING = {"status": True, "data": [{"status_text": "Pending", "keterangan": ""}]}
+GAGAL = {"status": True, "data": [{"status_text": "Gagal", "keterangan": "Nomor salah"}]}
+TIDAK_ADA = {"status": False, "message": "Transaksi tidak ditemukan"}
+
+class TesRekonsiliasi(unittest.TestCase):
+
+    def setUp(self):
+        rekonsiliasi._terakhir_dicek.clear()
+        self.jawaban = {}  # refid -> respon history; default PENDING
+        self.dicek = []
+        self.events = []
+        self.refund = []
+        self.log = []
+        self.db_pending = []
+        self.db_kedaluwarsa = []
+        patch = [
+            mock.patch.object(rekonsiliasi, "history", self._history),
+            mock.patch.object(rekonsiliasi._PembatasLaju, "tunggu", lambda pembatas: None),
+            mock.patch.object(rekonsiliasi, "tambah_saldo", lambda jumlah, ref: self.refund.append(ref)),
+            mock.patch.object(rekonsiliasi.webhook, "proses_batch", self.events.extend),
+            mock.patch.object(rekonsiliasi.notifikasi, "kirim_nanti"),
+            mock.patch.object(rekonsiliasi.peran, "muat_ulang", lambda: frozenset({99})),
+            mock.patch.object(rekonsiliasi.db, "get_riwayat_pending",
+                              lambda umur_menit, maks_umur_jam, limit: self.db_pending[:limit]),
+            mock.patch.object(rekonsiliasi.db, "get_riwayat_kedaluwarsa",
+                              lambda maks_umur_jam, limit: self.db_kedaluwarsa[:limit]),
+            mock.patch.object(rekonsiliasi.riwayat_log, "pending", lambda sebelum, limit: self.log[:limit]),
+            mock.patch.object(rekonsiliasi.riwayat_log, "terapkan_status", self._terapkan_log),
+        ]
+        for p in patch:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def _history(self, refid):
+        self.dicek.append(refid)
+        return self.jawaban.get(refid, PENDING)
+
+    def _terapkan_log(self, refid, status_text, keterangan):
+        return next(t for t in self.log if t["refid"] == refid)
+
+    def _status_db(self):
+        return {reffid: status for reffid, trxid, status, ket in self.events}
+
+    def test_batch_bergiliran_tanpa_terlewat(self):
+        self.db_pending = [(f"db{i}",) for i in range(REKON_BATCH * 3)]
+        for putaran in range(3):
+            self.dicek.clear()
+            self.assertEqual(rekonsiliasi._rekon_db(1000.0), 0)
+            self.assertEqual(len(self.dicek), REKON_BATCH)
+            self.assertEqual(len(rekonsiliasi._terakhir_dicek), REKON_BATCH * (putaran + 1))
+        self.assertEqual(sorted(rekonsiliasi._terakhir_dicek), sorted(r[0] for r in self.db_pending))
+        self.dicek.clear()
+        rekonsiliasi._rekon_db(1000.0)
+        self.assertEqual(self.dicek, [])  # semua baru saja dicek
+        self.assertEqual(self.events, [])
+
+    def test_kedaluwarsa_status_tidak_terbaca_tidak_direfund(self):
+        self.db_kedaluwarsa = [("db_lama",)]
+        self.log = [{"refid": "log_lama", "dibuat": time.time() - 72 * 3600, "harga": 1000}]
+        self.jawaban = {"db_lama": GAGAL_KONEKSI, "log_lama": {"status": "error", "message": "x"}}
+        self.assertEqual(rekonsiliasi._rekon_db(1000.0), 0)
+        self.assertEqual(rekonsiliasi._rekon_log(1000.0), 0)
+        self.assertEqual(self.events, [])
+        self.assertEqual(self.refund, [])
+
+    def test_kedaluwarsa_masih_pending_ditandai_cek_manual(self):
+        self.db_kedaluwarsa = [("db_lama",)]
+        self.log = [{"refid": "log_lama", "dibuat": time.time() - 72 * 3600, "harga": 1000}]
+        self.assertEqual(rekonsiliasi._rekon_db(1000.0), 0)
+        self.assertEqual(rekonsiliasi._rekon_log(1000.0), 0)
+        self.assertEqual(self._status_db(), {"db_lama": db.STATUS_CEK_MANUAL})
+        self.assertEqual(self.refund, [])
+        self.assertEqual(rekonsiliasi.notifikasi.kirim_nanti.call_count, 2)
+
+    def test_log_tanpa_dibuat_tidak_direfund(self):
+        self.log = [{"refid": f"lama{i}", "harga": 1000} for i in range(3)]
+        self.jawaban = {"lama0": GAGAL_KONEKSI, "lama1": TIDAK_ADA}  # lama2: PENDING
+        self.assertEqual(rekonsiliasi._rekon_log(1000.0), 0)
+        self.assertEqual(self.refund, [])
+
+    def test_status_final_dan_tidak_ditemukan(self):
+        self.db_pending = [("db_gagal",), ("db_tidak_ada",)]
+        self.db_kedaluwarsa = [("db_lama_tidak_ada",)]
+        self.log = [{"refid": "log_gagal", "dibuat": time.time() - 3600, "harga": 1000}]
+        self.jawaban = {"db_gagal": GAGAL, "db_tidak_ada": TIDAK_ADA,
+                        "db_lama_tidak_ada": TIDAK_ADA, "log_gagal": GAGAL}
+        self.assertEqual(rekonsiliasi._rekon_db(1000.0), 2)
+        self.assertEqual(self._status_db(), {"db_gagal": "gagal", "db_lama_tidak_ada": "GAGAL"})
+        self.assertEqual(rekonsiliasi._rekon_log(1000.0), 1)
+        self.assertEqual(self.refund, ["refund:log_gagal"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+import sys
+import time
+import subprocess
+import requests
+from config import WEBHOOK_PORT, TELEGRAM_WEBHOOK_SECRET, WEBHOOK_CERT, WEBHOOK_KEY
+
+# Harness lokal untuk mode webhook:
+#   python tes_webhook.py sertifikat  -> buat sertifikat self-signed (isi WEBHOOK_CERT/WEBHOOK_KEY di config.json)
+#   python tes_webhook.py kirim       -> kirim contoh update Telegram & callback provider ke bot yang sedang jalan
+
+def buat_sertifikat(cert="webhook_cert.pem", key="webhook_key.pem", cn="localhost"):
+    subprocess.run([
+        "openssl", "req", "-newkey", "rsa:2048", "-sha256", "-nodes", "-x509", "-days", "365",
+        "-keyout", key, "-out", cert, "-subj", f"/CN={cn}",
+    ], check=True)
+    print(f"Sertifikat dibuat: {cert} / {key}")
+
+def contoh_update():
+    now = int(time.time())
+    user = {"id": 1, "is_bot": False, "first_name": "Tes", "username": "tes"}
+    return {
+        "update_id": now,
+        "message": {
+            "message_id": 1, "date": now, "text": "/start", "from": user,
+            "chat": {"id": 1, "type": "private", "first_name": "Tes"},
+            "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+        },
+    }
+
+def kirim():
+    skema = "https" if WEBHOOK_CERT and WEBHOOK_KEY else "http"
+    base = f"{skema}://127.0.0.1:{WEBHOOK_PORT}"
+    verify = WEBHOOK_CERT or True
+    t0 = time.monotonic()
+    r = requests.post(f"{base}/telegram/{TELEGRAM_WEBHOOK_SECRET}", json=contoh_update(), verify=verify, timeout=10)
+    print(f"/telegram -> {r.status_code} {r.text.strip()} ({(time.monotonic() - t0) * 1000:.0f} ms)")
+    message = "RC=00000000-0000-0000-0000-000000000000 TrxID=1 BPAL1.081234567890 Sukses tes harness"
+    t0 = time.monotonic()
+    r = requests.get(f"{base}/webhook", params={"message": message}, verify=verify, timeout=10)
+    print(f"/webhook  -> {r.status_code} {r.text.strip()} ({(time.monotonic() - t0) * 1000:.0f} ms)")
+
+if __name__ == "__main__":
+    perintah = sys.argv[1] if len(sys.argv) > 1 else "kirim"
+    if perintah == "sertifikat":
+        buat_sertifikat()
+    else:
+        kirim()
@@ -1,10 +1,13 @@
 import os
 import json
+import riwayat_log
+import db
 
 SALDO_FILE = 'saldo.json'
 RIWAYAT_FILE = 'riwayat_transaksi.json'
 HARGA_PRODUK_FILE = 'harga_produk.json'
 TOPUP_FILE = 'topup_user.json'
+BOT_SALDO_ID = 0  # akun saldo bot di tabel users (db)
 
 def load_json(filename, fallback=None):
     if os.path.exists(filename):
@@ -19,17 +22,51 @@ def save_json(filename, data):
     with open(filename, "w") as f:
         json.dump(data, f, indent=2, ensure_ascii=False)
 
+_akun_bot_siap = False
+
+def _pastikan_akun_bot():
+    # Saldo bot dipindah ke ledger di db; saldo.json lama dipakai sebagai saldo awal
+    global _akun_bot_siap
+    if not _akun_bot_siap:
+        db.buat_akun_saldo(BOT_SALDO_ID, load_json(SALDO_FILE, 500000))
+        _akun_bot_siap = True
+
 def get_saldo():
-    return load_json(SALDO_FILE, 500000)
+    _pastikan_akun_bot()
+    return db.get_saldo(BOT_SALDO_ID)
 
 def set_saldo(amount):
-    save_json(SALDO_FILE, amount)
+    # Hanya untuk koreksi manual; alur pembelian memakai hold_saldo/capture/release
+    _pastikan_akun_bot()
+    selisih = int(amount) - db.get_saldo(BOT_SALDO_ID)
+    if selisih:
+        db.tambah_saldo(BOT_SALDO_ID, selisih, jenis="koreksi")
+
+def tambah_saldo(amount, ref=""):
+    _pastikan_akun_bot()
+    return db.tambah_saldo(BOT_SALDO_ID, amount, jenis="tambah_admin", ref=ref)
+
+def hold_saldo(hold_id, amount):
+    """Tahan saldo bot untuk satu transaksi. Return saldo akhir, atau None jika tidak cukup."""
+    _pastikan_akun_bot()
+    return db.buat_hold(hold_id, BOT_SALDO_ID, amount)
+
+def capture_saldo(hold_id):
+    return db.capture_hold(hold_id)
+
+def release_saldo(hold_id):
+    """Kembalikan saldo yang ditahan (transaksi gagal). Return saldo akhir atau None."""
+    return db.release_hold(hold_id)
 
 def load_riwayat():
-    return load_json(RIWAYAT_FILE, {})
+    return riwayat_log.semua()
 
 def save_riwayat(riwayat):
-    save_json(RIWAYAT_FILE, riwayat)
+    # Riwayat disimpan di log append-only; hanya transaksi yang berubah yang ditulis
+    lama = riwayat_log.semua()
+    for refid, data in riwayat.items():
+        if lama.get(refid) != data:
+            riwayat_log.tambah(refid, data)
 
 def load_harga_produk():
     return load_json(HARGA_PRODUK_FILE, {})
@@ -1,27 +1,197 @@
 from flask import Flask, request, jsonify
-import re
+import hmac
+import time
+import queue
 import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
 import db
-from telegram import ParseMode
-from config import get_config
+import notifikasi
+from callback_parser import parse_callback, CallbackTidakValid
+from telegram import ParseMode, Update
+from config import TELEGRAM_WEBHOOK_SECRET, CALLBACK_BATCH_WINDOW, CALLBACK_BATCH_MAX
 
 app = Flask(__name__)
-cfg = get_config()
-
-# Regex sesuai dokumentasi provider
-RX = re.compile(
-    r'RC=(?P<reffid>[a-f0-9-]+)\s+TrxID=(?P<trxid>\d+)\s+'
-    r'(?P<produk>[A-Z0-9]+)\.(?P<tujuan>\d+)\s+'
-    r'(?P<status_text>[A-Za-z]+)\s*'
-    r'(?P<keterangan>.+?)'
-    r'(?:\s+Saldo[\s\S]*?)?'
-    r'(?:\bresult=(?P<status_code>\d+))?\s*>?$',
-    re.I | re.DOTALL
-)
 
 # updater harus di-set dari main.py (setelah Updater dibuat)
 updater = None
 
+class _SetTerbatas:
+    """Set kunci event terakhir (maks `maxsize`), untuk menolak callback duplikat dalam O(1)."""
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def ada(self, kunci):
+        with self._lock:
+            return kunci in self._data
+
+    def tambah(self, kunci):
+        with self._lock:
+            self._data[kunci] = None
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+_event_terlihat = _SetTerbatas()
+
+def teks_notif_status(riwayat, status_text, keterangan, saldo_akhir):
+    """Teks notifikasi hasil satu transaksi (sukses / gagal + refund), None jika status bukan final."""
+    (db_reffid, user_id, produk_kode, tujuan, harga, waktu, current_status, db_keterangan) = riwayat
+    if "sukses" in status_text.lower():
+        return (
+            f"✅ <b>TRANSAKSI SUKSES</b>\n\n"
+            f"Produk [{produk_kode}] ke {tujuan} BERHASIL.\n"
+            f"Keterangan: {keterangan}\n"
+            f"Saldo akhir: Rp {saldo_akhir:,.0f}"
+        )
+    if db.status_refund(status_text):
+        return (
+            f"❌ <b>TRANSAKSI GAGAL</b>\n\n"
+            f"Produk [{produk_kode}] ke {tujuan} GAGAL.\n"
+            f"Keterangan: {keterangan}\n"
+            f"Saldo kembali: Rp {harga:,.0f}\nSaldo sekarang: Rp {saldo_akhir:,.0f}"
+        )
+    return None
+
+MAKS_PANJANG_NOTIF = 3500  # batas aman di bawah 4096 karakter pesan Telegram
+
+def teks_notif_gabungan(daftar):
+    """Beberapa transaksi user selesai dalam satu batch: satu ringkasan (dipecah jika terlalu panjang)."""
+    baris = []
+    for riwayat, status_text, keterangan, _ in daftar:
+        produk_kode, tujuan, harga = riwayat[2], riwayat[3], riwayat[4]
+        if "sukses" in status_text.lower():
+            baris.append(f"✅ [{produk_kode}] ke {tujuan} BERHASIL - {keterangan}")
+        else:
+            baris.append(f"❌ [{produk_kode}] ke {tujuan} GAGAL - {keterangan} (kembali Rp {harga:,.0f})")
+    saldo_akhir = daftar[-1][3]
+    penutup = f"\n\nSaldo sekarang: Rp {saldo_akhir:,.0f}"
+
+    pesan, bagian, panjang = [], [], 0
+    for b in baris:
+        if bagian and panjang + len(b) > MAKS_PANJANG_NOTIF:
+            pesan.append("\n".join(bagian))
+            bagian, panjang = [], 0
+        if not bagian:
+            judul = f"📋 <b>UPDATE {len(daftar)} TRANSAKSI</b>\n"
+            bagian.append(judul)
+            panjang = len(judul)
+        bagian.append(b)
+        panjang += len(b) + 1
+    pesan.append("\n".join(bagian) + penutup)
+    return pesan
+
+def _susun_notif(events, semua_hasil):
+    """Notifikasi [(chat_id, teks, parse_mode), ...] untuk event yang diupdate, digabung per user."""
+    per_user = OrderedDict()
+    for (reffid, trxid, status_text, keterangan), (hasil, riwayat, saldo_akhir) in zip(events, semua_hasil):
+        if hasil == "diupdate" and ("sukses" in status_text.lower() or db.status_refund(status_text)):
+            per_user.setdefault(riwayat[1], []).append((riwayat, status_text, keterangan, saldo_akhir))
+    notif = []
+    for user_id, daftar in per_user.items():
+        if len(daftar) == 1:
+            notif.append((user_id, teks_notif_status(*daftar[0]), ParseMode.HTML))
+        else:
+            notif.extend((user_id, teks, ParseMode.HTML) for teks in teks_notif_gabungan(daftar))
+    return notif
+
+def _terapkan(events):
+    # Notifikasi ikut ditulis ke notif_queue di transaksi DB yang sama (outbox),
+    # jadi status, refund dan notifikasinya tersimpan bersama atau tidak sama sekali.
+    return db.terapkan_status_batch(events, susun_notif=lambda hasil: _susun_notif(events, hasil))
+
+def proses_batch(events):
+    """
+    Terapkan event callback (reffid, trxid, status_text, keterangan) dalam satu transaksi DB,
+    termasuk notifikasinya (digabung per user) di antrian notifikasi.
+    Return list (hasil, riwayat, saldo_akhir) sesuai urutan `events`.
+    """
+    try:
+        semua_hasil = _terapkan(events)
+    except Exception:
+        # Satu event bermasalah tidak boleh menggagalkan event lain di batch yang sama
+        logging.exception("[WEBHOOK] Batch DB gagal, diproses satu per satu")
+        semua_hasil = []
+        for event in events:
+            try:
+                semua_hasil.extend(_terapkan([event]))
+            except Exception:
+                logging.exception(f"[WEBHOOK] Gagal menerapkan status RefID {event[0]}")
+                semua_hasil.append(("error", None, None))
+
+    for (reffid, trxid, status_text, keterangan), (hasil, riwayat, saldo_akhir) in zip(events, semua_hasil):
+        if hasil in ("duplikat", "sudah_final", "diupdate"):
+            _event_terlihat.tambah((reffid, trxid, status_text))
+    notifikasi.bangunkan()
+    return semua_hasil
+
+class _PengumpulCallback:
+    """
+    Micro-batch callback provider: callback yang masuk dalam `jendela` detik
+    (maks `maks` event) diproses sekaligus oleh satu thread lewat proses_batch.
+    """
+
+    def __init__(self, jendela, maks):
+        self.jendela = jendela
+        self.maks = maks
+        self._antrian = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def ajukan(self, event):
+        """Masukkan event ke batch berikutnya. Return Future berisi (hasil, riwayat, saldo_akhir)."""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="webhook-batch", daemon=True)
+                self._thread.start()
+        future = Future()
+        self._antrian.put((event, future))
+        return future
+
+    def _kumpulkan(self):
+        batch = [self._antrian.get()]
+        batas = time.monotonic() + self.jendela
+        while len(batch) < self.maks:
+            sisa = batas - time.monotonic()
+            if sisa <= 0:
+                break
+            try:
+                batch.append(self._antrian.get(timeout=sisa))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._kumpulkan()
+            try:
+                semua_hasil = proses_batch([event for event, _ in batch])
+            except Exception as e:
+                logging.exception("[WEBHOOK] Batch callback gagal")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), hasil in zip(batch, semua_hasil):
+                future.set_result(hasil)
+
+_pengumpul = _PengumpulCallback(CALLBACK_BATCH_WINDOW, CALLBACK_BATCH_MAX)
+
+@app.route('/telegram/<secret>', methods=['POST'])
+def telegram_webhook(secret):
+    """Update dari Telegram (mode webhook): langsung dimasukkan ke antrian dispatcher."""
+    if not TELEGRAM_WEBHOOK_SECRET or not hmac.compare_digest(secret, TELEGRAM_WEBHOOK_SECRET):
+        return jsonify({'ok': False}), 404
+    if updater is None:
+        return jsonify({'ok': False, 'error': 'bot belum siap'}), 503
+    data = request.get_json(force=True, silent=True)
+    if not data:
+        return jsonify({'ok': False, 'error': 'update kosong'}), 400
+    updater.update_queue.put(Update.de_json(data, updater.bot))
+    return jsonify({'ok': True}), 200
+
 @app.route('/webhook', methods=['GET', 'POST'])
 def webhook_handler():
     try:
@@ -31,61 +201,83 @@ def webhook_handler():
             return jsonify({'ok': False, 'error': 'message kosong'}), 400
 
         logging.info(f"[WEBHOOK] RAW: {message}")
-        match = RX.match(message)
-        if not match:
-            logging.warning(f"[WEBHOOK] Format tidak dikenali -> {message}")
-            return jsonify({'ok': False, 'error': 'format tidak dikenali'}), 200
+        try:
+            groups = parse_callback(message)
+        except CallbackTidakValid as e:
+            logging.warning(f"[WEBHOOK] Format tidak dikenali ({e.alasan}) -> {message[:500]}")
+            return jsonify({'ok': False, 'error': 'format tidak dikenali', 'alasan': e.alasan}), 200
 
-        groups = match.groupdict()
-        reffid = groups.get('reffid')
-        status_text = groups.get('status_text', '').lower()
-        keterangan = groups.get('keterangan', '').strip()
+        reffid = groups['reffid']
+        trxid = groups['trxid']
+        status_text = groups['status_text'].lower()
+        keterangan = groups['keterangan']
 
         logging.info(f"Webhook ter-parse -> RefID: {reffid}, Status: {status_text}")
 
-        riwayat = db.get_riwayat_by_refid(reffid)
-        if not riwayat:
+        # Callback yang sama (reffid + trxid + status) baru saja diproses: tolak tanpa menyentuh DB
+        kunci = (reffid, trxid, status_text)
+        if _event_terlihat.ada(kunci):
+            logging.info(f"RefID {reffid} callback duplikat. Diabaikan.")
+            return jsonify({'ok': True, 'message': 'Callback duplikat'}), 200
+
+        # Diterapkan bersama callback lain yang masuk di jendela yang sama (satu transaksi DB)
+        hasil, riwayat, saldo_akhir = _pengumpul.ajukan((reffid, trxid, status_text, keterangan)).result(timeout=30)
+        if hasil == "tidak_ditemukan":
             logging.warning(f"RefID {reffid} tidak ditemukan di database.")
             return jsonify({'ok': False, 'error': 'transaksi tidak ditemukan'}), 200
-
-        (db_reffid, user_id, produk_kode, tujuan, harga, waktu, current_status, db_keterangan) = riwayat
-
-        # Hindari update ganda (sudah sukses/gagal)
-        if any(s in current_status.lower() for s in ("sukses", "gagal", "batal")):
+        if hasil == "error":
+            return jsonify({'ok': False, 'error': 'internal_error'}), 500
+        if hasil == "duplikat":
+            logging.info(f"RefID {reffid} callback duplikat. Diabaikan.")
+            return jsonify({'ok': True, 'message': 'Callback duplikat'}), 200
+        if hasil == "sudah_final":
             logging.info(f"RefID {reffid} sudah status final. Update diabaikan.")
             return jsonify({'ok': True, 'message': 'Status sudah final'}), 200
 
-        # Update status transaksi di DB
-        db.update_riwayat_status(reffid, status_text.upper(), keterangan)
+        return jsonify({'ok': True, 'message': 'Webhook diterima'}), 200
+
+    except Exception as e:
+        logging.exception("[WEBHOOK][ERROR]")
+        return jsonify({'ok': False, 'error': 'internal_error'}), 500
+
+@app.route('/webhook/batch', methods=['POST'])
+def webhook_batch_handler():
+    """
+    Banyak callback sekaligus: JSON {"messages": [...]} atau teks satu pesan per baris.
+    Diterapkan per CALLBACK_BATCH_MAX pesan dalam satu transaksi DB.
+    """
+    try:
+        data = request.get_json(force=True, silent=True)
+        if isinstance(data, dict) and isinstance(data.get('messages'), list):
+            messages = [str(m) for m in data['messages']]
+        else:
+            messages = [b for b in request.get_data(as_text=True).splitlines() if b.strip()]
+        if not messages:
+            return jsonify({'ok': False, 'error': 'message kosong'}), 400
 
-        # Beri notifikasi user
-        if updater:
+        hasil_per_pesan = [None] * len(messages)
+        events, posisi = [], []
+        for i, message in enumerate(messages):
             try:
-                bot = updater.bot
-                if "sukses" in status_text:
-                    bot.send_message(
-                        user_id,
-                        f"✅ <b>TRANSAKSI SUKSES</b>\n\n"
-                        f"Produk [{produk_kode}] ke {tujuan} BERHASIL.\n"
-                        f"Keterangan: {keterangan}\n"
-                        f"Saldo akhir: Rp {db.get_saldo(user_id):,.0f}",
-                        parse_mode=ParseMode.HTML
-                    )
-                elif "gagal" in status_text or "batal" in status_text:
-                    db.tambah_saldo(user_id, harga)
-                    bot.send_message(
-                        user_id,
-                        f"❌ <b>TRANSAKSI GAGAL</b>\n\n"
-                        f"Produk [{produk_kode}] ke {tujuan} GAGAL.\n"
-                        f"Keterangan: {keterangan}\n"
-                        f"Saldo kembali: Rp {harga:,.0f}\nSaldo sekarang: Rp {db.get_saldo(user_id):,.0f}",
-                        parse_mode=ParseMode.HTML
-                    )
-                else:
-                    pass # Status non-final, abaikan
-            except Exception as e:
-                logging.error(f"Gagal kirim notif ke user {user_id}: {e}")
-        return jsonify({'ok': True, 'message': 'Webhook diterima'}), 200
+                groups = parse_callback(message)
+            except CallbackTidakValid as e:
+                hasil_per_pesan[i] = {'ok': False, 'error': 'format tidak dikenali', 'alasan': e.alasan}
+                continue
+            event = (groups['reffid'], groups['trxid'], groups['status_text'].lower(), groups['keterangan'])
+            if _event_terlihat.ada(event[:3]):
+                hasil_per_pesan[i] = {'ok': True, 'reffid': event[0], 'hasil': 'duplikat'}
+                continue
+            events.append(event)
+            posisi.append(i)
+
+        for awal in range(0, len(events), CALLBACK_BATCH_MAX):
+            potongan = events[awal:awal + CALLBACK_BATCH_MAX]
+            for i, event, (hasil, _, _) in zip(posisi[awal:], potongan, proses_batch(potongan)):
+                hasil_per_pesan[i] = {'ok': hasil not in ("tidak_ditemukan", "error"),
+                                      'reffid': event[0], 'hasil': hasil}
+
+        logging.info(f"[WEBHOOK] Batch {len(messages)} pesan, {len(events)} diterapkan")
+        return jsonify({'ok': True, 'hasil': hasil_per_pesan}), 200
 
     except Exception as e:
         logging.exception("[WEBHOOK][ERROR]")